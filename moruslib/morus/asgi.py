@@ -0,0 +1,285 @@
+"""
+Minimal helpers for ASGI services, shaped like their Flask counterparts:
+blueprints of routes with a url_prefix, an app factory with a heartbeat
+index, and a synchronous test client.
+
+Handlers are coroutines taking a Request & returning a Response (or any
+JSON-serializable value, which is wrapped in a 200 Response).  Serve the
+app with any ASGI server, eg `uvicorn module:app`.
+
+Request bodies larger than the app's max_body_size are refused with a 413
+before being read in full.
+"""
+import asyncio
+import decimal
+import json
+import logging
+import urllib.parse
+import uuid
+
+
+log = logging.getLogger(__name__)
+
+# default ASGIApp max_body_size, in bytes
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+def _json_default(obj):
+    if isinstance(obj, (uuid.UUID, decimal.Decimal)):
+        return str(obj)
+    # asyncpg returns its own UUID type
+    if type(obj).__name__ == "UUID":
+        return str(obj)
+    raise TypeError("{} is not JSON serializable".format(type(obj)))
+
+
+def dumps(obj):
+    return json.dumps(obj, default=_json_default, separators=(",", ":"))
+
+
+class MultiDict(dict):
+    """the first value of each key, as werkzeug's MultiDict; getlist()
+    returns all of them, in order"""
+
+    def __init__(self, pairs=()):
+        self._lists = {}
+        for (key, value) in pairs:
+            self._lists.setdefault(key, []).append(value)
+        super(MultiDict, self).__init__((key, values[0]) for (key, values) in self._lists.items())
+
+    def getlist(self, key):
+        return list(self._lists.get(key, []))
+
+
+class Request(object):
+
+    def __init__(self, scope, body=b""):
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.body = body
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1")
+                        for (k, v) in scope.get("headers", [])}
+        query = scope.get("query_string", b"").decode("latin-1")
+        self.args = MultiDict(urllib.parse.parse_qsl(query))
+
+    @property
+    def form(self):
+        if "application/x-www-form-urlencoded" not in self.headers.get("content-type", ""):
+            return MultiDict()
+        return MultiDict(urllib.parse.parse_qsl(self.body.decode("utf8")))
+
+    def get_json(self):
+        try:
+            return json.loads(self.body.decode("utf8"))
+        except ValueError:
+            return None
+
+
+class Response(object):
+
+    def __init__(self, body=b"", status=200, content_type="application/json"):
+        self.body = body if isinstance(body, bytes) else body.encode("utf8")
+        self.status = status
+        self.headers = [(b"content-type", content_type.encode("latin-1"))]
+
+    async def send(self, send):
+        await send({"type": "http.response.start", "status": self.status,
+                    "headers": self.headers})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+def jsonify(obj, status=200):
+    return Response(dumps(obj) + "\n", status=status)
+
+
+class Blueprint(object):
+
+    def __init__(self, name, import_name, url_prefix=""):
+        self.name = name
+        self.import_name = import_name
+        self.url_prefix = url_prefix
+        self.routes = []
+
+    def route(self, rule, methods=("GET",)):
+        def decorator(handler):
+            self.routes.append((self.url_prefix + rule, tuple(methods), handler))
+            return handler
+        return decorator
+
+
+class ASGIApp(object):
+    """ASGI application; register_blueprint() to add routes, and append
+    coroutines to on_startup/on_shutdown to manage resources (eg db pools)
+    over the lifespan of the server
+
+    max_body_size bounds the request bodies read, None for no limit"""
+
+    def __init__(self, import_name, max_body_size=MAX_BODY_SIZE):
+        self.import_name = import_name
+        self.max_body_size = max_body_size
+        self.routes = {}
+        self.on_startup = []
+        self.on_shutdown = []
+
+        async def index(request):
+            return {"{}-server".format(import_name): "ok"}
+        self.routes["/"] = (("GET",), index)
+
+    def register_blueprint(self, blueprint):
+        for (rule, methods, handler) in blueprint.routes:
+            self.routes[rule] = (methods, handler)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                for func in self.on_startup:
+                    await func()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for func in self.on_shutdown:
+                    await func()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, request, receive):
+        """the request body, or None if it exceeds max_body_size"""
+        limit = self.max_body_size
+        try:
+            length = int(request.headers.get("content-length", 0))
+        except ValueError:
+            length = 0
+        if limit is not None and length > limit:
+            return None
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if limit is not None and size > limit:
+                return None
+            more_body = message.get("more_body", False)
+        return b"".join(chunks)
+
+    async def _http(self, scope, receive, send):
+        request = Request(scope)
+        request.body = await self._read_body(request, receive)
+
+        route = self.routes.get(request.path)
+        if request.body is None:
+            response = jsonify({"status": "Request Entity Too Large"}, status=413)
+        elif route is None:
+            response = jsonify({"status": "Not Found"}, status=404)
+        elif request.method not in route[0]:
+            response = jsonify({"status": "Method Not Allowed"}, status=405)
+        else:
+            try:
+                response = await route[1](request)
+                if not isinstance(response, Response):
+                    response = jsonify(response)
+            except Exception:
+                log.exception("%s %s", request.method, request.path)
+                response = jsonify({"status": "Internal Server Error"}, status=500)
+        await response.send(send)
+
+
+class TestClient(object):
+    """synchronous client calling an ASGI app in-process, as Flask's
+    test_client does; use as a contextmanager to run lifespan events
+
+    >>> app = ASGIApp("doctest")
+    >>> with TestClient(app) as client:
+    ...     client.get("/").json()
+    {'doctest-server': 'ok'}
+    """
+    __test__ = False
+
+    def __init__(self, app):
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        self._lifespan = None
+        self._lifespan_queue = None
+
+    def __enter__(self):
+        self._lifespan_queue = asyncio.Queue()
+        sent = []
+
+        async def receive():
+            return await self._lifespan_queue.get()
+
+        async def send(message):
+            sent.append(message)
+
+        self._lifespan = self.loop.create_task(self.app({"type": "lifespan"}, receive, send))
+        self._lifespan_queue.put_nowait({"type": "lifespan.startup"})
+        self.loop.run_until_complete(self._wait_for(sent, "lifespan.startup.complete"))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lifespan_queue.put_nowait({"type": "lifespan.shutdown"})
+        self.loop.run_until_complete(self._lifespan)
+        self.loop.close()
+
+    async def _wait_for(self, sent, message_type):
+        while not any(m["type"] == message_type for m in sent):
+            if self._lifespan.done():
+                self._lifespan.result()
+            await asyncio.sleep(0)
+
+    def request(self, method, path, query=None, data=None, json_body=None, headers=None):
+        headers = dict(headers or {})
+        body = b""
+        if data is not None:
+            body = urllib.parse.urlencode(data, doseq=True).encode("utf8")
+            headers.setdefault("content-type", "application/x-www-form-urlencoded")
+        elif json_body is not None:
+            body = dumps(json_body).encode("utf8")
+            headers.setdefault("content-type", "application/json")
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "query_string": urllib.parse.urlencode(query or {}, doseq=True).encode("latin-1"),
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                        for (k, v) in headers.items()],
+        }
+        messages = [{"type": "http.request", "body": body}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(self.app(scope, receive, send))
+        return TestResponse(sent)
+
+    def get(self, path, query=None, **kwargs):
+        return self.request("GET", path, query=query, **kwargs)
+
+    def post(self, path, data=None, json=None, **kwargs):
+        return self.request("POST", path, data=data, json_body=json, **kwargs)
+
+
+class TestResponse(object):
+    __test__ = False
+
+    def __init__(self, messages):
+        start = messages[0]
+        self.status_code = start["status"]
+        self.headers = {k.decode("latin-1"): v.decode("latin-1")
+                        for (k, v) in start["headers"]}
+        self.data = b"".join(m.get("body", b"") for m in messages[1:])
+
+    def json(self):
+        return json.loads(self.data.decode("utf8"))
@@ -0,0 +1,171 @@
+"""
+Latency benchmarks of library functions, saved as JSON & compared against a
+baseline to catch regressions
+
+    >>> stats = timed(lambda: None, iterations=100, warmup=10)
+    >>> sorted(stats)
+    ['iterations', 'max', 'mean', 'min', 'p50', 'p95', 'p99', 'queries']
+
+Times are in seconds.  `queries` is the number of SQL statements executed per
+call, counted by a QueryCounter on every SQLAlchemy Engine; a change in it
+is as much a regression as a slower p50.
+"""
+import datetime
+import json
+import os
+import platform
+import threading
+import time
+
+
+# statistics of each benchmark compared by compare()
+COMPARED = ("p50", "p95", "p99")
+
+
+def percentile(samples, pct):
+    """pct percentile of sorted samples, by linear interpolation
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    >>> percentile([1, 2, 3, 4], 100)
+    4.0
+    """
+    if not samples:
+        raise ValueError("no samples")
+    rank = (len(samples) - 1) * pct / 100.0
+    lo = int(rank)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (rank - lo)
+
+
+class QueryCounter(object):
+    """counts statements executed via any SQLAlchemy Engine, in this thread,
+    while a `with counter:` block is active"""
+
+    def __init__(self):
+        self.count = 0
+        self._thread = None
+        self._installed = False
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context,
+                               executemany):
+        if self._thread == threading.get_ident():
+            self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        if not self._installed:
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            self._installed = True
+        self._thread = threading.get_ident()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._thread = None
+
+    def remove(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        if self._installed:
+            event.remove(Engine, "before_cursor_execute", self._before_cursor_execute)
+            self._installed = False
+
+
+def timed(func, iterations=1000, warmup=100, counter=None):
+    """call func() warmup times, then time each of iterations calls
+
+    returns dict of latency statistics & queries per call"""
+    for i in range(warmup):
+        func()
+    counter = counter or QueryCounter()
+    counter.count = 0
+    samples = []
+    with counter:
+        for i in range(iterations):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "min": samples[0],
+        "max": samples[-1],
+        "mean": sum(samples) / len(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "queries": counter.count / float(iterations),
+    }
+
+
+def environment():
+    """where results were recorded, saved alongside them"""
+    return {
+        "recorded": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def save_results(path, results):
+    """write results, {scale: {benchmark: stats}}, to path as JSON"""
+    doc = {"environment": environment(), "results": results}
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def compare(results, baseline, tolerance=0.2, noise=0.0002):
+    """regressions of results against baseline, each {scale: {benchmark: stats}}
+
+    a benchmark regressed if any of COMPARED is more than tolerance (a
+    fraction) and noise (seconds, so microsecond timings do not flap) slower
+    than in the baseline, or it executes more queries per call; benchmarks
+    missing from either side are not compared
+
+    >>> base = {"1000": {"f": {"p50": 1.0, "p95": 2.0, "p99": 3.0, "queries": 1}}}
+    >>> now = {"1000": {"f": {"p50": 1.1, "p95": 2.6, "p99": 3.0, "queries": 2}}}
+    >>> for line in compare(now, base): print(line)
+    1000 f: p95 2600.0ms > 2000.0ms +30%
+    1000 f: queries 2 > 1 per call
+
+    returns a list of descriptions, empty if nothing regressed"""
+    ret = []
+    for (scale, benchmarks) in sorted(results.items()):
+        for (name, stats) in sorted(benchmarks.items()):
+            base = baseline.get(scale, {}).get(name)
+            if base is None:
+                continue
+            for key in COMPARED:
+                if key in base and stats[key] > max(base[key] * (1 + tolerance),
+                                                    base[key] + noise):
+                    ret.append("{} {}: {} {:.1f}ms > {:.1f}ms +{:.0%}".format(
+                        scale, name, key, stats[key] * 1000, base[key] * 1000,
+                        stats[key] / base[key] - 1))
+            if "queries" in base and stats["queries"] > base["queries"]:
+                ret.append("{} {}: queries {:g} > {:g} per call".format(
+                    scale, name, stats["queries"], base["queries"]))
+    return ret
+
+
+def report(results):
+    """results as a table, one line per benchmark"""
+    lines = ["{:>10} {:55} {:>9} {:>9} {:>9} {:>7}".format(
+        "scale", "benchmark", "p50 ms", "p95 ms", "p99 ms", "queries")]
+    for (scale, benchmarks) in sorted(results.items(), key=lambda kv: int(kv[0])):
+        for (name, stats) in sorted(benchmarks.items()):
+            lines.append("{:>10} {:55} {:9.3f} {:9.3f} {:9.3f} {:7g}".format(
+                scale, name, stats["p50"] * 1000, stats["p95"] * 1000,
+                stats["p99"] * 1000, stats["queries"]))
+    return "\n".join(lines)
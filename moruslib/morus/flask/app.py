@@ -1,11 +1,10 @@
 import argparse
 import logging
 import os
-import tempfile
 
 from flask import Flask, jsonify
-from werkzeug.middleware.proxy_fix import ProxyFix
-from werkzeug.middleware.profiler import ProfilerMiddleware
+
+from morus.logging import configure_logging
 
 
 log = logging.getLogger(__name__)
@@ -15,13 +14,30 @@ ConfiguredAppArgParser = argparse.ArgumentParser(description="Argument parser fo
 ConfiguredAppArgParser.add_argument("--config", help="config module (as python path)")
 ConfiguredAppArgParser.add_argument("--port", type=int, required=True, help="port number")
 ConfiguredAppArgParser.add_argument("--debug", action="store_true", default=False, help="put app into debug mode")
+ConfiguredAppArgParser.add_argument("--log-level", help="root log level, overrides LOG_LEVEL config")
 # create key+crt: https://devcenter.heroku.com/articles/ssl-certificate-self
 ConfiguredAppArgParser.add_argument("--https", action="store_true", default=False, help="listen via https")
 ConfiguredAppArgParser.add_argument("--ssl-key", default="")
 ConfiguredAppArgParser.add_argument("--ssl-crt", default="")
+# prefork serving, see morus.flask.serve
+ConfiguredAppArgParser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+ConfiguredAppArgParser.add_argument("--workers", type=int, default=None,
+                                    help="worker processes (default 1 per cpu, 0 for none)")
+ConfiguredAppArgParser.add_argument("--threads", type=int, default=4,
+                                    help="concurrent requests per worker")
+ConfiguredAppArgParser.add_argument("--max-requests", type=int, default=0,
+                                    help="recycle workers after this many requests")
+ConfiguredAppArgParser.add_argument("--max-requests-jitter", type=int, default=0,
+                                    help="up to this many more, so workers recycle apart")
+ConfiguredAppArgParser.add_argument("--max-rss-mb", type=int, default=0,
+                                    help="recycle workers whose RSS exceeds this")
+ConfiguredAppArgParser.add_argument("--graceful-timeout", type=float, default=30.0,
+                                    help="seconds to finish requests in flight on shutdown")
 # options to enable Flask extensions
 ConfiguredAppArgParser.add_argument("--profile", action="store_true", default=False)
 ConfiguredAppArgParser.add_argument("--proxy-fix", action="store_true", default=False)
+ConfiguredAppArgParser.add_argument("--metrics", action="store_true", default=False,
+                                    help="serve request & db metrics at /metrics")
 # add support for Flask() kwargs
 ConfiguredAppArgParser.add_argument("--static-folder", default="")
 ConfiguredAppArgParser.add_argument("--static-url-path", default="")
@@ -31,13 +47,13 @@ ConfiguredAppArgParser.add_argument("--template-folder", default="")
 
 def parse_args(parser=ConfiguredAppArgParser):
     (known_args, unknown_args) = parser.parse_known_args()
-    log.debug("parse_args: {} known_args: {}".format(parser, known_args))
-    log.debug("parse_args: {} ignoring unknown_args: {}".format(parser, unknown_args))
+    log.debug("parse_args: %s known_args: %s", parser, known_args)
+    log.debug("parse_args: %s ignoring unknown_args: %s", parser, unknown_args)
     return known_args
 
 
 def configured_app(import_name, debug=False, config_module=None, profile=False,
-                   proxy_fix=False, **flask_kwargs):
+                   proxy_fix=False, log_level=None, metrics=False, **flask_kwargs):
     """instantiate a Flask app
 
     for details see https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask
@@ -45,8 +61,22 @@ def configured_app(import_name, debug=False, config_module=None, profile=False,
      * import_name: the name of your app package
      * debug: put flask app into debug mode
      * config_module: python module path to load config from
-     * profile: bool. activate flask.contrib.profiler.ProfilerMiddleware
-     * proxy_fix: bool. activate werkzeug.contrib.fixers.ProxyFix
+     * profile: bool. profile sampled requests, see morus.flask.profiler
+     * proxy_fix: bool. activate werkzeug.middleware.proxy_fix.ProxyFix
+     * log_level: configure logging at this root level (overrides LOG_LEVEL)
+     * metrics: bool. record request & db metrics, served at /metrics
+
+    Config values supported:
+
+    LOG_LEVEL if set (or log_level, or debug), logging is configured via
+    morus.logging.configure_logging(), with per-logger LOG_LEVELS (dict) and
+    LOG_DEBUG_SAMPLE_EVERY; otherwise logging is left as it is
+
+    METRICS_ENABLED same as metrics=True; METRICS_MULTIPROCESS_DIR to sum
+    metrics over all worker processes, see morus.flask.metrics
+
+    Optional middleware is only imported when enabled, to keep cold start
+    (see `setup.py importtime`) to what the app uses.
 
     Environment variables supported:
 
@@ -67,11 +97,26 @@ def configured_app(import_name, debug=False, config_module=None, profile=False,
         # do not fail silently if configured file cannot be loaded
         app.config.from_envvar("FLASKAPP_CONFIG", silent=False)
 
+    log_level = log_level or app.config.get("LOG_LEVEL") or ("DEBUG" if debug else None)
+    if log_level:
+        configure_logging(level=log_level, levels=app.config.get("LOG_LEVELS"),
+                          debug_sample_every=app.config.get("LOG_DEBUG_SAMPLE_EVERY", 1))
+
+    if proxy_fix:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+
+        app.wsgi_app = ProxyFix(app.wsgi_app)
+
     # enable profiling?
     if profile:
-        pstat_dir = tempfile.mkdtemp()
-        log.debug("PROFILER writing pstat files to {}".format(pstat_dir))
-        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, profile_dir=pstat_dir)
+        from morus.flask.profiler import install_profiler
+
+        install_profiler(app)
+
+    if metrics or app.config.get("METRICS_ENABLED"):
+        from morus.flask.metrics import install_metrics
+
+        install_metrics(app, multiprocess_dir=app.config.get("METRICS_MULTIPROCESS_DIR"))
 
     @app.route('/')
     def index():
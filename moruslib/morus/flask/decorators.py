@@ -1,7 +1,8 @@
 
 import functools
+import hashlib
 
-from flask import current_app, redirect, request
+from flask import abort, current_app, make_response, redirect, request
 
 
 def require_https(endpoint):
@@ -24,3 +25,54 @@ def require_https(endpoint):
     return require_https_wrapper
 
 
+
+def require_token():
+    """abort with a 403 unless the request's PROFILE_HEADER header (default
+    X-Profile) equals PROFILE_TOKEN, when that is set: the check guarding
+    the profiler's reports, eg as the before_request of an admin Blueprint"""
+    token = current_app.config.get("PROFILE_TOKEN")
+    header = current_app.config.get("PROFILE_HEADER", "X-Profile")
+    if token and request.headers.get(header) != token:
+        abort(403)
+
+
+def etag(version_func=None):
+    """decorator adding a strong ETag to 200 responses of a GET endpoint, and
+    answering requests with a matching If-None-Match with 304 Not Modified
+
+    with version_func, the ETag is derived from the request URL and the value
+    returned by version_func(*args, **kwargs), which must change whenever
+    the resource does (eg a table version stamp); matching requests are then
+    answered without calling the endpoint at all.  Without it, the ETag is a
+    hash of the response body, saving bandwidth but not work"""
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        def etag_wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return endpoint(*args, **kwargs)
+
+            tag = None
+            if version_func:
+                version = "{}:{}".format(version_func(*args, **kwargs), request.full_path)
+                tag = hashlib.sha1(version.encode("utf8")).hexdigest()
+                if request.if_none_match.contains(tag):
+                    current_app.logger.debug("etag: {} not modified".format(tag))
+                    return _not_modified(tag)
+
+            response = make_response(endpoint(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            if tag is None:
+                tag = hashlib.sha1(response.get_data()).hexdigest()
+                if request.if_none_match.contains(tag):
+                    return _not_modified(tag)
+            response.set_etag(tag)
+            return response
+        return etag_wrapper
+    return decorator
+
+
+def _not_modified(tag):
+    response = current_app.response_class(status=304)
+    response.set_etag(tag)
+    return response
@@ -0,0 +1,117 @@
+"""
+Request & database instrumentation for Flask apps, served at /metrics
+
+install_metrics(app) records, per endpoint (the url rule, not the raw
+path), method & status code:
+
+ * http_request_duration_seconds: request latency histogram
+ * http_request_db_seconds: histogram of time spent in db queries per request
+ * db_queries_total, db_query_seconds_total: queries executed & their time
+
+Queries are timed via SQLAlchemy cursor events on every Engine, and
+attributed to the request executing them.  Each response also carries a
+`Server-Timing` header with its own app & db time.
+"""
+import os
+import time
+
+from flask import Response, g, has_request_context, request
+
+from morus.metrics import CONTENT_TYPE, Registry
+
+
+# per request db timings are kept on flask.g under this name
+_G_KEY = "_morus_metrics"
+
+_engine_events_installed = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault("morus_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("morus_query_start")
+    if starts and has_request_context():
+        timing = g.get(_G_KEY)
+        if timing is not None:
+            timing["db_seconds"] += time.perf_counter() - starts.pop()
+            timing["db_queries"] += 1
+
+
+def _handle_error(context):
+    # the failed query's start time is not popped by after_cursor_execute
+    starts = context.connection.info.get("morus_query_start") if context.connection else None
+    if starts and has_request_context():
+        starts.pop()
+
+
+def install_engine_events():
+    """time queries of every SQLAlchemy Engine, once per process"""
+    global _engine_events_installed
+    if _engine_events_installed:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    _engine_events_installed = True
+
+
+def install_metrics(app, path="/metrics", multiprocess_dir=None, buckets=None):
+    """instrument app & serve its metrics at path
+
+    multiprocess_dir: directory shared by all worker processes of the app
+    (eg under a prefork server), it should be emptied before the server
+    starts; metrics are then summed over all workers.  Each worker writes
+    its values after a request at most every METRICS_FLUSH_SECONDS, and
+    morus.flask.serve workers once more as they exit
+
+    returns the app's morus.metrics.Registry"""
+    registry = Registry(multiprocess_dir=multiprocess_dir,
+                        flush_seconds=app.config.get("METRICS_FLUSH_SECONDS", 1.0))
+    if multiprocess_dir:
+        os.makedirs(multiprocess_dir, exist_ok=True)
+    histogram_kwargs = {"buckets": buckets} if buckets else {}
+    labels = ("endpoint", "method", "status")
+    latency = registry.histogram("http_request_duration_seconds",
+                                 "Request latency", labels, **histogram_kwargs)
+    db_latency = registry.histogram("http_request_db_seconds",
+                                    "Time spent in db queries per request", labels,
+                                    **histogram_kwargs)
+    queries = registry.counter("db_queries_total", "Db queries executed", labels)
+    query_seconds = registry.counter("db_query_seconds_total", "Time spent in db queries",
+                                     labels)
+    install_engine_events()
+
+    @app.before_request
+    def _start_timer():
+        setattr(g, _G_KEY, {"start": time.perf_counter(), "db_seconds": 0.0, "db_queries": 0})
+
+    @app.after_request
+    def _record(response):
+        timing = g.get(_G_KEY)
+        if timing is None:
+            return response
+        elapsed = time.perf_counter() - timing["start"]
+        endpoint = request.url_rule.rule if request.url_rule else "<unmatched>"
+        labelvalues = (endpoint, request.method, str(response.status_code))
+        latency.observe(elapsed, *labelvalues)
+        db_latency.observe(timing["db_seconds"], *labelvalues)
+        if timing["db_queries"]:
+            queries.inc(*labelvalues, amount=timing["db_queries"])
+            query_seconds.inc(*labelvalues, amount=timing["db_seconds"])
+        response.headers.add("Server-Timing", "app;dur={:.2f}, db;dur={:.2f}".format(
+            elapsed * 1000, timing["db_seconds"] * 1000))
+        registry.flush()
+        return response
+
+    @app.route(path)
+    def metrics():
+        return Response(registry.expose(), content_type=CONTENT_TYPE)
+
+    app.extensions["morus_metrics"] = registry
+    return registry
@@ -0,0 +1,203 @@
+"""
+Sampling profiler for Flask apps, cheap enough to leave enabled
+
+Only selected requests are profiled: 1 in every PROFILE_SAMPLE_EVERY, and
+any request carrying the PROFILE_HEADER header with the value of
+PROFILE_TOKEN.  While a selected request runs, a background thread records
+its thread's stack every PROFILE_INTERVAL seconds; other requests pay only
+for the selection check.
+
+The last PROFILE_BUFFER_SIZE profiles are kept in memory, and merged per
+endpoint into collapsed stacks (one `frame;frame;frame count` line per
+distinct stack), the input format of flamegraph.pl & speedscope:
+
+    GET /admin/profiles                                 summary, as JSON
+    GET /admin/profiles/collapsed?endpoint=/warranties/ collapsed stacks
+
+When PROFILE_TOKEN is set, the admin endpoints require the header too.
+"""
+import collections
+import itertools
+import os
+import sys
+import threading
+import time
+
+from flask import Response, g, jsonify, request
+
+from morus.flask.decorators import require_token
+
+
+DEFAULTS = {
+    "PROFILE_SAMPLE_EVERY": 100,
+    "PROFILE_HEADER": "X-Profile",
+    "PROFILE_TOKEN": None,
+    "PROFILE_INTERVAL": 0.005,
+    "PROFILE_BUFFER_SIZE": 100,
+}
+
+Profile = collections.namedtuple(
+    "Profile", ["endpoint", "method", "status", "started", "duration", "stacks"])
+
+
+def _frame_name(code):
+    filename = os.sep.join(code.co_filename.split(os.sep)[-2:])
+    return "{} ({}:{})".format(code.co_name, filename, code.co_firstlineno)
+
+
+def _stack(frame):
+    """frame's stack as a tuple of frame names, outermost first"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(names))
+
+
+class StackSampler(object):
+    """samples stacks of the threads registered with start(), from a daemon
+    thread which sleeps while there are none"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}  # thread ident -> Counter of stacks
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, ident):
+        with self._lock:
+            self._active[ident] = collections.Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name="morus-profiler")
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, ident):
+        """stop sampling thread ident, returns Counter of its stacks"""
+        with self._lock:
+            return self._active.pop(ident, collections.Counter())
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            frames = sys._current_frames()
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+                    continue
+                for (ident, stacks) in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, sample_every=100, header="X-Profile", token=None,
+                 interval=0.005, buffer_size=100):
+        self.sample_every = sample_every
+        self.header = header
+        self.token = token
+        self.profiles = collections.deque(maxlen=buffer_size)
+        self.sampler = StackSampler(interval=interval)
+        self._counter = itertools.count(1)
+
+    def trusted(self):
+        return bool(self.token) and request.headers.get(self.header) == self.token
+
+    def selected(self):
+        if self.trusted():
+            return True
+        # itertools.count is atomic under the GIL
+        return bool(self.sample_every) and next(self._counter) % self.sample_every == 0
+
+    def before_request(self):
+        if self.selected():
+            g._morus_profile_started = (time.time(), time.perf_counter())
+            self.sampler.start(threading.get_ident())
+
+    def teardown_request(self, exc):
+        started = g.pop("_morus_profile_started", None)
+        if started is None:
+            return
+        stacks = self.sampler.stop(threading.get_ident())
+        status = g.pop("_morus_profile_status", 500 if exc else None)
+        self.profiles.append(Profile(
+            endpoint=request.url_rule.rule if request.url_rule else "<unmatched>",
+            method=request.method,
+            status=status,
+            started=started[0],
+            duration=time.perf_counter() - started[1],
+            stacks=stacks,
+        ))
+
+    def after_request(self, response):
+        if "_morus_profile_started" in g:
+            g._morus_profile_status = response.status_code
+        return response
+
+    def collapsed(self, endpoint=None):
+        """stacks of buffered profiles (of endpoint, or all) merged, in the
+        collapsed format"""
+        merged = collections.Counter()
+        for profile in list(self.profiles):
+            if endpoint is None or profile.endpoint == endpoint:
+                merged.update(profile.stacks)
+        return "".join("{} {}\n".format(";".join(stack), count)
+                       for (stack, count) in merged.most_common())
+
+    def summary(self):
+        endpoints = collections.defaultdict(lambda: {"profiles": 0, "samples": 0,
+                                                     "duration": 0.0})
+        profiles = []
+        for profile in list(self.profiles):
+            samples = sum(profile.stacks.values())
+            stats = endpoints[profile.endpoint]
+            stats["profiles"] += 1
+            stats["samples"] += samples
+            stats["duration"] += profile.duration
+            profiles.append({
+                "endpoint": profile.endpoint,
+                "method": profile.method,
+                "status": profile.status,
+                "started": profile.started,
+                "duration": profile.duration,
+                "samples": samples,
+            })
+        return {"profiles": profiles, "endpoints": endpoints}
+
+
+def install_profiler(app, prefix="/admin/profiles"):
+    """profile sampled requests of app, configured by the PROFILE_* config
+    values (see DEFAULTS), with reports served under prefix
+
+    returns the SamplingProfiler"""
+    config = {key: app.config.get(key, value) for (key, value) in DEFAULTS.items()}
+    profiler = SamplingProfiler(
+        sample_every=config["PROFILE_SAMPLE_EVERY"],
+        header=config["PROFILE_HEADER"],
+        token=config["PROFILE_TOKEN"],
+        interval=config["PROFILE_INTERVAL"],
+        buffer_size=config["PROFILE_BUFFER_SIZE"],
+    )
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
+
+    @app.route(prefix)
+    def profiles():
+        require_token()
+        return jsonify(profiler.summary())
+
+    @app.route(prefix + "/collapsed")
+    def profiles_collapsed():
+        require_token()
+        return Response(profiler.collapsed(request.args.get("endpoint")),
+                        content_type="text/plain; charset=utf-8")
+
+    app.extensions["morus_profiler"] = profiler
+    return profiler
@@ -0,0 +1,383 @@
+"""
+Prefork WSGI server for morus apps, in place of `app.run()`
+
+serve(app, port, workers=N, threads=T) binds the listening socket, then
+forks N worker processes sharing it, each handling up to T requests at once
+from a thread pool.  The app is created (preloaded) before forking, and
+`gc.freeze()` moves everything allocated so far out of the collector's
+reach, so the collector does not write to (and un-share) pages which are
+shared copy-on-write between workers.
+
+The master process only supervises workers:
+
+ * a worker exiting is replaced by a fresh fork, so workers can be recycled
+   after max_requests requests (plus up to max_requests_jitter more, so they
+   do not all restart together) or once their RSS exceeds max_rss_mb
+ * SIGTERM or SIGINT shuts down gracefully: workers stop accepting, finish
+   requests in flight, and are killed if still running after
+   graceful_timeout seconds
+ * SIGHUP replaces every worker, eg to shed memory
+
+workers=0 serves from the calling process, without forking.
+"""
+import concurrent.futures
+import gc
+import os
+import random
+import resource
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer, select_address_family
+
+from morus.logging import getLogger, stop_logging
+
+
+log = getLogger(__name__)
+
+DEFAULT_THREADS = 4
+DEFAULT_GRACEFUL_TIMEOUT = 30.0
+LISTEN_BACKLOG = 2048
+
+# seconds the accept loop waits for a free thread, before returning to
+# check whether the server was shut down
+SLOT_WAIT = 0.05
+
+# a worker exiting within this many seconds of starting is crashing, and
+# is replaced only after as long again
+MIN_WORKER_LIFETIME = 1.0
+
+
+def rss_bytes():
+    """resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        # peak rather than current, in kB on Linux & bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+class PoolWSGIServer(BaseWSGIServer):
+    """werkzeug server handling connections in a pool of `threads` threads
+
+    the accept loop waits for a free thread before accepting, so a busy
+    worker leaves new connections to its siblings; once max_requests have
+    been accepted, or RSS exceeds max_rss bytes, it stops accepting & calls
+    on_recycle()"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=DEFAULT_THREADS, max_requests=0,
+                 max_rss=0, on_recycle=None, **kwargs):
+        super(PoolWSGIServer, self).__init__(host, port, app, **kwargs)
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.on_recycle = on_recycle
+        self.requests = 0
+        self.recycling = False
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="morus-serve")
+        self._slots = threading.BoundedSemaphore(threads)
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def get_request(self):
+        # the listening socket is non-blocking, as it is shared with other
+        # workers which may accept the connection first (raising
+        # BlockingIOError, ignored by socketserver)
+        if self.recycling:
+            # leave connections to the other workers until shut down
+            raise BlockingIOError
+        # a thread must be free before a connection is taken off the shared
+        # socket, so a busy worker leaves it to its siblings
+        if not self._slots.acquire(timeout=SLOT_WAIT):
+            raise BlockingIOError
+        try:
+            (conn, addr) = self.socket.accept()
+        except BaseException:
+            self._slots.release()
+            raise
+        conn.setblocking(True)
+        return (conn, addr)
+
+    def process_request(self, request, client_address):
+        # counted as accepted, so that recycling stops the next accept
+        self._count_request()
+        try:
+            self._pool.submit(self._process, request, client_address)
+        except RuntimeError:
+            # pool shut down
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+            if self.recycling:
+                return
+            if self.max_requests and self.requests >= self.max_requests:
+                reason = "served {} requests".format(self.requests)
+            elif self.max_rss and rss_bytes() > self.max_rss:
+                reason = "rss {}MB".format(rss_bytes() // 2 ** 20)
+            else:
+                return
+            self.recycling = True
+        log.info("worker %s recycling: %s", os.getpid(), reason)
+        if self.on_recycle:
+            self.on_recycle()
+
+    def stop(self):
+        """stop accepting, from any thread but the one serving; returns
+        False if already stopped"""
+        if self._stopped:
+            return False
+        self._stopped = True
+        threading.Thread(target=self.shutdown, daemon=True).start()
+        return True
+
+    def drain(self, timeout=None):
+        """wait for requests in flight to finish"""
+        waiter = threading.Thread(target=self._pool.shutdown, daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+        return not waiter.is_alive()
+
+
+def listen(host, port, backlog=LISTEN_BACKLOG):
+    """bound, listening & non-blocking socket, to be shared by workers"""
+    sock = socket.socket(select_address_family(host, port), socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def _serve_worker(app, sock, host, threads, max_requests, max_rss, graceful_timeout,
+                  ssl_context, before_exit=None):
+    """serve requests until stopped or recycled, returns exit code"""
+    server = PoolWSGIServer(host, sock.getsockname()[1], app, threads=threads,
+                            max_requests=max_requests, max_rss=max_rss,
+                            ssl_context=ssl_context, fd=sock.fileno())
+    server.on_recycle = server.stop
+
+    def graceful(signum, frame):
+        if server.stop():
+            log.info("worker %s stopping on signal %s", os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, graceful)
+    signal.signal(signal.SIGINT, graceful)
+    signal.signal(signal.SIGHUP, graceful)
+    log.info("worker %s serving with %s threads", os.getpid(), threads)
+    # closes the worker's copy of the listening socket when stopped
+    server.serve_forever()
+    code = 0
+    if not server.drain(graceful_timeout):
+        log.warning("worker %s: requests still running after %ss", os.getpid(),
+                    graceful_timeout)
+        code = 1
+    if before_exit:
+        before_exit()
+    # counts since the last periodic flush, see morus.flask.metrics
+    metrics = getattr(app, "extensions", {}).get("morus_metrics")
+    if metrics is not None:
+        metrics.flush(force=True)
+    return code
+
+
+class Master(object):
+    """forks & supervises the workers, see serve()"""
+
+    def __init__(self, app, sock, host, workers, threads, max_requests,
+                 max_requests_jitter, max_rss, graceful_timeout, ssl_context,
+                 after_fork=None, before_exit=None):
+        self.app = app
+        self.sock = sock
+        self.host = host
+        self.workers = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss = max_rss
+        self.graceful_timeout = graceful_timeout
+        self.ssl_context = ssl_context
+        self.after_fork = after_fork
+        self.before_exit = before_exit
+        self.children = {}  # pid -> start time
+        self.stopping = False
+        self.restarting = False
+
+    def spawn(self):
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return pid
+        # worker
+        code = 1
+        try:
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            random.seed()
+            if self.after_fork:
+                self.after_fork()
+            code = _serve_worker(self.app, self.sock, self.host, self.threads,
+                                 max_requests, self.max_rss, self.graceful_timeout,
+                                 self.ssl_context, before_exit=self.before_exit)
+        except BaseException:
+            log.exception("worker %s failed", os.getpid())
+        finally:
+            stop_logging()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # skip the master's atexit handlers & finalizers
+            os._exit(code)
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _on_restart(self, signum, frame):
+        self.restarting = True
+
+    def signal_all(self, signum):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                self.children.pop(pid, None)
+
+    def reap(self):
+        """collect exited workers, returns how long the shortest lived"""
+        shortest = None
+        while self.children:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                break
+            if not pid:
+                break
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            lifetime = time.monotonic() - started
+            shortest = lifetime if shortest is None else min(shortest, lifetime)
+            log.info("worker %s exited with status %s after %.1fs", pid, status, lifetime)
+        return shortest
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_restart)
+        log.info("master %s forking %s workers", os.getpid(), self.workers)
+        for i in range(self.workers):
+            self.spawn()
+
+        while not self.stopping:
+            time.sleep(0.1)
+            if self.restarting:
+                self.restarting = False
+                log.info("master %s replacing workers", os.getpid())
+                self.signal_all(signal.SIGTERM)
+            shortest = self.reap()
+            if shortest is not None and shortest < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            while not self.stopping and len(self.children) < self.workers:
+                self.spawn()
+        return self.shutdown()
+
+    def shutdown(self):
+        """stop workers gracefully, killing those which overrun"""
+        log.info("master %s stopping %s workers", os.getpid(), len(self.children))
+        self.signal_all(signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        if self.children:
+            log.warning("killing %s workers", len(self.children))
+            self.signal_all(signal.SIGKILL)
+            while self.children:
+                self.reap()
+                time.sleep(0.05)
+        self.sock.close()
+        return 0
+
+
+def serve(app, port, host="127.0.0.1", workers=None, threads=DEFAULT_THREADS,
+          max_requests=0, max_requests_jitter=0, max_rss_mb=0,
+          graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT, ssl_context=None,
+          before_fork=None, after_fork=None, before_exit=None):
+    """serve app on host:port until SIGTERM or SIGINT, see module docs
+
+     * workers: processes to fork, default one per cpu; 0 serves from this
+       process
+     * threads: requests handled concurrently by each worker
+     * max_requests, max_requests_jitter, max_rss_mb: worker recycling, 0
+       to disable
+     * graceful_timeout: seconds requests in flight are given to finish
+     * ssl_context: as for app.run(), eg (crt_path, key_path)
+     * before_fork(): called once in this process before the first fork, eg
+       to close db connections opened while creating the app, which must not
+       be shared with the workers
+     * after_fork(): called in each worker when it starts
+     * before_exit(): called in each worker (or this process) once it has
+       stopped serving, eg to flush writes queued by requests; workers exit
+       without running atexit handlers
+
+    returns the exit code"""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    sock = listen(host, port)
+    log.info("listening at %s:%s", host, sock.getsockname()[1])
+    max_rss = max_rss_mb * 2 ** 20
+
+    if not workers:
+        try:
+            return _serve_worker(app, sock, host, threads, max_requests, max_rss,
+                                 graceful_timeout, ssl_context, before_exit=before_exit)
+        finally:
+            sock.close()
+
+    if before_fork:
+        before_fork()
+    # freeze the preloaded app, so collections do not touch shared pages
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    master = Master(app, sock, host, workers, threads, max_requests, max_requests_jitter,
+                    max_rss, graceful_timeout, ssl_context, after_fork=after_fork,
+                    before_exit=before_exit)
+    return master.run()
+
+
+def serve_kwargs(args):
+    """serve() kwargs from ConfiguredAppArgParser args"""
+    return {
+        "port": args.port,
+        "host": args.host,
+        "workers": args.workers,
+        "threads": args.threads,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests_jitter,
+        "max_rss_mb": args.max_rss_mb,
+        "graceful_timeout": args.graceful_timeout,
+        "ssl_context": (args.ssl_crt, args.ssl_key) if args.https else None,
+    }
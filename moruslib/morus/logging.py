@@ -1,12 +1,36 @@
-import sys
+"""
+Logging setup for morus services
 
+Modules get their own logger with getLogger(__name__) and log with lazy
+%-style arguments, eg `log.debug("found %s", rows)`, so nothing is
+formatted unless the level is enabled.  Services call configure_logging()
+once at startup to set levels per logger, and to move writing records off
+the calling thread: records are put on a queue and written by a
+QueueListener thread (restarted in processes forked from this one).
+"""
+import atexit
+import collections
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
 StderrHandler = logging.StreamHandler(sys.stderr)
 StderrHandler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+formatter = logging.Formatter(FORMAT)
 StderrHandler.setFormatter(formatter)
 
+# state of configure_logging(), undone by stop_logging()
+_listener = None
+_root_handlers = []
+_filters = []
+
+
 class NullHandler(logging.Handler):
     """Null log handler can be registered with app to suppress "no handlers" error
 
@@ -16,12 +40,128 @@ class NullHandler(logging.Handler):
     def emit(self, record):
         pass
 
+
+class SamplingFilter(logging.Filter):
+    """passes 1 in every `every` records at or below max_level from each call
+    site (logger & line), and every record above max_level
+
+    for debug lines on hot paths, which would otherwise flood the logs; the
+    first record from a call site is always passed
+
+    >>> f = SamplingFilter(every=3)
+    >>> record = logging.LogRecord("x", logging.DEBUG, "x.py", 1, "msg", None, None)
+    >>> [f.filter(record) for i in range(5)]
+    [True, False, False, True, False]
+    """
+
+    def __init__(self, every=100, max_level=logging.DEBUG, name=""):
+        super().__init__(name)
+        self.every = max(int(every), 1)
+        self.max_level = max_level
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not super().filter(record):
+            return False
+        if record.levelno > self.max_level or self.every == 1:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        with self._lock:
+            count = self._counts[key]
+            self._counts[key] = count + 1
+        return count % self.every == 0
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """merges args into the message on the calling thread, since the
+    objects passed as args may be modified after the call returns, and
+    leaves formatting & writing to the listener thread"""
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # traceback objects cannot be handed between threads safely
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
 def getLogger(name):
-    log = logging.getLogger(__name__)
-    log.setLevel(logging.DEBUG)
+    """logger for module name; levels are set by configure_logging()"""
+    return logging.getLogger(name)
+
+
+def configure_logging(level=logging.INFO, levels=None, handlers=None,
+                      debug_sample_every=1, background=True):
+    """configure the root logger, replacing any previous configuration
+
+     * level: root log level (name or number)
+     * levels: dict of logger name -> level, eg {"pplans.warranty": "DEBUG"}
+     * handlers: where records are written, default StderrHandler
+     * debug_sample_every: only write 1 in N DEBUG records per call site
+     * background: write records from a QueueListener thread, so logging
+       never blocks the caller on I/O
+
+    returns the QueueListener, if any"""
+    global _listener
+    stop_logging()
+    root = logging.getLogger()
+    root.setLevel(level)
+    for (name, logger_level) in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    handlers = list(handlers or [StderrHandler])
+    if background:
+        queue_handler = _QueueHandler(queue.SimpleQueue())
+        _listener = logging.handlers.QueueListener(
+            queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _root_handlers.append(queue_handler)
+    else:
+        _root_handlers.extend(handlers)
+    for handler in _root_handlers:
+        if debug_sample_every > 1:
+            # on the queue handler, sampled out records are never formatted
+            f = SamplingFilter(every=debug_sample_every)
+            handler.addFilter(f)
+            _filters.append((handler, f))
+        root.addHandler(handler)
+    return _listener
+
+
+def _restart_listener_after_fork():
+    """the listener thread does not survive fork(): give a forked child its
+    own queue & listener, writing to the same handlers"""
+    global _listener
+    if _listener is None:
+        return
+    handlers = _listener.handlers
+    for handler in _root_handlers:
+        if isinstance(handler, _QueueHandler):
+            handler.queue = queue.SimpleQueue()
+            _listener = logging.handlers.QueueListener(
+                handler.queue, *handlers, respect_handler_level=True)
+            _listener.start()
+
 
-    if not log.handlers:
-        log.addHandler(StderrHandler)
+def stop_logging():
+    """undo configure_logging(), writing any records still queued first;
+    registered to run at exit"""
+    global _listener
+    root = logging.getLogger()
+    while _root_handlers:
+        root.removeHandler(_root_handlers.pop())
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    while _filters:
+        (handler, f) = _filters.pop()
+        handler.removeFilter(f)
 
-    return log
 
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
@@ -0,0 +1,207 @@
+"""
+In-process metrics in the Prometheus text format
+
+A Registry holds Counters and Histograms, keyed by label values.  Under a
+prefork server each worker process has its own registry; give them a shared
+`multiprocess_dir` and each process periodically writes its values there, so
+any process can serve the sum over all of them (including workers that have
+since exited, as counters must never go down).  Files are named by pid &
+process start time, so a worker reusing an exited one's pid does not
+overwrite its values; processes should flush(force=True) before exiting.
+
+    >>> registry = Registry()
+    >>> requests = registry.counter("requests_total", "Requests", ["method"])
+    >>> requests.inc("GET")
+    >>> print(registry.expose(), end="")
+    # HELP requests_total Requests
+    # TYPE requests_total counter
+    requests_total{method="GET"} 1.0
+"""
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# seconds; suits request latencies of a web service
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v)) for (k, v) in pairs) + "}"
+
+
+def _float(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Counter(object):
+    type = "counter"
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labelvalues, amount=1.0):
+        with self.registry.lock:
+            values = self.registry.values(self)
+            values[labelvalues] = values.get(labelvalues, 0.0) + amount
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def samples(self, values):
+        for (labelvalues, value) in sorted(values.items()):
+            yield "{}{} {}".format(self.name, _labels(self.labelnames, labelvalues),
+                                   _float(value))
+
+
+class Histogram(object):
+    """observations counted into buckets by upper bound; values per label set
+    are [count per bucket (not cumulative)..., +Inf count, sum]"""
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        with self.registry.lock:
+            values = self.registry.values(self)
+            counts = values.get(labelvalues)
+            if counts is None:
+                counts = values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    break
+            else:
+                i = len(self.buckets)
+            counts[i] += 1
+            counts[-1] += value
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for (x, y) in zip(a, b)]
+
+    def samples(self, values):
+        for (labelvalues, counts) in sorted(values.items()):
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "{}_bucket{} {}".format(
+                    self.name,
+                    _labels(self.labelnames, labelvalues, [("le", _float(bound))]),
+                    cumulative)
+            labels = _labels(self.labelnames, labelvalues)
+            yield "{}_sum{} {}".format(self.name, labels, _float(counts[-1]))
+            yield "{}_count{} {}".format(self.name, labels, cumulative)
+
+
+class Registry(object):
+    """metrics of this process, optionally shared with others through files
+    in multiprocess_dir, written at most every flush_seconds by flush()"""
+
+    def __init__(self, multiprocess_dir=None, flush_seconds=1.0):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_seconds = flush_seconds
+        self._values = {}
+        self._pid = os.getpid()
+        self._started = time.time_ns()
+        self._flushed = 0.0
+
+    def values(self, metric):
+        """this process' values of metric, caller holds self.lock"""
+        if self._pid != os.getpid():
+            # forked: values so far belong to (and are reported by) the parent
+            self._pid = os.getpid()
+            self._started = time.time_ns()
+            self._values = {}
+            self._flushed = 0.0
+        return self._values.setdefault(metric.name, {})
+
+    def counter(self, name, help, labelnames=()):
+        return self.metrics.setdefault(name, Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(self, name, help, labelnames, buckets))
+
+    def snapshot(self):
+        """this process' values, as {name: [[labelvalues, value], ...]}"""
+        with self.lock:
+            for metric in self.metrics.values():
+                self.values(metric)
+            return {name: [[list(labels), value] for (labels, value) in values.items()]
+                    for (name, values) in self._values.items()}
+
+    def _path(self):
+        return os.path.join(self.multiprocess_dir,
+                            "metrics-{}-{}.json".format(self._pid, self._started))
+
+    def flush(self, force=False):
+        """write this process' values to multiprocess_dir, if due"""
+        if not self.multiprocess_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed < self.flush_seconds:
+            return
+        self._flushed = now
+        snapshot = self.snapshot()
+        (fd, tmp) = tempfile.mkstemp(dir=self.multiprocess_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f)
+        # atomic, readers never see a partial file
+        os.replace(tmp, self._path())
+
+    def collect(self):
+        """values summed over all processes, {name: {labelvalues: value}}"""
+        snapshots = [self.snapshot()]
+        if self.multiprocess_dir:
+            self.flush(force=True)
+            snapshots = []
+            for path in glob.glob(os.path.join(self.multiprocess_dir, "metrics-*.json")):
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        ret = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for (name, samples) in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for (labelvalues, value) in samples:
+                    labelvalues = tuple(labelvalues)
+                    current = ret[name].get(labelvalues)
+                    ret[name][labelvalues] = (value if current is None
+                                              else metric.merge(current, value))
+        return ret
+
+    def expose(self):
+        """all metrics in the Prometheus text exposition format"""
+        lines = []
+        for (name, values) in sorted(self.collect().items()):
+            metric = self.metrics[name]
+            lines.append("# HELP {} {}".format(name, metric.help))
+            lines.append("# TYPE {} {}".format(name, metric.type))
+            lines.extend(metric.samples(values))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,143 @@
+"""
+Instrumented SQLAlchemy connection pools, and helpers to configure them
+
+Pass the result of engine_options() as create_engine() kwargs (or as
+Flask-SQLAlchemy's `SQLALCHEMY_ENGINE_OPTIONS`), then read live counters
+from pool_stats(engine.pool) to tell whether latency comes from waiting on
+the pool rather than from the database itself.
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+log = logging.getLogger(__name__)
+
+
+class PoolStats(object):
+    """counters shared by an instrumented pool and the pools recreate()d
+    from it (eg after engine.dispose())"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_overflow_seen = 0
+
+    def record_checkout(self, seconds, overflow):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            self.max_overflow_seen = max(self.max_overflow_seen, overflow)
+
+    def record_timeout(self, seconds):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+
+class InstrumentedPoolMixin(object):
+    """times every checkout from the pool: for a QueuePool this is the wait
+    for a free connection, plus connect time when a new one is opened"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            rec = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record_timeout(time.monotonic() - start)
+            log.warning("connection pool exhausted: %s", self.status())
+            raise
+        self.stats.record_checkout(time.monotonic() - start, overflow(self))
+        return rec
+
+    def _create_connection(self):
+        self.stats.record_connect()
+        return super()._create_connection()
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedNullPool(InstrumentedPoolMixin, NullPool):
+    pass
+
+
+def overflow(pool):
+    """connections open beyond pool_size"""
+    return max(pool.overflow(), 0) if isinstance(pool, QueuePool) else 0
+
+
+def engine_options(pool_size=None, max_overflow=None, pool_timeout=None,
+                   pool_recycle=None, pool_pre_ping=None, pgbouncer=False):
+    """create_engine() kwargs for an instrumented pool, None values are
+    left to sqlalchemy's defaults
+
+    with pgbouncer=True connections are opened per checkout & closed on
+    checkin (NullPool), leaving pooling to a PgBouncer in transaction mode;
+    pool_size, max_overflow & pool_timeout do not apply"""
+    options = {"pool_recycle": pool_recycle, "pool_pre_ping": pool_pre_ping}
+    if pgbouncer:
+        options["poolclass"] = InstrumentedNullPool
+    else:
+        options.update({
+            "poolclass": InstrumentedQueuePool,
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": pool_timeout,
+        })
+    return {key: value for (key, value) in options.items() if value is not None}
+
+
+def pool_stats(pool):
+    """live counters of an instrumented pool (current usage only for others)
+
+    wait_seconds is the total spent checking out connections, so
+    avg_wait_seconds rising with checked_out near size + max_overflow
+    means requests are queueing for connections"""
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": overflow(pool),
+        })
+    counters = getattr(pool, "stats", None)
+    if counters is not None:
+        with counters._lock:
+            stats.update({
+                "checkouts": counters.checkouts,
+                "connects": counters.connects,
+                "timeouts": counters.timeouts,
+                "wait_seconds": counters.wait_seconds,
+                "avg_wait_seconds": (counters.wait_seconds / counters.checkouts
+                                     if counters.checkouts else None),
+                "max_wait_seconds": counters.max_wait_seconds,
+                "max_overflow_seen": counters.max_overflow_seen,
+            })
+    return stats
@@ -6,9 +6,6 @@ import shlex
 import subprocess
 import sys
 
-import psycopg2
-import psycopg2.extensions
-
 from setuptools import Command
 from setuptools.command.test import test as TestCommand
 
@@ -276,6 +273,9 @@ class PsqlCommand(Command):
 
     def _psycopg2_query(self, query):
         """executes query & returns list of rows"""
+        import psycopg2
+        import psycopg2.extensions
+
         result = None
         conn = psycopg2.connect(self.dsn)
         conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
@@ -380,6 +380,8 @@ class EnvTestCommand(PsqlCommand):
             sys.exit("db {} not found".format(self.dbname))
 
     def _check_run_query(self):
+        import psycopg2
+
         log.debug(
             "{} Checking run_query: {} @ {}".format(
                 self.__class__.__name__, self.user, self.dbname
@@ -423,6 +425,128 @@ class EnvTestCommand(PsqlCommand):
         self._check_dsn()
 
 
+class BenchmarkCommand(Command):
+    """run a benchmark suite, save its results as JSON & compare them with a
+    baseline; exits non-zero if any benchmark regressed
+
+    subclasses set `suite` to the dotted name of a module whose
+    run(dsn, scales, iterations) returns {scale: {benchmark: stats}}, as
+    recorded by morus.benchmark.timed()
+    """
+
+    description = "run benchmarks & compare against a baseline"
+
+    suite = None
+    default_scales = "1000,100000"
+    default_output = "benchmark-results.json"
+    default_baseline = None
+
+    user_options = [
+        ("dsn=", None, "DSN of database to benchmark against (it is recreated!)"),
+        ("scales=", None, "comma separated data sizes (default {})".format(default_scales)),
+        ("iterations=", None, "timed calls per benchmark (default 200)"),
+        ("output=", None, "where to write results (default {})".format(default_output)),
+        ("baseline=", None, "results to compare against"),
+        ("tolerance=", None, "fraction slower than baseline to allow (default 0.2)"),
+        ("update-baseline", None, "write results to --baseline, rather than comparing"),
+    ]
+    boolean_options = ["update-baseline"]
+
+    def initialize_options(self):
+        self.dsn = None
+        self.scales = None
+        self.iterations = None
+        self.output = None
+        self.baseline = None
+        self.tolerance = None
+        self.update_baseline = False
+
+    def finalize_options(self):
+        if not self.suite:
+            raise ValueError("{} has no suite".format(self.__class__.__name__))
+        if not self.dsn:
+            raise ValueError("dsn is required")
+        self.scales = [int(float(scale)) for scale in
+                       (self.scales or self.default_scales).split(",")]
+        self.iterations = int(self.iterations or 200)
+        self.output = self.output or self.default_output
+        self.baseline = self.baseline or self.default_baseline
+        self.tolerance = float(self.tolerance or 0.2)
+        if self.update_baseline and not self.baseline:
+            raise ValueError("baseline is required to update it")
+
+    def run(self):
+        import importlib
+
+        from morus import benchmark
+
+        suite = importlib.import_module(self.suite)
+        results = suite.run(self.dsn, self.scales, self.iterations)
+        print(benchmark.report(results))
+        if self.update_baseline:
+            benchmark.save_results(self.baseline, results)
+            log.info("baseline written to {}".format(self.baseline))
+            return
+        benchmark.save_results(self.output, results)
+        log.info("results written to {}".format(self.output))
+        if not self.baseline or not os.path.exists(self.baseline):
+            log.warning("no baseline to compare with")
+            return
+        regressions = benchmark.compare(results, benchmark.load_results(self.baseline),
+                                        tolerance=self.tolerance)
+        if regressions:
+            sys.exit("regressed against {}:\n\t{}".format(
+                self.baseline, "\n\t".join(regressions)))
+        log.info("no regressions against {}".format(self.baseline))
+
+
+class ImportTimeCommand(Command):
+    """report the modules slowest to import, & the cold start of the app;
+    exits non-zero if its median exceeds --budget seconds
+
+    subclasses set `suite` to the dotted name of a module defining MODULE
+    (to report import times of), STATEMENT (eg importing & configuring the
+    app) & BUDGET (default --budget), see morus.startup
+    """
+
+    description = "report import times & cold start"
+
+    suite = None
+
+    user_options = [
+        ("top=", None, "modules to report (default 20)"),
+        ("repeat=", None, "interpreters to time the cold start in (default 5)"),
+        ("budget=", None, "seconds the median cold start may take"),
+    ]
+
+    def initialize_options(self):
+        self.top = None
+        self.repeat = None
+        self.budget = None
+
+    def finalize_options(self):
+        if not self.suite:
+            raise ValueError("{} has no suite".format(self.__class__.__name__))
+        self.top = int(self.top or 20)
+        self.repeat = int(self.repeat or 5)
+
+    def run(self):
+        import importlib
+        import statistics
+
+        from morus import startup
+
+        suite = importlib.import_module(self.suite)
+        budget = float(self.budget or suite.BUDGET)
+        print(startup.report(startup.import_times(suite.MODULE), top=self.top))
+        elapsed = statistics.median(startup.cold_start(suite.STATEMENT, repeat=self.repeat))
+        print("cold start: {:.1f} ms (median of {})".format(elapsed * 1e3, self.repeat))
+        if elapsed > budget:
+            sys.exit("cold start {:.1f} ms exceeds budget of {:.1f} ms".format(
+                elapsed * 1e3, budget * 1e3))
+        log.info("cold start within budget of {:.1f} ms".format(budget * 1e3))
+
+
 # https://fgimian.github.io/blog/2014/04/27/running-nose-tests-with-plugins-using-the-setuptools-test-command/
 class NoseTestCommand(TestCommand):
     """custom nosetests runner to force nose into verbose mode"""
@@ -449,11 +573,13 @@ class NoseTestCommand(TestCommand):
 
 
 COMMANDS = {
+    "benchmark": BenchmarkCommand,
     "createdb": CreateDbCommand,
     "createuser": CreateUserCommand,
     "dropdb": DropDbCommand,
     "dropuser": DropUserCommand,
     "envtest": EnvTestCommand,
+    "importtime": ImportTimeCommand,
     "listdbs": ListDbsCommand,
     "listusers": ListUsersCommand,
     "psqldbs": ListDbsPsqlCommand,
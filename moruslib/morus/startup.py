@@ -0,0 +1,99 @@
+"""
+Import time & cold start, measured in fresh interpreters so that nothing
+already imported by the caller is hidden
+
+    >>> times = parse_importtime('''import time: self [us] | cumulative | imported package
+    ... import time:       120 |        150 |   abc
+    ... import time:       300 |        450 | mod''')
+    >>> times[-1]
+    ImportTime(module='mod', self=0.0003, cumulative=0.00045, depth=0)
+    >>> print(report(times))
+     cumulative      self  module
+        0.45 ms   0.30 ms  mod
+        0.15 ms   0.12 ms    abc
+
+`import_times(module)` runs `python -X importtime -c "import module"`, and
+`cold_start(code)` times running code (eg importing & configuring an app)
+in each of `repeat` new interpreters, excluding the interpreter's own
+startup; `imported_modules(code)` lists what running it imports.
+Interpreters are run with this one's sys.path.
+"""
+import collections
+import os
+import subprocess
+import sys
+
+
+ImportTime = collections.namedtuple("ImportTime", ["module", "self", "cumulative", "depth"])
+
+# written by children before their results, on stdout
+_ELAPSED = "morus.startup elapsed:"
+_MODULES = "morus.startup modules:"
+
+_TIMER = """
+import time
+_start = time.perf_counter()
+exec(compile({code!r}, "<cold start>", "exec"), {{"__name__": "__main__"}})
+print({marker!r}, time.perf_counter() - _start, flush=True)
+"""
+
+
+def parse_importtime(text):
+    """ImportTime of each module in `python -X importtime` output, in the
+    order reported (a module after those it imported), times in seconds"""
+    times = []
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        (self_us, cumulative_us, name) = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            # header
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append(ImportTime(name.strip(), int(self_us) / 1e6,
+                                int(cumulative_us) / 1e6, depth))
+    return times
+
+
+def _run(args, env=None):
+    # importing what this process can
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, sys.path)), **(env or {}))
+    return subprocess.run([sys.executable] + args, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+def import_times(module, env=None):
+    """ImportTime of every module imported by `import module`, from a fresh
+    interpreter with the environment variables env added"""
+    return parse_importtime(_run(["-X", "importtime", "-c", "import " + module], env).stderr)
+
+
+def imported_modules(code, env=None):
+    """names of the modules in sys.modules after running code in a fresh
+    interpreter, eg to check optional dependencies are imported lazily"""
+    code += "\nimport sys\nprint({!r}, *sys.modules)".format(_MODULES)
+    stdout = _run(["-c", code], env).stdout
+    line = [line for line in stdout.splitlines() if line.startswith(_MODULES)][-1]
+    return set(line[len(_MODULES):].split())
+
+
+def cold_start(code, repeat=5, env=None):
+    """seconds each of repeat fresh interpreters took to run code"""
+    elapsed = []
+    for i in range(repeat):
+        stdout = _run(["-c", _TIMER.format(code=code, marker=_ELAPSED)], env).stdout
+        line = [line for line in stdout.splitlines() if line.startswith(_ELAPSED)][-1]
+        elapsed.append(float(line[len(_ELAPSED):]))
+    return elapsed
+
+
+def report(times, top=20):
+    """the top modules by cumulative import time, as a table, each indented
+    by how deeply it was imported"""
+    lines = [" cumulative      self  module"]
+    slowest = sorted(times, key=lambda t: t.cumulative, reverse=True)[:top]
+    for t in slowest:
+        lines.append("{:8.2f} ms {:6.2f} ms  {}{}".format(
+            t.cumulative * 1e3, t.self * 1e3, "  " * t.depth, t.module))
+    return "\n".join(lines)
@@ -0,0 +1,77 @@
+from morus.asgi import ASGIApp, Blueprint, MultiDict, Response, TestClient
+from morus.testing.base import MorusTestCase
+
+
+class TestASGI(MorusTestCase):
+
+    def setUp(self):
+        self.app = ASGIApp("morus_test", max_body_size=64)
+        bp = Blueprint("echo", __name__, url_prefix="/echo")
+
+        @bp.route("/", methods=["GET", "POST"])
+        async def echo(request):
+            if request.method == "POST":
+                return request.get_json() or request.form
+            return request.args
+
+        @bp.route("/list")
+        async def getlist(request):
+            return request.args.getlist("a")
+
+        @bp.route("/text")
+        async def text(request):
+            return Response("plain", content_type="text/plain")
+
+        @bp.route("/error")
+        async def error(request):
+            raise RuntimeError("boom")
+
+        self.app.register_blueprint(bp)
+        self.events = []
+
+        async def startup():
+            self.events.append("startup")
+
+        async def shutdown():
+            self.events.append("shutdown")
+        self.app.on_startup.append(startup)
+        self.app.on_shutdown.append(shutdown)
+
+    def test_lifespan(self):
+        with TestClient(self.app) as client:
+            self.assertEqual(self.events, ["startup"])
+            self.assertEqual(client.get("/").json(), {"morus_test-server": "ok"})
+        self.assertEqual(self.events, ["startup", "shutdown"])
+
+    def test_routes(self):
+        with TestClient(self.app) as client:
+            self.assertEqual(client.get("/echo/", query={"a": "1"}).json(), {"a": "1"})
+            self.assertEqual(client.post("/echo/", data={"b": "2"}).json(), {"b": "2"})
+            self.assertEqual(client.post("/echo/", json=[1, 2]).json(), [1, 2])
+
+            r = client.get("/echo/text")
+            self.assertEqual(r.headers["content-type"], "text/plain")
+            self.assertEqual(r.data, b"plain")
+
+            self.assertEqual(client.get("/nope").status_code, 404)
+            self.assertEqual(client.post("/echo/text").status_code, 405)
+            self.assertEqual(client.get("/echo/error").status_code, 500)
+
+    def test_multiple_values(self):
+        with TestClient(self.app) as client:
+            query = {"a": ["1", "2"], "b": "3"}
+            self.assertEqual(client.get("/echo/", query=query).json(), {"a": "1", "b": "3"})
+            self.assertEqual(client.get("/echo/list", query=query).json(), ["1", "2"])
+            self.assertEqual(client.post("/echo/", data={"a": ["4", "5"]}).json(), {"a": "4"})
+        args = MultiDict([("a", "1"), ("a", "2")])
+        self.assertEqual((args.get("a"), args.getlist("a"), args.getlist("b")),
+                         ("1", ["1", "2"], []))
+
+    def test_body_size(self):
+        with TestClient(self.app) as client:
+            self.assertEqual(client.post("/echo/", json=["x" * 50]).status_code, 200)
+            r = client.post("/echo/", json=["x" * 100])
+            self.assertEqual(r.status_code, 413)
+            # refused from the declared length, before reading
+            r = client.post("/echo/", json=[], headers={"content-length": "1000"})
+            self.assertEqual(r.status_code, 413)
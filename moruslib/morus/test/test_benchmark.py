@@ -0,0 +1,56 @@
+import os
+import tempfile
+
+import sqlalchemy
+
+from morus import benchmark
+from morus.testing.base import MorusTestCase
+
+
+class TestBenchmark(MorusTestCase):
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(samples, 0), 1)
+        self.assertAlmostEqual(benchmark.percentile(samples, 50), 50.5)
+        self.assertAlmostEqual(benchmark.percentile(samples, 99), 99.01)
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+        with self.assertRaises(ValueError):
+            benchmark.percentile([], 50)
+
+    def test_timed_counts_queries(self):
+        engine = sqlalchemy.create_engine("sqlite://")
+        conn = engine.connect()
+        counter = benchmark.QueryCounter()
+        try:
+            stats = benchmark.timed(lambda: conn.execute("SELECT 1").fetchall(),
+                                    iterations=20, warmup=5, counter=counter)
+            self.assertEqual(stats["iterations"], 20)
+            self.assertEqual(stats["queries"], 1)
+            self.assertTrue(stats["min"] <= stats["p50"] <= stats["p99"] <= stats["max"])
+
+            # outside of timed(), queries are not counted
+            conn.execute("SELECT 1")
+            self.assertEqual(counter.count, 20)
+        finally:
+            counter.remove()
+            conn.close()
+
+    def test_compare(self):
+        stats = {"p50": 0.001, "p95": 0.002, "p99": 0.004, "queries": 1}
+        baseline = {"1000": {"f": stats, "g": stats}}
+        faster = {"1000": {"f": dict(stats, p99=0.0045), "h": dict(stats, p50=1.0)}}
+        self.assertEqual(benchmark.compare(faster, baseline, tolerance=0.2), [])
+        slower = {"1000": {"f": dict(stats, p99=0.006), "g": dict(stats, queries=3)}}
+        regressions = benchmark.compare(slower, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith("1000 f: p99"))
+        self.assertTrue(regressions[1].startswith("1000 g: queries"))
+
+    def test_save_load_results(self):
+        results = {"1000": {"f": {"p50": 0.001, "p95": 0.002, "p99": 0.004, "queries": 1}}}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "results.json")
+            benchmark.save_results(path, results)
+            self.assertEqual(benchmark.load_results(path), results)
+            self.assertEqual(os.listdir(tmpdir), ["results.json"])
@@ -0,0 +1,66 @@
+from morus.cache import LRUCache
+from morus.testing.base import MorusTestCase
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(MorusTestCase):
+
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # touching "a" makes "b" least recently used
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertEqual(sorted(cache.keys()), ["a", "c"])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(maxsize=10, ttl=5, clock=clock)
+        cache.set("a", 1)
+        clock.now = 4.9
+        self.assertEqual(cache.get("a"), 1)
+        clock.now = 5.0
+        self.assertEqual(cache.get("a", "gone"), "gone")
+        self.assertEqual(cache.expirations, 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_get_or_load(self):
+        cache = LRUCache(maxsize=10)
+        calls = []
+        loader = lambda: calls.append(1) or len(calls)
+        self.assertEqual(cache.get_or_load("a", loader), 1)
+        self.assertEqual(cache.get_or_load("a", loader), 1)
+        self.assertEqual(len(calls), 1)
+
+    def test_get_or_load_invalidated(self):
+        # a load racing an invalidation is returned but not cached
+        cache = LRUCache(maxsize=10)
+        loader = lambda: cache.invalidate(lambda key: True) or "stale"
+        self.assertEqual(cache.get_or_load("a", loader), "stale")
+        self.assertFalse("a" in cache)
+
+    def test_invalidate(self):
+        cache = LRUCache(maxsize=10)
+        for key in [("x", 1), ("x", 2), ("y", 1)]:
+            cache.set(key, True)
+        self.assertEqual(cache.invalidate(lambda key: key[0] == "x"), 2)
+        self.assertEqual(cache.keys(), [("y", 1)])
+
+    def test_stats(self):
+        cache = LRUCache(maxsize=10)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import threading
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from morus.testing.base import MorusTestCase
+from morus.testing.database import database_dsn, rolled_back
+
+
+def sqlite_engine(url):
+    """engine whose transactions & savepoints are emitted by SQLAlchemy, as
+    pysqlite's own transaction handling does not support SAVEPOINT"""
+    engine = sqlalchemy.create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(conn):
+        conn.execute("BEGIN")
+
+    return engine
+
+
+class TestRolledBack(MorusTestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+        self.engine = sqlite_engine("sqlite:///{}".format(self.path))
+        self.engine.execute("CREATE TABLE t (x INTEGER)")
+        self.engine.execute("INSERT INTO t VALUES (1)")
+        self.session = scoped_session(sessionmaker(bind=self.engine))
+        self.addCleanup(self.session.remove)
+
+    def values(self, session=None):
+        session = session or self.session
+        return [x for (x,) in session.execute("SELECT x FROM t ORDER BY x")]
+
+    def test_commit_rolled_back(self):
+        with rolled_back(self.session, self.engine):
+            self.session.execute("INSERT INTO t VALUES (2)")
+            self.session.commit()
+            self.session.execute("INSERT INTO t VALUES (3)")
+            self.session.rollback()
+            self.assertEqual(self.values(), [1, 2])
+            self.session.execute("DELETE FROM t")
+            self.session.commit()
+            self.assertEqual(self.values(), [])
+        self.assertEqual(self.values(), [1])
+        self.assertEqual([x for (x,) in self.engine.execute("SELECT x FROM t")], [1])
+
+    def test_shared_between_threads(self):
+        seen = []
+
+        def other_thread(insert):
+            seen.append(self.values())
+            self.session.execute("INSERT INTO t VALUES ({})".format(insert))
+            if insert == 3:
+                self.session.commit()
+            # uncommitted work is discarded when the session is closed
+            self.session.remove()
+
+        with rolled_back(self.session, self.engine) as conn:
+            self.session.execute("INSERT INTO t VALUES (2)")
+            self.session.commit()
+            for insert in (3, 4):
+                t = threading.Thread(target=other_thread, args=(insert,))
+                t.start()
+                t.join()
+            self.assertEqual(seen, [[1, 2], [1, 2, 3]])
+            self.assertEqual(self.values(), [1, 2, 3])
+            self.assertEqual([x for (x,) in conn.execute("SELECT count(*) FROM t")], [3])
+        self.assertEqual(self.values(), [1])
+
+    def test_sessions_restored(self):
+        with rolled_back(self.session, self.engine) as conn:
+            shared = conn.connection
+            self.assertTrue(self.session.connection().connection is shared)
+        self.assertTrue(conn.closed)
+        self.assertFalse(self.session.connection().connection is shared)
+
+
+class TestDatabaseDsn(MorusTestCase):
+
+    def test_database_dsn(self):
+        self.assertEqual(database_dsn("postgresql://u:p@localhost:5432/testdb", "testdb_1"),
+                         "postgresql://u:p@localhost:5432/testdb_1")
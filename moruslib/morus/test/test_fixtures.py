@@ -1,8 +1,19 @@
 import os
+import socket
 import sys
+import urllib.request
+
+from flask import Flask
 
 from morus.testing.base import MorusTestCase
-from morus.testing.fixtures import mkportslockdir, mock_stderr, mock_stdout, unused_port
+from morus.testing.fixtures import (
+    background_instance,
+    mkportslockdir,
+    mock_stderr,
+    mock_stdout,
+    unused_port,
+    wait_for_port,
+)
 
 
 class TestTestingFixtures(MorusTestCase):
@@ -33,3 +44,15 @@ class TestTestingFixtures(MorusTestCase):
             print("Test STDOUT")
             self.assertEqual(_stdout.getvalue().strip(), "Test STDOUT")
 
+    def test_background_instance(self):
+        app = Flask("testapp")
+        app.route("/")(lambda: "ok")
+        with unused_port() as port:
+            with background_instance(app, port, threaded=False, ready_path="/") as base_url:
+                with urllib.request.urlopen(base_url) as r:
+                    self.assertEqual(r.read(), b"ok")
+            # stopped on exit
+            with self.assertRaises(OSError):
+                socket.create_connection(("localhost", port), timeout=1)
+            with self.assertRaises(TimeoutError):
+                wait_for_port(port, timeout=0.05)
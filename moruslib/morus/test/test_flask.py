@@ -1,12 +1,13 @@
 import io
 import os
 import sys
+import time
 from unittest import mock
 
-from flask import jsonify
+from flask import jsonify, request
 
 from morus.flask.app import ConfiguredAppArgParser, parse_args, configured_app
-from morus.flask.decorators import require_https
+from morus.flask.decorators import etag, require_https
 from morus.testing.fixtures import mock_stderr, unused_port
 from morus.testing.base import MorusTestCase
 
@@ -52,3 +53,121 @@ class TestFlaskTestCase(MorusTestCase):
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.headers['Location'], 'https://localhost/https-only')
 
+
+    def test_etag(self):
+        calls = []
+
+        @self.app.route('/content-hash')
+        @etag()
+        def content_hash():
+            calls.append(1)
+            return jsonify({"calls": 1})
+
+        response = self.client.get('/content-hash')
+        self.assertEqual(response.status_code, 200)
+        tag = response.headers['ETag']
+        response = self.client.get('/content-hash', headers={'If-None-Match': tag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], tag)
+        self.assertEqual(len(calls), 2)
+
+    def test_etag_version(self):
+        calls = []
+        version = [1]
+
+        @self.app.route('/versioned')
+        @etag(lambda: version[0])
+        def versioned():
+            calls.append(1)
+            return jsonify({"version": version[0]})
+
+        response = self.client.get('/versioned?a=1')
+        tag = response.headers['ETag']
+        # matching tag is answered without calling the endpoint
+        response = self.client.get('/versioned?a=1', headers={'If-None-Match': tag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(calls), 1)
+        # tag depends on the url
+        response = self.client.get('/versioned?a=2', headers={'If-None-Match': tag})
+        self.assertEqual(response.status_code, 200)
+        # and on the version
+        version[0] = 2
+        response = self.client.get('/versioned?a=1', headers={'If-None-Match': tag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], tag)
+
+    def test_metrics(self):
+        import sqlalchemy
+
+        app = configured_app("testapp", metrics=True)
+        engine = sqlalchemy.create_engine("sqlite://")
+
+        @app.route('/items/<int:item_id>')
+        def item(item_id):
+            for i in range(3):
+                engine.execute("SELECT 1").fetchall()
+            return jsonify({"item_id": item_id})
+
+        client = app.test_client()
+        for item_id in (1, 2):
+            response = client.get('/items/{}'.format(item_id))
+        self.assertTrue(response.headers['Server-Timing'].startswith('app;dur='))
+        client.get('/nope')
+
+        response = client.get('/metrics')
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        labels = '{endpoint="/items/<int:item_id>",method="GET",status="200"}'
+        self.assertTrue('http_request_duration_seconds_count{} 2\n'.format(labels) in text)
+        self.assertTrue('db_queries_total{} 6.0\n'.format(labels) in text)
+        # unmatched paths share one label value
+        self.assertTrue('endpoint="<unmatched>",method="GET",status="404"' in text)
+
+    def test_profiler(self):
+
+        class config:
+            PROFILE_SAMPLE_EVERY = 0
+            PROFILE_TOKEN = "secret"
+            PROFILE_INTERVAL = 0.001
+
+        app = configured_app("testapp", config_module=config, profile=True)
+
+        def slow_work():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+
+        @app.route('/slow')
+        def slow():
+            slow_work()
+            return jsonify({})
+
+        client = app.test_client()
+        trusted = {"X-Profile": "secret"}
+        client.get('/slow')
+        self.assertEqual(client.get('/admin/profiles', headers=trusted).get_json()["profiles"], [])
+        self.assertEqual(client.get('/admin/profiles').status_code, 403)
+
+        client.get('/slow', headers=trusted)
+        summary = client.get('/admin/profiles', headers=trusted).get_json()
+        profiles = [p for p in summary["profiles"] if p["endpoint"] == "/slow"]
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0]["status"], 200)
+        self.assertGreater(profiles[0]["samples"], 5)
+
+        response = client.get('/admin/profiles/collapsed?endpoint=/slow', headers=trusted)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertTrue(lines)
+        (stack, count) = lines[0].rsplit(" ", 1)
+        self.assertTrue(stack.split(";")[-1].startswith("slow_work (test/test_flask.py:"))
+        self.assertGreater(int(count), 0)
+
+    def test_proxy_fix(self):
+        app = configured_app("testapp", proxy_fix=True)
+
+        @app.route('/remote')
+        def remote():
+            return jsonify({"remote_addr": request.remote_addr})
+
+        response = app.test_client().get('/remote', headers={"X-Forwarded-For": "10.0.0.1"})
+        self.assertEqual(response.get_json(), {"remote_addr": "10.0.0.1"})
@@ -0,0 +1,83 @@
+import logging
+import threading
+
+from morus.logging import configure_logging, getLogger, stop_logging
+from morus.testing.base import MorusTestCase
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.records.append(record)
+        self.threads.add(threading.current_thread().name)
+
+
+class Expensive(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "expensive"
+
+
+class TestLogging(MorusTestCase):
+
+    def setUp(self):
+        self.handler = ListHandler()
+        self.addCleanup(stop_logging)
+        self.addCleanup(logging.getLogger().setLevel, logging.getLogger().level)
+        self.log = getLogger("morus.test.logging")
+        self.addCleanup(self.log.setLevel, logging.NOTSET)
+
+    def test_get_logger(self):
+        self.assertEqual(self.log.name, "morus.test.logging")
+        self.assertEqual(self.log.level, logging.NOTSET)
+
+    def test_lazy_args(self):
+        configure_logging(level="INFO", handlers=[self.handler])
+        arg = Expensive()
+        self.log.debug("not written: %s", arg)
+        self.assertEqual(arg.calls, 0)
+        self.log.info("written: %s", arg)
+        stop_logging()
+        self.assertEqual([r.getMessage() for r in self.handler.records], ["written: expensive"])
+
+    def test_background(self):
+        configure_logging(level="DEBUG", handlers=[self.handler])
+        rows = [1]
+        self.log.debug("rows: %s", rows)
+        # args are merged on the calling thread, later changes are not logged
+        rows.append(2)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.log.exception("failed")
+        stop_logging()
+        self.assertEqual([r.getMessage() for r in self.handler.records], ["rows: [1]", "failed"])
+        self.assertTrue("ValueError: boom" in self.handler.records[1].exc_text)
+        self.assertFalse(threading.current_thread().name in self.handler.threads)
+
+    def test_levels(self):
+        configure_logging(level="WARNING", levels={"morus.test.logging": "DEBUG"},
+                          handlers=[self.handler], background=False)
+        self.log.debug("debug")
+        getLogger("morus.test.other").info("info")
+        self.assertEqual([r.getMessage() for r in self.handler.records], ["debug"])
+
+    def test_sampling(self):
+        configure_logging(level="DEBUG", handlers=[self.handler], debug_sample_every=10)
+        for i in range(25):
+            self.log.debug("sampled %s", i)
+            self.log.info("not sampled %s", i)
+        stop_logging()
+        messages = [r.getMessage() for r in self.handler.records]
+        self.assertEqual([m for m in messages if m.startswith("sampled")],
+                         ["sampled 0", "sampled 10", "sampled 20"])
+        self.assertEqual(len([m for m in messages if m.startswith("not sampled")]), 25)
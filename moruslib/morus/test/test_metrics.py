@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+
+from morus.metrics import Registry
+from morus.testing.base import MorusTestCase
+
+
+class TestMetrics(MorusTestCase):
+
+    def test_histogram(self):
+        registry = Registry()
+        latency = registry.histogram("latency_seconds", "Latency", ["endpoint"],
+                                     buckets=[0.1, 1.0])
+        for value in (0.05, 0.5, 0.5, 5.0):
+            latency.observe(value, "/a")
+        text = registry.expose()
+        self.assertTrue('latency_seconds_bucket{endpoint="/a",le="0.1"} 1\n' in text)
+        self.assertTrue('latency_seconds_bucket{endpoint="/a",le="1.0"} 3\n' in text)
+        self.assertTrue('latency_seconds_bucket{endpoint="/a",le="+Inf"} 4\n' in text)
+        self.assertTrue('latency_seconds_sum{endpoint="/a"} 6.05\n' in text)
+        self.assertTrue('latency_seconds_count{endpoint="/a"} 4\n' in text)
+
+    def test_label_escaping(self):
+        registry = Registry()
+        registry.counter("c_total", "C", ["path"]).inc('say "hi"\n')
+        self.assertTrue(r'c_total{path="say \"hi\"\n"} 1.0' in registry.expose())
+
+    def test_multiprocess(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        # two registries sharing a dir stand in for two worker processes
+        # as by a worker reusing the pid of one which has exited
+        registries = [Registry(multiprocess_dir=path) for i in range(2)]
+        for (i, registry) in enumerate(registries):
+            registry.counter("requests_total", "Requests", ["method"]).inc("GET", amount=i + 1)
+            registry.histogram("latency_seconds", "Latency", buckets=[1.0]).observe(0.5)
+        registries[1].flush(force=True)
+        text = registries[0].expose()
+        self.assertEqual(len(os.listdir(path)), 2)
+        self.assertTrue('requests_total{method="GET"} 3.0\n' in text)
+        self.assertTrue('latency_seconds_count 2\n' in text)
+
+    def test_fork(self):
+        registry = Registry()
+        counter = registry.counter("requests_total", "Requests")
+        counter.inc()
+        # as seen from a forked child: the parent's values are not its own
+        registry._pid = -1
+        counter.inc()
+        self.assertEqual(registry.snapshot(), {"requests_total": [[[], 1.0]]})
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import threading
+
+import sqlalchemy
+from sqlalchemy import exc
+
+from morus.pool import (
+    InstrumentedNullPool,
+    InstrumentedQueuePool,
+    engine_options,
+    pool_stats,
+)
+from morus.testing.base import MorusTestCase
+
+
+class TestPool(MorusTestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        self.url = "sqlite:///{}".format(self.path)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_engine_options(self):
+        options = engine_options(pool_size=3, pool_pre_ping=True)
+        self.assertEqual(options, {"poolclass": InstrumentedQueuePool,
+                                   "pool_size": 3, "pool_pre_ping": True})
+        options = engine_options(pool_size=3, pool_recycle=60, pgbouncer=True)
+        self.assertEqual(options, {"poolclass": InstrumentedNullPool, "pool_recycle": 60})
+
+    def test_pool_stats(self):
+        engine = sqlalchemy.create_engine(self.url, **engine_options(
+            pool_size=1, max_overflow=1, pool_timeout=0.05))
+        first = engine.connect()
+        second = engine.connect()
+        stats = pool_stats(engine.pool)
+        self.assertEqual((stats["checked_out"], stats["overflow"]), (2, 1))
+        self.assertEqual((stats["checkouts"], stats["connects"]), (2, 2))
+
+        # size + max_overflow reached: the next checkout waits, then fails
+        with self.assertRaises(exc.TimeoutError):
+            engine.connect()
+        stats = pool_stats(engine.pool)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["max_wait_seconds"], 0.05)
+
+        # a waiting checkout succeeds once a connection is returned
+        threading.Timer(0.05, first.close).start()
+        engine.pool._timeout = 5
+        engine.connect().close()
+        second.close()
+        stats = pool_stats(engine.pool)
+        self.assertEqual((stats["checkouts"], stats["connects"]), (3, 2))
+        self.assertEqual(stats["max_overflow_seen"], 1)
+
+    def test_recreate(self):
+        engine = sqlalchemy.create_engine(self.url, **engine_options(pool_size=1))
+        engine.connect().close()
+        engine.dispose()
+        engine.connect().close()
+        self.assertEqual(pool_stats(engine.pool)["checkouts"], 2)
@@ -0,0 +1,136 @@
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+
+from flask import Flask, jsonify
+
+from morus.flask.metrics import install_metrics
+from morus.flask.serve import PoolWSGIServer, listen, rss_bytes, serve
+from morus.testing.base import MorusTestCase
+from morus.testing.fixtures import unused_port, wait_for_port
+
+
+def create_app():
+    app = Flask("test_serve")
+
+    @app.route("/pid")
+    def pid():
+        return jsonify({"pid": os.getpid()})
+
+    @app.route("/slow")
+    def slow():
+        time.sleep(0.5)
+        return jsonify({"pid": os.getpid()})
+
+    return app
+
+
+def get(port, path):
+    with urllib.request.urlopen("http://127.0.0.1:{}{}".format(port, path),
+                                timeout=10) as r:
+        return (r.status, json.loads(r.read().decode("utf8")))
+
+
+class TestServe(MorusTestCase):
+
+    def start(self, port, app=None, **kwargs):
+        ctx = multiprocessing.get_context("fork")
+        master = ctx.Process(target=serve, args=(app or create_app(), port), kwargs=kwargs,
+                             daemon=True)
+        master.start()
+        self.addCleanup(master.join, 10)
+        self.addCleanup(master.terminate)
+        wait_for_port(port, host="127.0.0.1")
+        return master
+
+    def test_workers_recycled(self):
+        with unused_port() as port:
+            master = self.start(port, workers=2, threads=2, max_requests=2)
+            pids = set()
+            for i in range(8):
+                (status, body) = get(port, "/pid")
+                self.assertEqual(status, 200)
+                pids.add(body["pid"])
+            self.assertNotIn(master.pid, pids)
+            # each worker served at most 2, so were replaced
+            self.assertGreaterEqual(len(pids), 4)
+
+    def test_metrics_flushed_at_exit(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        app = create_app()
+        # only flushed periodically after the first request
+        app.config["METRICS_FLUSH_SECONDS"] = 3600
+        install_metrics(app, multiprocess_dir=path)
+        with unused_port() as port:
+            self.start(port, app=app, workers=1, threads=1, max_requests=2)
+            for i in range(4):
+                get(port, "/pid")
+            with urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(port),
+                                        timeout=10) as r:
+                text = r.read().decode("utf8")
+        # counted by both recycled workers, each in a file of its own
+        labels = '{endpoint="/pid",method="GET",status="200"}'
+        self.assertTrue("http_request_duration_seconds_count{} 4\n".format(labels) in text,
+                        text)
+        self.assertEqual(len(os.listdir(path)), 3)
+
+    def test_graceful_shutdown(self):
+        (fd, exited) = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, exited)
+
+        def before_exit():
+            with open(exited, "a") as f:
+                f.write("{}\n".format(os.getpid()))
+
+        with unused_port() as port:
+            master = self.start(port, workers=1, threads=2, graceful_timeout=5,
+                                before_exit=before_exit)
+            results = []
+            client = threading.Thread(target=lambda: results.append(get(port, "/slow")))
+            client.start()
+            time.sleep(0.2)
+            os.kill(master.pid, signal.SIGTERM)
+            client.join(10)
+            master.join(10)
+            # the request in flight finished, then the master exited cleanly
+            self.assertEqual(results[0][0], 200)
+            self.assertEqual(master.exitcode, 0)
+            # then the worker ran before_exit()
+            with open(exited) as f:
+                self.assertEqual(f.read().split(), [str(results[0][1]["pid"])])
+
+    def test_accepts_only_with_a_free_thread(self):
+        sock = listen("127.0.0.1", 0)
+        self.addCleanup(sock.close)
+        port = sock.getsockname()[1]
+        server = PoolWSGIServer("127.0.0.1", port, create_app(), threads=1, fd=sock.fileno())
+        self.addCleanup(server.server_close)
+        client = socket.create_connection(("127.0.0.1", port))
+        self.addCleanup(client.close)
+
+        # the only thread is busy: the connection is left on the socket
+        server._slots.acquire()
+        with self.assertRaises(BlockingIOError):
+            server.get_request()
+        server._slots.release()
+        (conn, addr) = server.get_request()
+        conn.close()
+        # & the slot is held until the request is processed
+        self.assertFalse(server._slots.acquire(blocking=False))
+        server._slots.release()
+        # no connection waiting: the slot is given back
+        with self.assertRaises(BlockingIOError):
+            server.get_request()
+        self.assertTrue(server._slots.acquire(blocking=False))
+
+    def test_rss_bytes(self):
+        self.assertGreater(rss_bytes(), 2 ** 20)
@@ -0,0 +1,25 @@
+from morus import startup
+from morus.testing.base import MorusTestCase
+
+
+class TestStartup(MorusTestCase):
+
+    def test_import_times(self):
+        times = {t.module: t for t in startup.import_times("json")}
+        self.assertEqual(times["json"].depth, 0)
+        self.assertEqual(times["json.decoder"].depth, 1)
+        self.assertGreaterEqual(times["json"].cumulative, times["json.decoder"].cumulative)
+
+    def test_imported_modules(self):
+        imported = startup.imported_modules("import json")
+        self.assertIn("json", imported)
+        self.assertNotIn("sqlite3", imported)
+        # the caller's sys.path
+        self.assertIn("morus.startup", startup.imported_modules("import morus.startup"))
+
+    def test_cold_start(self):
+        elapsed = startup.cold_start("import time; time.sleep(0.01)", repeat=2)
+        self.assertEqual(len(elapsed), 2)
+        for seconds in elapsed:
+            self.assertGreaterEqual(seconds, 0.01)
+            self.assertLess(seconds, 1)
@@ -0,0 +1,98 @@
+import queue
+import threading
+import time
+
+from morus.testing.base import MorusTestCase
+from morus.writebehind import BatchWriter
+
+
+class TestBatchWriter(MorusTestCase):
+
+    def writer(self, write, **kwargs):
+        writer = BatchWriter(write, **kwargs)
+        self.addCleanup(writer.close, 1.0)
+        return writer
+
+    def test_batches(self):
+        batches = []
+        writer = self.writer(batches.append, max_batch=3, max_delay=10.0)
+        for i in range(7):
+            writer.put(i)
+        start = time.monotonic()
+        self.assertTrue(writer.flush(timeout=5.0))
+        # flushing does not wait for more items to join a batch
+        self.assertLess(time.monotonic() - start, 5.0)
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+        stats = writer.stats()
+        self.assertEqual((stats["put"], stats["written"], stats["batches"], stats["queued"]),
+                         (7, 7, 3, 0))
+
+    def test_coalesces(self):
+        batches = []
+        writer = self.writer(batches.append, max_delay=0.2)
+        writer.put("a")
+        writer.put("b")
+        writer.flush()
+        self.assertEqual(batches, [["a", "b"]])
+        self.assertGreater(writer.stats()["max_lag_seconds"], 0)
+
+    def test_backpressure(self):
+        release = threading.Event()
+        writer = self.writer(lambda batch: release.wait(), max_batch=1, max_delay=0,
+                             maxsize=1, put_timeout=0.05)
+        self.addCleanup(release.set)
+        writer.put(1)
+        # 1 is being written, 2 fills the queue
+        deadline = time.monotonic() + 5
+        while writer.stats()["queued"] and time.monotonic() < deadline:
+            time.sleep(0.005)
+        writer.put(2)
+        with self.assertRaises(queue.Full):
+            writer.put(3)
+        self.assertEqual(writer.stats()["rejected"], 1)
+        release.set()
+        self.assertTrue(writer.flush(timeout=5.0))
+        self.assertEqual(writer.stats()["written"], 2)
+
+    def test_retries(self):
+        calls = []
+
+        def flaky(batch):
+            calls.append(batch)
+            if len(calls) == 1 or batch == ["bad"]:
+                raise RuntimeError("db down")
+
+        writer = self.writer(flaky, max_delay=0, retries=1, retry_delay=0)
+        writer.put("good")
+        writer.flush()
+        writer.put("bad")
+        writer.flush()
+        stats = writer.stats()
+        self.assertEqual((stats["written"], stats["failed"], stats["retried"]), (1, 1, 2))
+        self.assertEqual(calls, [["good"], ["good"], ["bad"], ["bad"]])
+
+    def test_isolates_failures(self):
+        calls = []
+
+        def strict(batch):
+            calls.append(batch)
+            if "bad" in batch:
+                raise ValueError("bad item")
+
+        writer = self.writer(strict, max_delay=10.0, retries=1, retry_delay=0)
+        for item in ("a", "bad", "b"):
+            writer.put(item)
+        writer.flush()
+        # the batch is retried, then written an item at a time
+        self.assertEqual(calls, [["a", "bad", "b"]] * 2 + [["a"], ["bad"], ["b"]])
+        stats = writer.stats()
+        self.assertEqual((stats["written"], stats["failed"], stats["batches"]), (2, 1, 1))
+
+    def test_close(self):
+        batches = []
+        writer = self.writer(batches.append, max_delay=10.0)
+        writer.put(1)
+        self.assertTrue(writer.close(timeout=5.0))
+        self.assertEqual(batches, [[1]])
+        with self.assertRaises(RuntimeError):
+            writer.put(2)
@@ -0,0 +1,221 @@
+"""
+Tests against a real db, rolled back afterwards rather than recreated, and
+run in parallel against a postgres db of their own
+
+Create the schema & fixture data once, then run each test in
+
+    with rolled_back(db.session, db.engine):
+        ...
+
+Every session the scoped_session creates meanwhile, in any thread (eg that
+of a background_instance serving the app), is bound to one connection in
+a transaction which is rolled back on exit.  Sessions work in a SAVEPOINT,
+restarted whenever they commit or roll back, so code under test may do
+either as usual.
+
+The connection is shared, so sessions must take turns: serve the app
+with threaded=False.  Work done via other connections (other engines, other
+processes) is not rolled back, and does not see the transaction's.
+
+To run tests in parallel, each process clones a template db once built &
+seeded, & runs against its clone (CREATE DATABASE ... TEMPLATE copies files,
+so is much quicker than creating the schema & fixture data again):
+
+    template = template_database(dsn, "testdb_template", seed, fingerprint)
+    with cloned_database(dsn, template) as clone_dsn:
+        ...
+
+Processes coordinate through lock files in /tmp/db-locks, like unused_port:
+the template is built by one process while the others wait, and each clone
+is named after the first free slot, so clones left by a crashed run are
+dropped & reused rather than accumulating.  The db user needs CREATEDB.
+"""
+import contextlib
+import fcntl
+import itertools
+import os
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+
+from morus.testing.fixtures import mklockdir
+
+
+def _restart_savepoint(session, transaction):
+    if session._rolled_back_closing:
+        return
+    if transaction.nested and not transaction._parent.nested:
+        # the savepoint was committed or rolled back, expire as the end of a
+        # real transaction would
+        session.expire_all()
+        session.begin_nested()
+
+
+class _SavepointSessionMixin(object):
+
+    _rolled_back_closing = False
+
+    def close(self):
+        # discard work left uncommitted, as closing a session does without
+        # the outer transaction
+        self._rolled_back_closing = True
+        try:
+            if self.transaction is not None and self.transaction.nested:
+                self.rollback()
+        finally:
+            super(_SavepointSessionMixin, self).close()
+
+
+def _savepoint_session_factory(session_factory, conn):
+    """session_factory (a sessionmaker) creating sessions bound to conn,
+    each in a savepoint"""
+    cls = type("Savepoint" + session_factory.class_.__name__,
+               (_SavepointSessionMixin, session_factory.class_), {})
+
+    def create(**kwargs):
+        # no per table binds (as flask_sqlalchemy sets), every statement
+        # runs on conn
+        session = cls(**dict(session_factory.kw, bind=conn, binds={}, **kwargs))
+        session.begin_nested()
+        event.listen(session, "after_transaction_end", _restart_savepoint)
+        return session
+    return create
+
+
+@contextlib.contextmanager
+def rolled_back(scoped_session, engine):
+    """sessions of scoped_session share a connection of engine for the
+    duration of the context, their work rolled back on exit
+
+    yields the connection, for statements to be run in the same
+    transaction"""
+    conn = engine.connect()
+    outer = conn.begin()
+    registry = scoped_session.registry
+    createfunc = registry.createfunc
+    scoped_session.remove()
+    registry.createfunc = _savepoint_session_factory(scoped_session.session_factory, conn)
+    try:
+        yield conn
+    finally:
+        scoped_session.remove()
+        registry.createfunc = createfunc
+        outer.rollback()
+        conn.close()
+
+
+def mkdblockdir():
+    """create /tmp/db-locks, see mklockdir"""
+    return mklockdir('db-locks')
+
+
+def database_dsn(dsn, name):
+    """dsn with its database replaced by name"""
+    url = make_url(dsn)
+    if hasattr(url, "set"):
+        # immutable, & str() hides the password, in SQLAlchemy >= 1.4
+        return url.set(database=name).render_as_string(hide_password=False)
+    url.database = name
+    return str(url)
+
+
+def _admin_engine(dsn):
+    return sqlalchemy.create_engine(dsn, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+
+
+def _quote(engine, name):
+    return engine.dialect.identifier_preparer.quote(name)
+
+
+def _disconnect(conn, name):
+    """terminate other connections to database name, which would prevent
+    it being dropped or cloned"""
+    conn.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                 "WHERE datname = %s AND pid <> pg_backend_pid()", (name,))
+
+
+def _drop(conn, name):
+    _disconnect(conn, name)
+    conn.execute("DROP DATABASE IF EXISTS {}".format(_quote(conn, name)))
+
+
+def _fingerprint(conn, name):
+    """comment of database name, None if it does not exist"""
+    row = conn.execute("SELECT coalesce(shobj_description(oid, 'pg_database'), '') "
+                       "FROM pg_database WHERE datname = %s", (name,)).fetchone()
+    return row[0] if row else None
+
+
+@contextlib.contextmanager
+def _flock(path, operation):
+    with open(path, "a") as f:
+        fcntl.flock(f, operation)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def template_database(dsn, name, seed, fingerprint="", lockdir=None):
+    """database name on dsn's server, built by seed(template_dsn) unless it
+    exists with the same fingerprint, eg a hash of the schema & fixtures
+
+    seed() must close its connections before returning; the template is
+    not connected to again, so it may be cloned
+
+    returns name"""
+    lockdir = lockdir or mkdblockdir()
+    engine = _admin_engine(dsn)
+    try:
+        with _flock(os.path.join(lockdir, name), fcntl.LOCK_EX):
+            with engine.connect() as conn:
+                if _fingerprint(conn, name) == fingerprint:
+                    return name
+                _drop(conn, name)
+                conn.execute("CREATE DATABASE {}".format(_quote(conn, name)))
+            seed(database_dsn(dsn, name))
+            with engine.connect() as conn:
+                _disconnect(conn, name)
+                # marks the template complete
+                conn.execute("COMMENT ON DATABASE {} IS %s".format(_quote(conn, name)),
+                             (fingerprint,))
+    finally:
+        engine.dispose()
+    return name
+
+
+@contextlib.contextmanager
+def cloned_database(dsn, template, lockdir=None):
+    """a database of this process' own, cloned from template for the
+    duration of the context & dropped on exit
+
+    yields its dsn"""
+    lockdir = lockdir or mkdblockdir()
+    engine = _admin_engine(dsn)
+    with contextlib.ExitStack() as stack:
+        stack.callback(engine.dispose)
+        for slot in itertools.count(1):
+            name = "{}_{}".format(template, slot)
+            slot_lock = open(os.path.join(lockdir, name), "a")
+            try:
+                # released by the OS if this process dies, so the slot (&
+                # any clone it left) is reused
+                fcntl.flock(slot_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                slot_lock.close()
+        stack.callback(slot_lock.close)
+        with engine.connect() as conn:
+            _drop(conn, name)
+            # shared, so clones are created concurrently but not while
+            # the template is being built
+            with _flock(os.path.join(lockdir, template), fcntl.LOCK_SH):
+                conn.execute("CREATE DATABASE {} TEMPLATE {}".format(
+                    _quote(conn, name), _quote(conn, template)))
+        try:
+            yield database_dsn(dsn, name)
+        finally:
+            with engine.connect() as conn:
+                _drop(conn, name)
@@ -6,6 +6,7 @@ import logging
 import multiprocessing
 import os
 import socket
+import socketserver
 import sys
 import tempfile
 import threading
@@ -14,13 +15,13 @@ import time
 log = logging.getLogger(__name__)
 
 
-def mkportslockdir():
-    """create /tmp/ports-lock in a consistent way
+def mklockdir(name):
+    """create /tmp/<name> in a consistent way
 
-    we want to share port-locks directory across multiple processes for
+    we want to share lock directories across multiple processes for
     CI server, potentially multiple users if CI server runs each process
     as owner & multiple services are testing simultaneously"""
-    lockdir = os.path.sep.join([tempfile.gettempdir(), 'port-locks'])
+    lockdir = os.path.sep.join([tempfile.gettempdir(), name])
     try:
         os.mkdir(lockdir)
         os.chmod(lockdir, 0o777)
@@ -30,6 +31,11 @@ def mkportslockdir():
     return lockdir
 
 
+def mkportslockdir():
+    """create /tmp/port-locks, see mklockdir"""
+    return mklockdir('port-locks')
+
+
 @contextlib.contextmanager
 def mock_stderr():
     """monkeypatches sys.stderr for duration of context"""
@@ -129,48 +135,131 @@ def unused_port(lockdir=None):
                     continue
 
 
-def _bginst(app, port, https=False, ssl_crt=None, ssl_key=None):
-    """start a daemonized instance of app listening on port in background
-    (shared target function for thread & multiprocess implementations)"""
-    if https:
-        app.run(port=port, ssl_context=(ssl_crt, ssl_key), use_reloader=False)
-    else:
-        app.run(port=port, use_reloader=False)
+# seconds to wait for a background instance to accept connections
+READY_TIMEOUT = 10.0
+
+# how often a background instance checks whether to stop serving
+SHUTDOWN_POLL_INTERVAL = 0.01
+
+
+def wait_for_port(port, host="localhost", timeout=READY_TIMEOUT, interval=0.005):
+    """block until host:port accepts connections, raising TimeoutError if it
+    does not within timeout seconds
+
+    >>> s = socket.socket()
+    >>> s.bind(('localhost', 0))  # bound, not listening
+    >>> wait_for_port(s.getsockname()[1], timeout=0.05)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    TimeoutError: localhost:... not listening after 0.05s
+    >>> s.close()
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=timeout).close()
+            return
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise TimeoutError("{}:{} not listening after {}s".format(host, port, timeout))
+            time.sleep(interval)
+
+
+def wait_for_url(url, timeout=READY_TIMEOUT, interval=0.005, ssl_context=None):
+    """block until GET url responds (with any status), eg a heartbeat
+    endpoint, raising TimeoutError if it does not within timeout seconds"""
+    import urllib.error
+    import urllib.request
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout=timeout, context=ssl_context).close()
+            return
+        except urllib.error.HTTPError:
+            return
+        except (OSError, urllib.error.URLError):
+            if time.monotonic() >= deadline:
+                raise TimeoutError("{} not responding after {}s".format(url, timeout))
+            time.sleep(interval)
+
+
+def _make_server(app, port, https=False, ssl_crt=None, ssl_key=None, threaded=True):
+    from werkzeug.serving import make_server
 
+    ssl_context = (ssl_crt, ssl_key) if https else None
+    return make_server("localhost", port, app, threaded=threaded, ssl_context=ssl_context)
 
-def background_instance_multiprocess(app, port, https=False, ssl_crt=None, ssl_key=None):
-    """call app.run() listening on port from daemonized process
 
-    ssl_crt & ssl_key are only required if https=True"""
+def _serve_until_shutdown(server):
+    # werkzeug's serve_forever() checks for shutdown() every 0.5s
+    socketserver.BaseServer.serve_forever(server, poll_interval=SHUTDOWN_POLL_INTERVAL)
+
+
+def _bginst(app, port, https=False, ssl_crt=None, ssl_key=None, threaded=True):
+    """serve app on port until terminated (target of multiprocess version)"""
+    server = _make_server(app, port, https, ssl_crt, ssl_key, threaded)
+    try:
+        _serve_until_shutdown(server)
+    finally:
+        server.server_close()
+
+
+def background_instance_multiprocess(app, port, https=False, ssl_crt=None, ssl_key=None,
+                                     threaded=True, timeout=READY_TIMEOUT):
+    """serve app on port from daemonized process, once it is listening
+
+    ssl_crt & ssl_key are only required if https=True
+
+    returns the multiprocessing.Process, terminate() it to stop serving"""
     p = multiprocessing.Process(target=_bginst,
-                                args=(app, port, https, ssl_crt, ssl_key))
+                                args=(app, port, https, ssl_crt, ssl_key, threaded))
     p.daemon = True
     p.start()
-    time.sleep(0.1)
+    wait_for_port(port, timeout=timeout)
+    return p
 
 
-def background_instance_threaded(app, port, https=False, ssl_crt=None, ssl_key=None):
-    """call app.run() listening on port in background thread
+def background_instance_threaded(app, port, https=False, ssl_crt=None, ssl_key=None,
+                                 threaded=True, timeout=READY_TIMEOUT):
+    """serve app on port from background thread, once it is listening
 
-    ssl_crt & ssl_key are only required if https=True"""
-    t = threading.Thread(target=_bginst, daemon=True,
-                         args=(app, port, https, ssl_crt, ssl_key))
+    threaded=False handles one request at a time, start to finish
+
+    ssl_crt & ssl_key are only required if https=True
+
+    returns the server, shutdown() then server_close() it to stop serving"""
+    server = _make_server(app, port, https, ssl_crt, ssl_key, threaded)
+    t = threading.Thread(target=_serve_until_shutdown, args=(server,), daemon=True)
     t.start()
-    time.sleep(0.1)
+    wait_for_port(port, timeout=timeout)
+    return server
 
 
 @contextlib.contextmanager
-def background_instance(app, port, https=False, ssl_crt=None, ssl_key=None):
-    """switch default implementation between multiprocess/threading versions"""
+def background_instance(app, port, https=False, ssl_crt=None, ssl_key=None,
+                        threaded=True, ready_path=None, timeout=READY_TIMEOUT):
+    """serve app on port in background for the duration of the context,
+    yielding its base url once it is listening (or, if ready_path is given,
+    responding to GET ready_path, eg a heartbeat endpoint)"""
     scheme = ('http', 'https')[int(https)]
     url = '{}://localhost:{}/'.format(scheme, port)
     app_id = app.config['SESSION_COOKIE_NAME']
     msg = 'bg {} listening at {}'.format(app_id, url)
     log.debug(msg)
+    server = background_instance_threaded(app, port, https=https, ssl_crt=ssl_crt,
+                                          ssl_key=ssl_key, threaded=threaded,
+                                          timeout=timeout)
     try:
-        background_instance_threaded(app, port, https=https,
-                                     ssl_crt=ssl_crt, ssl_key=ssl_key)
+        if ready_path is not None:
+            ssl_context = None
+            if https:
+                import ssl
+                # self-signed test certificates
+                ssl_context = ssl._create_unverified_context()
+            wait_for_url(url + ready_path.lstrip("/"), timeout=timeout,
+                         ssl_context=ssl_context)
         yield url
     finally:
-        pass
-
+        server.shutdown()
+        server.server_close()
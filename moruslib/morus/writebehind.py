@@ -0,0 +1,237 @@
+"""
+Write-behind: acknowledge work before it is persisted, & persist it in
+batches from a background thread
+
+    >>> batches = []
+    >>> writer = BatchWriter(batches.append, max_batch=2)
+    >>> for i in range(3):
+    ...     writer.put(i)
+    >>> writer.close()
+    True
+    >>> sorted(i for batch in batches for i in batch)
+    [0, 1, 2]
+
+Items put() are coalesced into batches of up to max_batch, each passed to
+write(batch), eg to insert them in one transaction: the writer waits up to
+max_delay seconds after an item is queued for more to join it.  The queue
+is bounded, so callers are slowed down rather than memory growing when
+writes fall behind: put() waits up to put_timeout seconds for room, then
+raises queue.Full.
+
+A failed write(batch) is retried `retries` times, then each of its items
+is written in a batch of its own, so that one bad item does not take the
+others down with it: only those which still fail are counted as failed &
+dropped.  Items queued are lost if the process dies
+before they are written: close() (registered to run at exit) & flush()
+wait for them.  stats() counts items put, written, failed & rejected, and
+how long items waited to be written (the window in which they could be
+lost).
+
+The thread is started by the first put(), so writers created before a
+prefork server forks run in each worker; a forked child drops the items
+its parent had queued, which are the parent's to write.
+"""
+import atexit
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+
+
+log = logging.getLogger(__name__)
+
+# seconds close() waits for queued items when the process exits
+EXIT_TIMEOUT = 10.0
+
+# open writers, closed at exit & reset in forked children
+_writers = weakref.WeakSet()
+
+
+class BatchWriter(object):
+    """bounded queue of items written in batches by a background thread,
+    see module docs"""
+
+    def __init__(self, write, max_batch=100, max_delay=0.05, maxsize=10000,
+                 put_timeout=1.0, retries=2, retry_delay=0.1, name="batch-writer",
+                 clock=time.monotonic):
+        if max_batch < 1 or maxsize < 1:
+            raise ValueError("max_batch & maxsize must be positive")
+        self.write = write
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.maxsize = maxsize
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.name = name
+        self.clock = clock
+        self._init()
+        _writers.add(self)
+
+    def _init(self):
+        self._cond = threading.Condition()
+        self._items = collections.deque()  # (queued at, item)
+        self._thread = None
+        self._closed = False
+        # flush() calls waiting, which should not wait for max_delay
+        self._flushing = 0
+        self.put_count = 0
+        self.done_count = 0  # written or failed
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+        self.batches = 0
+        self.retried = 0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """queue item to be written, waiting up to put_timeout seconds
+        (forever if None) while the queue is full, then raising queue.Full"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("{} is closed".format(self.name))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            if len(self._items) >= self.maxsize:
+                deadline = None if self.put_timeout is None else self.clock() + self.put_timeout
+                while len(self._items) >= self.maxsize:
+                    remaining = None if deadline is None else deadline - self.clock()
+                    if remaining is not None and remaining <= 0:
+                        self.rejected += 1
+                        raise queue.Full
+                    self._cond.wait(remaining)
+            self._items.append((self.clock(), item))
+            self.put_count += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """wait until items put so far are written (or failed), returns
+        False if they were not within timeout seconds"""
+        with self._cond:
+            target = self.put_count
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: self.done_count >= target, timeout)
+            finally:
+                self._flushing -= 1
+
+    def close(self, timeout=None):
+        """write the items queued & stop the thread; put() then raises
+        RuntimeError.  Returns False if items were left unwritten after
+        timeout seconds"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+            if thread.is_alive():
+                log.warning("%s: %s items unwritten after %ss", self.name,
+                            len(self._items), timeout)
+                return False
+        return True
+
+    def _next_batch(self):
+        """items to write next, None once closed & empty"""
+        with self._cond:
+            while not self._items:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            # let more items join the batch, unless waiting on it
+            deadline = self._items[0][0] + self.max_delay
+            while (len(self._items) < self.max_batch and not self._closed
+                   and not self._flushing):
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._items.popleft() for i in range(min(self.max_batch, len(self._items)))]
+            # room for put()
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            written = self._write([item for (queued, item) in batch])
+            now = self.clock()
+            with self._cond:
+                self.batches += 1
+                self.done_count += len(batch)
+                self.written += written
+                self.failed += len(batch) - written
+                if written:
+                    self.last_lag = now - batch[0][0]
+                    self.max_lag = max(self.max_lag, self.last_lag)
+                self._cond.notify_all()
+
+    def _write(self, items):
+        """write items, returns how many were written"""
+        if self._attempt(items, self.retries):
+            return len(items)
+        if len(items) == 1:
+            return 0
+        log.warning("%s: writing %s items one at a time", self.name, len(items))
+        return sum(1 for item in items if self._attempt([item], 0))
+
+    def _attempt(self, items, retries):
+        for attempt in range(retries + 1):
+            try:
+                self.write(items)
+                return True
+            except Exception:
+                if attempt < retries:
+                    log.warning("%s: write of %s items failed, retrying", self.name,
+                                len(items), exc_info=True)
+                    with self._cond:
+                        self.retried += 1
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                else:
+                    log.exception("%s: dropping %s items", self.name, len(items))
+        return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._items),
+                "maxsize": self.maxsize,
+                "put": self.put_count,
+                "written": self.written,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "batches": self.batches,
+                "retried": self.retried,
+                "avg_batch": (self.done_count / self.batches) if self.batches else None,
+                "oldest_queued_seconds": (self.clock() - self._items[0][0]) if self._items else 0.0,
+                "last_lag_seconds": self.last_lag,
+                "max_lag_seconds": self.max_lag,
+            }
+
+
+def _close_all():
+    for writer in list(_writers):
+        writer.close(EXIT_TIMEOUT)
+
+
+def _reset_after_fork():
+    for writer in list(_writers):
+        closed = writer._closed
+        writer._init()
+        writer._closed = closed
+
+
+atexit.register(_close_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,11 +1,27 @@
 #!/usr/bin/env python3
-from pplans.flask.app import configured_app, parse_args
+from morus.flask.serve import serve, serve_kwargs
+
+from pplans.flask.app import configured_app, parse_args, preload
+from pplans.models import db
+from pplans.warranty import close_write_behind
 
 args = parse_args()
 app = configured_app('pplansvc', args.dsn, config_module=args.config,
-                     debug=args.debug, testing=args.testing)
-if args.https:
-    app.run(port=args.port, ssl_context=(args.ssl_crt, args.ssl_key))
+                     debug=args.debug, testing=args.testing, log_level=args.log_level,
+                     metrics=args.metrics, profile=args.profile, proxy_fix=args.proxy_fix,
+                     admin=args.admin,
+                     pool_size=args.pool_size, max_overflow=args.max_overflow,
+                     pool_timeout=args.pool_timeout, pool_recycle=args.pool_recycle,
+                     pool_pre_ping=args.pool_pre_ping, pgbouncer=args.pgbouncer)
+preload(app)
+if args.debug:
+    # werkzeug development server, with the interactive debugger
+    if args.https:
+        app.run(host=args.host, port=args.port, ssl_context=(args.ssl_crt, args.ssl_key))
+    else:
+        app.run(host=args.host, port=args.port)
 else:
-    app.run(port=args.port)
-
+    # connections opened by --testing must not be shared with the workers
+    # quotes queued by WRITE_BEHIND are written before each worker exits
+    raise SystemExit(serve(app, before_fork=db.engine.dispose, before_exit=close_write_behind,
+                           **serve_kwargs(args)))
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""ASGI entry point, eg:
+
+    PPLANSVC_DSN=postgresql://... uvicorn asgi:app --port 9999
+
+PPLANSVC_LOG_LEVEL sets the root log level (default INFO)
+"""
+import os
+
+from morus.logging import configure_logging
+from pplans.asgi.app import configured_app
+from pplans.flask.app import DEFAULT_DSN
+
+configure_logging(level=os.environ.get("PPLANSVC_LOG_LEVEL", "INFO"))
+app = configured_app('pplansvc', os.environ.get("PPLANSVC_DSN", DEFAULT_DSN))
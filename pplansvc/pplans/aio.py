@@ -0,0 +1,252 @@
+"""
+asyncio versions of the `pplans.warranty` library functions, over an
+asyncpg connection pool (`pip install pplansvc[async]`).
+
+SQL is the same `pplans.statements` used by the Flask variant, compiled once
+per statement shape into asyncpg's `$n` placeholder form; asyncpg then
+prepares & caches each statement per connection.
+
+Call init_pool() before, and close_pool() after using these functions (the
+ASGI app does so in its lifespan events).
+"""
+import asyncio
+import re
+import time
+import uuid
+
+from sqlalchemy.dialects import postgresql
+
+from morus.logging import getLogger
+from pplans import statements
+from pplans.pricing import ConstraintIndex, to_cost
+from pplans.warranty import (
+    WARRANTY_ERRORS,
+    ItemRef,
+    WarrantyRuntimeError,
+    cache_identities,
+    cached_item_ref,
+    cached_store_id,
+    create_store_name,
+    forget_identities,
+    validate_record,
+)
+
+
+log = getLogger(__name__)
+
+# see pplans.warranty.CONSTRAINT_INDEX_POLL_SECONDS
+CONSTRAINT_INDEX_POLL_SECONDS = 1.0
+
+_pool = None
+_constraint_index = None
+_constraint_index_checked = 0.0
+_constraint_index_lock = None
+
+_DIALECT = postgresql.dialect(paramstyle="numeric")
+
+
+class Statement(object):
+    """SQLAlchemy Core statement compiled for asyncpg
+
+    bind parameters are referenced by name when executing, see args();
+    literal values in the statement (eg `id == 1`) are bound by default"""
+
+    def __init__(self, stmt):
+        compiled = stmt.compile(dialect=_DIALECT)
+        self.sql = re.sub(r":(\d+)", r"$\1", str(compiled))
+        self.names = list(compiled.positiontup)
+        self.defaults = compiled.params
+
+    def args(self, **params):
+        params = dict(self.defaults, **params)
+        return [params[name] for name in self.names]
+
+
+UPSERT_ITEM = Statement(statements.UPSERT_ITEM)
+SELECT_ITEM = Statement(statements.SELECT_ITEM)
+INSERT_STORE = Statement(statements.INSERT_STORE)
+SELECT_STORE = Statement(statements.SELECT_STORE)
+INSERT_WARRANTY = Statement(statements.INSERT_WARRANTY)
+SELECT_CONSTRAINTS_VERSION = Statement(statements.SELECT_CONSTRAINTS_VERSION)
+SELECT_CONSTRAINTS = Statement(statements.SELECT_CONSTRAINTS)
+
+_lookup_statements = {}
+
+
+def _lookup_statement(filters):
+    """statement selecting warranties for a combination of filter names"""
+    key = tuple(sorted(filters))
+    if key not in _lookup_statements:
+        _lookup_statements[key] = Statement(statements.lookup_statement(key))
+    return _lookup_statements[key]
+
+
+async def init_pool(dsn, min_size=2, max_size=10, statement_cache_size=100, **pool_kwargs):
+    """create the asyncpg pool used by this module
+
+    statement_cache_size=0 disables prepared statement caching, as required
+    behind pgbouncer in transaction pooling mode"""
+    global _pool, _constraint_index, _constraint_index_lock
+    import asyncpg
+
+    # asyncpg does not understand sqlalchemy's driver suffix
+    dsn = re.sub(r"^postgresql\+\w+://", "postgresql://", dsn)
+    _pool = await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size,
+                                      statement_cache_size=statement_cache_size,
+                                      **pool_kwargs)
+    # asyncio.Lock is bound to the running event loop
+    _constraint_index = None
+    _constraint_index_lock = asyncio.Lock()
+    log.debug("init_pool: %s", _pool)
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def load_constraint_index():
+    async with _pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            version = await conn.fetchval(SELECT_CONSTRAINTS_VERSION.sql,
+                                          *SELECT_CONSTRAINTS_VERSION.args())
+            rs = await conn.fetch(SELECT_CONSTRAINTS.sql)
+    ret = []
+    for rec in rs:
+        ret.append({
+            "constraint_id": rec["constraint_id"],
+            "item_type": rec["item_type"],
+            "min_cost": str(rec["min_cost"]),
+            "max_cost": str(rec["max_cost"]),
+            "warranty_price": str(rec["warranty_price"]),
+            "warranty_duration_months": rec["warranty_duration_months"],
+        })
+    return ConstraintIndex(ret, version=version)
+
+
+async def constraint_index():
+    """as pplans.warranty.constraint_index(), without blocking the loop"""
+    global _constraint_index, _constraint_index_checked, _constraint_index_lock
+    now = time.monotonic()
+    if _constraint_index and now - _constraint_index_checked < CONSTRAINT_INDEX_POLL_SECONDS:
+        return _constraint_index
+    async with _constraint_index_lock:
+        if _constraint_index and now - _constraint_index_checked < CONSTRAINT_INDEX_POLL_SECONDS:
+            return _constraint_index
+        version = None
+        if _constraint_index:
+            version = await _pool.fetchval(SELECT_CONSTRAINTS_VERSION.sql,
+                                           *SELECT_CONSTRAINTS_VERSION.args())
+        if not _constraint_index or version != _constraint_index.version:
+            _constraint_index = await load_constraint_index()
+        _constraint_index_checked = now
+    return _constraint_index
+
+
+def invalidate_constraint_index():
+    global _constraint_index_checked
+    _constraint_index_checked = 0.0
+
+
+async def get_constraints(item_type="", item_cost=""):
+    log.debug("aio.get_constraints: %s", locals())
+    index = await constraint_index()
+    try:
+        return index.match(item_type, item_cost)
+    except ValueError:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad item_cost"].format(item_cost))
+
+
+async def get_warranties(item_type="", item_sku="", item_uuid="", store_uuid=""):
+    log.debug("aio.get_warranties: %s", locals())
+    filters = {"item_type": item_type, "item_sku": item_sku,
+               "item_uuid": item_uuid, "store_uuid": store_uuid}
+    filters = {name: value for (name, value) in filters.items() if value}
+    if not filters:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["filter req"])
+    for name in ("item_uuid", "store_uuid"):
+        if name in filters:
+            try:
+                filters[name] = uuid.UUID(str(filters[name]))
+            except ValueError:
+                raise WarrantyRuntimeError(WARRANTY_ERRORS["bad " + name].format(filters[name]))
+
+    stmt = _lookup_statement(filters)
+    rs = await _pool.fetch(stmt.sql, *stmt.args(**filters))
+    return [{
+        "item_sku": rec["item_sku"],
+        "item_type": rec["item_type"],
+        "item_uuid": str(rec["item_uuid"]),
+        "store_uuid": str(rec["store_uuid"]),
+        "warranty_price": str(rec["warranty_price"]),
+        "warranty_duration_months": rec["warranty_duration_months"],
+    } for rec in rs]
+
+
+async def warranty(item_cost, item_sku, item_title, item_type, store_uuid):
+    """as pplans.warranty.warranty(): item & store are upserted and
+    warranties inserted in a single transaction, sharing its identity
+    caches"""
+    log.debug("aio.warranty args: %s", locals())
+    record = validate_record({"item_cost": item_cost, "item_sku": item_sku,
+                              "item_title": item_title, "item_type": item_type,
+                              "store_uuid": store_uuid})
+
+    index = await constraint_index()
+    constraints = index.match(record["item_type"], record["item_cost"])
+    if not constraints:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["no crit"])
+
+    store_uuid = record["store_uuid"]
+    item = {"item_uuid": uuid.uuid4(), "item_type": record["item_type"],
+            "item_sku": record["item_sku"], "item_cost": record["item_cost"],
+            "item_title": record["item_title"]}
+    store = {"store_uuid": store_uuid, "store_name": create_store_name()}
+    item_key = (record["item_type"], record["item_sku"])
+
+    try:
+        async with _pool.acquire() as conn:
+            async with conn.transaction():
+                item_ref = await _upsert_item(conn, item, item_key)
+                store_id = await _upsert_store(conn, store)
+
+                warranties = []
+                for avail_warranty in constraints:
+                    warranties.append({
+                        "item_id": item_ref.item_id,
+                        "store_id": store_id,
+                        "warranty_price": avail_warranty["warranty_price"],
+                        "warranty_duration_months": avail_warranty["warranty_duration_months"],
+                    })
+                await conn.executemany(INSERT_WARRANTY.sql, [
+                    INSERT_WARRANTY.args(**dict(w, warranty_price=to_cost(w["warranty_price"])))
+                    for w in warranties
+                ])
+    except Exception:
+        forget_identities([item_key], [store_uuid])
+        raise
+    cache_identities({item_key: item_ref}, {store_uuid: store_id})
+    return warranties
+
+
+async def _upsert_item(conn, item, item_key):
+    row = await conn.fetchrow(UPSERT_ITEM.sql, *UPSERT_ITEM.args(**item))
+    if row is None:
+        # unchanged item is not returned by upsert
+        item_ref = cached_item_ref(item_key)
+        if item_ref is not None:
+            return item_ref
+        row = await conn.fetchrow(SELECT_ITEM.sql, *SELECT_ITEM.args(**item))
+    return ItemRef(row["item_id"], row["item_uuid"])
+
+
+async def _upsert_store(conn, store):
+    store_id = cached_store_id(store["store_uuid"])
+    if store_id is None:
+        store_id = await conn.fetchval(INSERT_STORE.sql, *INSERT_STORE.args(**store))
+    if store_id is None:
+        store_id = await conn.fetchval(SELECT_STORE.sql, *SELECT_STORE.args(**store))
+    return store_id
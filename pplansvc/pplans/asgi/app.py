@@ -0,0 +1,27 @@
+from morus.asgi import MAX_BODY_SIZE, ASGIApp
+from morus.logging import getLogger
+
+from pplans.aio import close_pool, init_pool
+from pplans.asgi.blueprints import warranties_api
+
+log = getLogger(__name__)
+
+
+def configured_app(import_name, dsn, pool_min_size=2, pool_max_size=10,
+                   statement_cache_size=100, max_body_size=MAX_BODY_SIZE):
+    """ASGI app serving the same warranties_api endpoints as the Flask app,
+    with an asyncpg pool opened & closed over the server's lifespan
+
+    the schema is expected to exist; see `pplans.flask.app.configured_app`
+    with testing=True to create it"""
+    app = ASGIApp(import_name, max_body_size=max_body_size)
+    app.register_blueprint(warranties_api)
+
+    async def open_db():
+        await init_pool(dsn, min_size=pool_min_size, max_size=pool_max_size,
+                        statement_cache_size=statement_cache_size)
+    app.on_startup.append(open_db)
+    app.on_shutdown.append(close_pool)
+
+    log.debug("configured_app: %s", app)
+    return app
@@ -0,0 +1,57 @@
+"""
+asyncio variant of `pplans.flask.blueprints`, for serving via ASGI
+
+as with the Flask views, these only unpack requests, delegate to the
+library functions (here their `pplans.aio` versions) and format responses;
+invalid requests are answered with a 400 & their {"status": ...}
+"""
+from morus.asgi import Blueprint, jsonify
+from morus.logging import getLogger
+from pplans.aio import get_constraints, get_warranties, warranty
+from pplans.warranty import WarrantyRuntimeError
+
+
+log = getLogger(__name__)
+
+warranties_api = Blueprint('warranties', __name__, url_prefix='/warranties')
+
+@warranties_api.route('/', methods=['GET', 'POST'])
+async def warranties(request):
+
+    if request.method == 'GET':
+        log.debug(request.args)
+        item_sku = request.args.get("item_sku")
+        item_type = request.args.get("item_type")
+        item_uuid = request.args.get("item_uuid")
+        store_uuid = request.args.get("store_uuid")
+        try:
+            result = await get_warranties(store_uuid=store_uuid, item_uuid=item_uuid,
+                                          item_type=item_type, item_sku=item_sku)
+        except WarrantyRuntimeError as ex:
+            return jsonify({"status": str(ex)}, status=400)
+        return jsonify(result)
+
+    elif request.method == 'POST':
+        form = request.form
+        log.debug(form)
+        item_cost = form.get("item_cost")
+        item_sku = form.get("item_sku")
+        item_title = form.get("item_title")
+        item_type = form.get("item_type")
+        store_uuid = form.get("store_uuid")
+        try:
+            result = await warranty(item_cost, item_sku, item_title, item_type, store_uuid)
+        except WarrantyRuntimeError as ex:
+            return jsonify({"status": str(ex)}, status=400)
+        return jsonify(result)
+
+@warranties_api.route('/constraints', methods=['GET'])
+async def constraints(request):
+    log.debug(request.args)
+    item_type = request.args.get("item_type")
+    item_cost = request.args.get("item_cost")
+    try:
+        result = await get_constraints(item_type, item_cost)
+    except WarrantyRuntimeError as ex:
+        return jsonify({"status": str(ex)}, status=400)
+    return jsonify(result)
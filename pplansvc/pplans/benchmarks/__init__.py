@@ -0,0 +1,5 @@
+"""
+Micro-benchmarks of pplans hot paths, run as scripts, eg:
+
+    python -m pplans.benchmarks.statements --dsn postgresql://...
+"""
@@ -0,0 +1,149 @@
+"""
+Matching an item's cost against many constraints, in the db & in process
+
+For each count the constraints table is refilled with that many cost bands
+(as per-store or per-region pricing would need), then the constraints for
+random (item_type, item_cost) are looked up by:
+
+  * "btree": `min_cost < x AND max_cost > x`, over B-tree indexes on
+    min_cost & max_cost, as before cost_range
+  * "gist": `cost_range @> x` (`query_constraints()`), over its GiST index
+  * "in process": the ConstraintIndex `get_constraints()` matches against,
+    only up to IN_PROCESS_MAX constraints, as it holds the matches of every
+    slot between bounds, which grow with how many bands overlap (building
+    it takes seconds at 10^5)
+
+The db must exist (see README).  Seeding deletes all its warranties (&
+their lookups) and leaves it with the generated constraints, so a db
+holding warranties is refused unless --force is given:
+
+    python -m pplans.benchmarks.constraints --dsn postgresql://... --counts 1000,100000
+"""
+import argparse
+import random
+
+from sqlalchemy import text
+
+from morus import benchmark
+
+from pplans.benchmarks.warranty import cycle
+from pplans.flask.app import DEFAULT_DSN, configured_app
+from pplans.models import ItemType, db
+from pplans.warranty import load_constraint_index, query_constraints
+
+
+# count bands of width up to max_width, each with a distinct price so none
+# violate the exclusion constraints (so count must be under 10^6)
+SEED_CONSTRAINTS = text("""
+    INSERT INTO constraints (item_type, min_cost, max_cost, warranty_price,
+                             warranty_duration_months)
+    SELECT (enum_range(NULL::itemtype))[1 + g % 4], lo, lo + width, g / 100.0, 12 * (g % 5)
+    FROM (
+        SELECT g, round((random() * 9000)::numeric, 2) AS lo,
+               round((1 + random() * :max_width)::numeric, 2) AS width
+        FROM generate_series(1, :count) AS g
+    ) AS bands
+""")
+
+BTREE_INDEXES = [
+    text("CREATE INDEX IF NOT EXISTS ix_constraints_min_cost ON constraints (min_cost)"),
+    text("CREATE INDEX IF NOT EXISTS ix_constraints_max_cost ON constraints (max_cost)"),
+]
+
+MATCH_BTREE = text("""
+    SELECT constraint_id, item_type, min_cost, max_cost, warranty_price, warranty_duration_months
+    FROM constraints
+    WHERE item_type = :item_type AND min_cost < :item_cost AND max_cost > :item_cost
+    ORDER BY constraint_id
+""")
+
+HAS_WARRANTIES = text("SELECT EXISTS (SELECT 1 FROM warranties)")
+
+SAMPLES = 100
+
+IN_PROCESS_MAX = 100000
+
+
+class DatabaseNotEmpty(RuntimeError):
+    pass
+
+
+def seed(count, max_width, seed=0):
+    """replace the constraints with count random bands, deleting every
+    warranty"""
+    session = db.session
+    session.execute("SELECT setseed(:seed)", {"seed": seed / 2 ** 31})
+    session.execute("TRUNCATE warranties, constraints CASCADE")
+    session.execute(SEED_CONSTRAINTS, {"count": count, "max_width": max_width})
+    for stmt in BTREE_INDEXES:
+        session.execute(stmt)
+    session.commit()
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute("ANALYZE constraints")
+
+
+def benchmarks():
+    """(name, func) of each variant, & the args they cycle through"""
+    rng = random.Random(0)
+    args = [{"item_type": rng.choice(list(ItemType)).value,
+             "item_cost": "{:.2f}".format(rng.uniform(0, 9500))} for i in range(SAMPLES)]
+
+    def btree(item_type, item_cost):
+        return db.session.execute(MATCH_BTREE, {"item_type": item_type,
+                                                "item_cost": item_cost}).fetchall()
+
+    variants = [("btree", btree), ("gist", query_constraints)]
+    if db.session.execute("SELECT count(*) FROM constraints").scalar() <= IN_PROCESS_MAX:
+        variants.append(("in process", load_constraint_index().match))
+    db.session.rollback()
+    return (variants, args)
+
+
+def run(dsn, counts, max_width, iterations=500, force=False):
+    """benchmark at each of counts, returns {str(count): {variant: stats}}
+
+    raises DatabaseNotEmpty if the db holds warranties, unless force"""
+    configured_app("pplans.benchmarks", dsn)
+    if not force and db.session.execute(HAS_WARRANTIES).scalar():
+        db.session.rollback()
+        raise DatabaseNotEmpty("{} holds warranties, which seeding deletes; "
+                               "pass --force to benchmark it anyway".format(dsn))
+    counter = benchmark.QueryCounter()
+    results = {}
+    try:
+        for count in counts:
+            seed(count, max_width)
+            (variants, args) = benchmarks()
+            results[str(count)] = {}
+            for (name, func) in variants:
+                results[str(count)][name] = benchmark.timed(
+                    cycle(func, args), iterations=iterations, warmup=SAMPLES,
+                    counter=counter)
+                db.session.rollback()
+    finally:
+        counter.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN)
+    parser.add_argument("--counts", default="1000,100000",
+                        help="comma separated numbers of constraints")
+    parser.add_argument("--max-width", type=float, default=100.0,
+                        help="widest cost band generated")
+    parser.add_argument("--iterations", "-n", type=int, default=500)
+    parser.add_argument("--force", action="store_true",
+                        help="run even if the db holds warranties, deleting them all")
+    args = parser.parse_args()
+
+    counts = [int(float(count)) for count in args.counts.split(",")]
+    try:
+        results = run(args.dsn, counts, args.max_width, args.iterations, force=args.force)
+    except DatabaseNotEmpty as ex:
+        raise SystemExit(str(ex))
+    print(benchmark.report(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Cold start of the service: importing `pplans.flask.app` & configuring the
+app (without connecting to the db), each in a fresh interpreter
+
+Flask & SQLAlchemy account for most of it; optional dependencies &
+middleware (LAZY_MODULES) are only imported when enabled.  Checked against
+BUDGET by `setup.py importtime` & the functional tests:
+
+    python -m pplans.benchmarks.startup --top 30
+"""
+import argparse
+import os
+import statistics
+
+from morus import startup
+
+
+MODULE = "pplans.flask.app"
+
+STATEMENT = """
+from pplans.flask.app import DEFAULT_DSN, configured_app
+configured_app("pplansvc", DEFAULT_DSN)
+"""
+
+# seconds the median cold start may take, generous as CI machines vary
+BUDGET = float(os.environ.get("PPLANSVC_STARTUP_BUDGET", 1.5))
+
+# must not be imported by STATEMENT
+LAZY_MODULES = (
+    "psycopg2",
+    "werkzeug.middleware.proxy_fix",
+    "morus.flask.metrics",
+    "morus.flask.profiler",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--top", type=int, default=20, help="modules to report")
+    parser.add_argument("--repeat", "-n", type=int, default=5)
+    args = parser.parse_args()
+
+    print(startup.report(startup.import_times(MODULE), top=args.top))
+    elapsed = statistics.median(startup.cold_start(STATEMENT, repeat=args.repeat))
+    print("cold start: {:.1f} ms (median of {}), budget {:.1f} ms".format(
+        elapsed * 1e3, args.repeat, BUDGET * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Per-call cost of building & compiling the warranty lookup, against reusing
+the cached compiled statement (`pplans.warranty._execute`)
+
+Each variant runs the same `item_type` lookup against the db, so the
+difference between them is Python-side overhead only; "compile only" times
+the compilation step alone.  The db must exist (see README).
+"""
+import argparse
+import time
+
+from pplans.flask.app import DEFAULT_DSN, configured_app
+from pplans.models import WarrantyLookup, db
+from pplans.statements import WARRANTY_COLUMNS, lookup_statement
+from pplans.warranty import _lookup_warranties
+
+
+def orm_query(item_type):
+    """warranty lookup as built before pplans.statements"""
+    return db.session.query(*WARRANTY_COLUMNS).filter(
+        WarrantyLookup.item_type == item_type).order_by(WarrantyLookup.warranty_id).all()
+
+
+def core_compiled_per_call(item_type):
+    """the same select, built afresh so it is compiled every call"""
+    stmt = db.select(WARRANTY_COLUMNS).where(
+        WarrantyLookup.item_type == item_type).order_by(WarrantyLookup.warranty_id)
+    return db.session.execute(stmt).fetchall()
+
+
+def core_cached(item_type):
+    return _lookup_warranties({"item_type": item_type}).fetchall()
+
+
+def compile_only(item_type):
+    return lookup_statement({"item_type": item_type}).compile(dialect=db.engine.dialect)
+
+
+VARIANTS = [
+    ("orm query, built & compiled per call", orm_query),
+    ("core statement, compiled per call", core_compiled_per_call),
+    ("core statement, compiled once", core_cached),
+    ("compile only", compile_only),
+]
+
+
+def per_call(func, iterations, item_type):
+    for i in range(min(iterations, 100)):
+        func(item_type)
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(item_type)
+    elapsed = time.perf_counter() - start
+    db.session.rollback()
+    return elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN)
+    parser.add_argument("--iterations", "-n", type=int, default=2000)
+    parser.add_argument("--item-type", default="furniture")
+    parser.add_argument("--qps", type=int, default=1000,
+                        help="request rate to express savings at")
+    args = parser.parse_args()
+
+    configured_app("pplans.benchmarks", args.dsn)
+    results = {}
+    for (name, func) in VARIANTS:
+        results[name] = per_call(func, args.iterations, args.item_type)
+        print("{:40} {:9.1f} us/call".format(name, results[name] * 1e6))
+
+    saved = results[VARIANTS[0][0]] - results["core statement, compiled once"]
+    print("saved per call vs orm query: {:.1f} us, {:.0%} of a core at {} QPS".format(
+        saved * 1e6, saved * args.qps, args.qps))
+
+
+if __name__ == "__main__":
+    main()
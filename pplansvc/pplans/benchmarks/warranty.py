@@ -0,0 +1,150 @@
+"""
+Latency of the `pplans.warranty` library functions as the data grows
+
+For each scale (about that many warranties) the db is recreated with data
+from `pplans.datagen`, then `warranty()`, `get_warranties()` for every
+combination of filters, `get_constraints()` & `quote_warranties()` are
+timed, reporting p50/p95/p99 and queries per call.  The warranty cache is
+disabled, so every call goes to the db.
+
+Run via setup.py, which saves the results & compares them with the
+committed baseline (see README):
+
+    python setup.py benchmark --dsn postgresql://... --scales 1e3,1e5,1e7
+
+or directly, printing the results only:
+
+    python -m pplans.benchmarks.warranty --dsn postgresql://... --scales 1000
+"""
+import argparse
+import itertools
+import json
+import random
+
+from sqlalchemy import text
+
+from morus import benchmark
+from morus.logging import getLogger
+
+from pplans import datagen
+from pplans.flask.app import DEFAULT_DSN, configured_app
+from pplans.models import db
+from pplans.statements import LOOKUP_FILTERS
+from pplans.warranty import (
+    clear_identity_caches,
+    configure_warranty_cache,
+    get_constraints,
+    get_warranties,
+    quote_warranties,
+    warranty,
+)
+
+
+log = getLogger(__name__)
+
+# distinct argument sets each benchmark cycles through
+SAMPLES = 100
+
+# rows of seeded warranties, whose values are passed as filters
+SAMPLE_WARRANTIES = text("""
+    SELECT i.item_type, i.item_sku, i.item_uuid, s.store_uuid
+    FROM warranties w JOIN items i USING (item_id) JOIN stores s USING (store_id)
+    WHERE w.warranty_id = ANY(:ids)
+""")
+
+
+def seed(scale):
+    """recreate the db with about scale warranties, see pplans.datagen"""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    clear_identity_caches()
+    (items, stores) = datagen.sizes_for(scale)
+    counts = datagen.load_data(items=items, stores=stores)
+    log.info("seeded %s", counts)
+    datagen.analyze()
+
+
+def sample_filters(count=SAMPLES):
+    """values of count random warranties, as dicts of LOOKUP_FILTERS"""
+    (max_id,) = db.session.execute("SELECT max(warranty_id) FROM warranties").fetchone()
+    ids = [random.randint(1, max_id) for i in range(count)]
+    rows = db.session.execute(SAMPLE_WARRANTIES, {"ids": ids}).fetchall()
+    db.session.rollback()
+    return [{"item_type": row.item_type, "item_sku": row.item_sku,
+             "item_uuid": str(row.item_uuid), "store_uuid": str(row.store_uuid)}
+            for row in rows]
+
+
+def cycle(func, args):
+    """func called with each of args in turn, by successive calls"""
+    args = itertools.cycle(args)
+    return lambda: func(**next(args))
+
+
+def benchmarks(samples):
+    """(name, func) of each benchmark, func takes no args"""
+    ret = []
+    # repeated quotes of the same items; after warmup these take the
+    # idempotent path, as most production traffic does
+    store_uuid = samples[0]["store_uuid"]
+    quotes = [{"item_cost": "{}.00".format(10 + i * 4), "item_sku": "BENCH-Q-{}".format(i),
+               "item_title": "Bench quote", "item_type": random.choice(["furniture",
+                                                                        "electronics"]),
+               "store_uuid": store_uuid} for i in range(SAMPLES)]
+    ret.append(("warranty", cycle(warranty, quotes)))
+
+    for n in range(1, len(LOOKUP_FILTERS) + 1):
+        for names in itertools.combinations(sorted(LOOKUP_FILTERS), n):
+            args = [{name: sample[name] for name in names} for sample in samples]
+            ret.append(("get_warranties[{}]".format(",".join(names)),
+                        cycle(get_warranties, args)))
+
+    constraints = [{"item_type": item_type, "item_cost": "{}.00".format(cost)}
+                   for item_type in ("furniture", "electronics")
+                   for cost in range(0, 2000, 40)]
+    ret.append(("get_constraints", cycle(get_constraints, constraints)))
+    ret.append(("quote_warranties", cycle(quote_warranties, constraints)))
+    return ret
+
+
+def run(dsn, scales, iterations=200):
+    """benchmark at each of scales, returns {str(scale): {benchmark: stats}}"""
+    configured_app("pplans.benchmarks", dsn)
+    configure_warranty_cache(maxsize=0)
+    counter = benchmark.QueryCounter()
+    results = {}
+    try:
+        for scale in scales:
+            seed(scale)
+            samples = sample_filters()
+            results[str(scale)] = {}
+            for (name, func) in benchmarks(samples):
+                results[str(scale)][name] = benchmark.timed(
+                    func, iterations=iterations, warmup=min(iterations, SAMPLES),
+                    counter=counter)
+                db.session.rollback()
+    finally:
+        counter.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN)
+    parser.add_argument("--scales", default="1000",
+                        help="comma separated numbers of warranties")
+    parser.add_argument("--iterations", "-n", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    scales = [int(float(scale)) for scale in args.scales.split(",")]
+    results = run(args.dsn, scales, args.iterations)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print(benchmark.report(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Synthetic data at production scale, loaded with Postgres COPY
+
+Items, stores, constraints & warranties are generated as streams of rows
+and copied into the db as they are produced, so memory use does not grow
+with the amount of data.  The data is shaped like real traffic:
+
+ * item types are unevenly popular, and item costs log-normally distributed
+ * SKU popularity is skewed: the item of popularity rank r is quoted at a
+   number of stores proportional to 1 / r ** skew (Zipf), so a few SKUs are
+   carried by most stores while the long tail is carried by one or two
+ * each quote (item at a store) has a warranty per matching constraint
+
+Output is deterministic for a given seed.  Generated ids follow any rows
+already present, so data can be added on top of `create_demo_data()`:
+
+    >>> counts = load_data(items=100000, stores=1000)  # doctest: +SKIP
+
+Also run as a script, or via `setup.py datagen` (see README):
+
+    python -m pplans.datagen --dsn postgresql://... --warranties 10000000
+"""
+import argparse
+import itertools
+import math
+import random
+import uuid
+
+from morus.logging import getLogger
+
+from pplans.models import db
+from pplans.warranty import invalidate_constraint_index, load_constraint_index
+
+
+log = getLogger(__name__)
+
+ITEM_TYPE_WEIGHTS = {
+    "furniture": 0.35,
+    "electronics": 0.30,
+    "computers": 0.20,
+    "jewelry": 0.15,
+}
+
+# item_cost ~ lognormal, median ITEM_COST_MEDIAN, clamped to the largest
+# cost a constraint can cover
+ITEM_COST_MEDIAN = 150.0
+ITEM_COST_SIGMA = 1.0
+MAX_COST = 9999.98
+
+# generated constraints: per item type, each cost band offers these
+# (warranty_duration_months, fraction of band max_cost) warranties
+COST_BANDS = (100, 250, 500, 1000, 2500, 5000, 9999.99)
+BAND_OPTIONS = ((12, 0.05), (36, 0.12), (0, 0.20))
+
+STORE_NAME_WORDS = (("ACME", "Apu's", "Corner", "Dollar", "Harlem", "Moe's"),
+                    ("Markt", "Store", "Stuff", "Warehouse"))
+
+TITLE_WORDS = {
+    "furniture": (("Retro", "Oak", "Vintage", "Modern", "Rustic"),
+                  ("Table", "Sofa", "Chair", "Dresser", "Bookcase")),
+    "electronics": (("Modular", "Portable", "Wireless", "Analog", "Smart"),
+                    ("Synth", "Speaker", "Camera", "Turntable", "Television")),
+    "computers": (("Gaming", "Business", "Ultralight", "Refurbished", "Workstation"),
+                  ("Laptop", "Desktop", "Tablet", "Monitor", "Server")),
+    "jewelry": (("Gold", "Silver", "Platinum", "Antique", "Diamond"),
+                ("Ring", "Necklace", "Bracelet", "Watch", "Earrings")),
+}
+
+# average number of warranties per quote, with the generated constraints
+WARRANTIES_PER_QUOTE = len(BAND_OPTIONS)
+
+# rows written to COPY per chunk read from a stream
+COPY_CHUNK_SIZE = 65536
+
+
+class RowStream(object):
+    """read-only file of rows in COPY text format, produced on demand from an
+    iterable of tuples, for cursor.copy_expert()
+
+    values must not contain tabs, newlines or backslashes; None is NULL"""
+
+    def __init__(self, rows):
+        self._lines = ("\t".join(r"\N" if v is None else str(v) for v in row) + "\n"
+                       for row in rows)
+        self._buffer = ""
+        self.rows = 0
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self.rows += 1
+            chunks.append(line)
+            length += len(line)
+        data = "".join(chunks)
+        if size < 0:
+            (ret, self._buffer) = (data, "")
+        else:
+            (ret, self._buffer) = (data[:size], data[size:])
+        return ret
+
+
+def _uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def generate_constraints():
+    """constraint rows for every item type & COST_BANDS band, as
+    (item_type, min_cost, max_cost, warranty_price, warranty_duration_months)
+
+    consecutive bands overlap by a cent, as costs match open intervals"""
+    for item_type in sorted(ITEM_TYPE_WEIGHTS):
+        lo = 0.0
+        for hi in COST_BANDS:
+            for (months, fraction) in BAND_OPTIONS:
+                yield (item_type, "{:.2f}".format(lo), "{:.2f}".format(hi),
+                       "{:.2f}".format(min(hi * fraction, 9999.99)), months)
+            lo = hi - 0.01
+
+
+def generate_stores(count, first_id=1, seed=0):
+    """(store_id, store_uuid, store_name) rows"""
+    rng = random.Random("stores-{}".format(seed))
+    for store_id in range(first_id, first_id + count):
+        name = " ".join(rng.choice(words) for words in STORE_NAME_WORDS)
+        yield (store_id, _uuid(rng), "{} #{}".format(name, store_id))
+
+
+def generate_items(count, first_id=1, seed=0):
+    """(item_id, item_uuid, item_type, item_sku, item_cost, item_title) rows,
+    in popularity order (the first is the most quoted)"""
+    rng = random.Random("items-{}".format(seed))
+    types = sorted(ITEM_TYPE_WEIGHTS)
+    cum_weights = list(itertools.accumulate(ITEM_TYPE_WEIGHTS[t] for t in types))
+    mu = math.log(ITEM_COST_MEDIAN)
+    for item_id in range(first_id, first_id + count):
+        item_type = rng.choices(types, cum_weights=cum_weights)[0]
+        cost = min(max(rng.lognormvariate(mu, ITEM_COST_SIGMA), 0.01), MAX_COST)
+        (adjectives, nouns) = TITLE_WORDS[item_type]
+        title = "{} {} #{}".format(rng.choice(adjectives), rng.choice(nouns), item_id)
+        yield (item_id, _uuid(rng), item_type,
+               "{}-{:08d}".format(item_type[:4].upper(), item_id),
+               "{:.2f}".format(cost), title)
+
+
+def zipf_quotes(items, stores, quotes_per_item, skew):
+    """function of popularity rank (0 first) -> expected number of stores
+    quoting the item, averaging quotes_per_item over all items before
+    capping at stores"""
+    norm = sum(1.0 / (rank ** skew) for rank in range(1, items + 1))
+    scale = quotes_per_item * items / norm
+    return lambda rank: min(scale / ((rank + 1) ** skew), stores)
+
+
+def generate_warranties(items, item_count, stores, index, first_store_id=1,
+                        quotes_per_item=3.0, skew=1.1, seed=0):
+    """(store_id, item_id, warranty_price, warranty_duration_months) rows for
+    the item_count rows of items (as from generate_items, in popularity
+    order), each quoted at a Zipf distributed number of stores; index is the
+    ConstraintIndex the quotes are priced with"""
+    rng = random.Random("warranties-{}".format(seed))
+    quotes = zipf_quotes(item_count, stores, quotes_per_item, skew)
+    for (rank, item) in enumerate(items):
+        (item_id, item_type, item_cost) = (item[0], item[2], item[4])
+        matches = index.match(item_type, item_cost)
+        if not matches:
+            continue
+        expected = quotes(rank)
+        count = max(int(expected) + (rng.random() < expected % 1), 1)
+        for store in rng.sample(range(stores), count):
+            for c in matches:
+                yield (first_store_id + store, item_id, c["warranty_price"],
+                       c["warranty_duration_months"])
+
+
+def sizes_for(warranties, quotes_per_item=3.0, items_per_store=100):
+    """(items, stores) generating about `warranties` warranties, with the
+    generated constraints; actual counts are lower when popular items are
+    capped at every store"""
+    items = max(int(warranties / (quotes_per_item * WARRANTIES_PER_QUOTE)), 1)
+    return (items, max(items // items_per_store, 10))
+
+
+def _copy(cursor, table, columns, rows):
+    stream = RowStream(rows)
+    cursor.copy_expert("COPY {} ({}) FROM STDIN".format(table, ", ".join(columns)),
+                       stream, size=COPY_CHUNK_SIZE)
+    log.info("copied %s rows into %s", stream.rows, table)
+    return stream.rows
+
+
+def _next_id(cursor, table, column):
+    cursor.execute("SELECT coalesce(max({}), 0) + 1 FROM {}".format(column, table))
+    return cursor.fetchone()[0]
+
+
+def _reset_sequence(cursor, table, column):
+    cursor.execute("SELECT setval(pg_get_serial_sequence('{0}', '{1}'), "
+                   "coalesce(max({1}), 1)) FROM {0}".format(table, column))
+
+
+def load_data(items=1000, stores=100, quotes_per_item=3.0, skew=1.1, seed=0):
+    """generate & COPY items, stores & warranties into the db, in a single
+    transaction; constraints are generated first if there are none
+
+    returns dict of table -> rows copied"""
+    session = db.session
+    cursor = session.connection().connection.cursor()
+    counts = {"constraints": 0}
+    try:
+        cursor.execute("SELECT count(*) FROM constraints")
+        if not cursor.fetchone()[0]:
+            counts["constraints"] = _copy(
+                cursor, "constraints",
+                ("item_type", "min_cost", "max_cost", "warranty_price",
+                 "warranty_duration_months"),
+                generate_constraints())
+        first_store_id = _next_id(cursor, "stores", "store_id")
+        first_item_id = _next_id(cursor, "items", "item_id")
+        counts["stores"] = _copy(cursor, "stores", ("store_id", "store_uuid", "store_name"),
+                                 generate_stores(stores, first_store_id, seed))
+        counts["items"] = _copy(
+            cursor, "items",
+            ("item_id", "item_uuid", "item_type", "item_sku", "item_cost", "item_title"),
+            generate_items(items, first_item_id, seed))
+        _reset_sequence(cursor, "stores", "store_id")
+        _reset_sequence(cursor, "items", "item_id")
+
+        # items are generated again rather than kept in memory; the index
+        # is read in this transaction, so includes constraints copied above
+        warranties = generate_warranties(
+            generate_items(items, first_item_id, seed), items, stores,
+            load_constraint_index(),
+            first_store_id=first_store_id, quotes_per_item=quotes_per_item,
+            skew=skew, seed=seed)
+        counts["warranties"] = _copy(
+            cursor, "warranties",
+            ("store_id", "item_id", "warranty_price", "warranty_duration_months"),
+            warranties)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        cursor.close()
+    invalidate_constraint_index()
+    return counts
+
+
+def analyze():
+    """update planner statistics after a load"""
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute("ANALYZE")
+
+
+def main(argv=None):
+    from pplans.flask.app import DEFAULT_DSN, configured_app
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN)
+    parser.add_argument("--warranties", type=float, default=None,
+                        help="about how many warranties, sets --items & --stores")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--stores", type=int, default=100)
+    parser.add_argument("--quotes-per-item", type=float, default=3.0,
+                        help="mean number of stores quoting each item")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recreate", action="store_true",
+                        help="drop & recreate tables first")
+    args = parser.parse_args(argv)
+
+    configured_app("pplans.datagen", args.dsn)
+    if args.recreate:
+        db.drop_all()
+        db.create_all()
+    (items, stores) = (args.items, args.stores)
+    if args.warranties:
+        (items, stores) = sizes_for(args.warranties, args.quotes_per_item)
+    counts = load_data(items=items, stores=stores, quotes_per_item=args.quotes_per_item,
+                       skew=args.skew, seed=args.seed)
+    analyze()
+    print(", ".join("{} {}".format(count, table) for (table, count) in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,22 +8,62 @@ Flask "views" should only be concerned about unpacking requests, delegating
 all business logic to a library function, and formatting the library output
 into a response
 """
-from flask import Blueprint, jsonify, request
+import queue
 
+from flask import Blueprint, Response, json, jsonify, request, stream_with_context
+
+from morus.flask.decorators import etag, require_token
 from morus.logging import getLogger
+from morus.pool import pool_stats
+from pplans.models import db
 from pplans.warranty import (
+    DEFAULT_PAGE_LIMIT,
+    WARRANTY_ERRORS,
     WarrantyRuntimeError,
+    constraint_index_stats,
+    constraints_version,
     get_constraints,
+    identity_cache_stats,
     warranty,
+    warranty_batch,
     get_warranties,
+    get_warranties_page,
+    iter_warranties,
+    quote_warranties,
+    warranty_cache_stats,
+    warranty_write_behind,
+    write_behind_enabled,
+    write_behind_stats,
 )
 
 
 log = getLogger(__name__)
 
+# rows serialized per chunk of a streamed response
+STREAM_CHUNK_ROWS = 100
+
 warranties_api = Blueprint('warranties', __name__, url_prefix='/warranties')
+# internal state of the process; only registered when ADMIN_ENABLED, and
+# requiring the profiler's header when PROFILE_TOKEN is set
+admin_api = Blueprint('admin', __name__, url_prefix='/admin')
+admin_api.before_request(require_token)
+
+def _stream_json_list(rows):
+    """generate a JSON array from an iterable of rows, in chunks"""
+    yield "["
+    sep = ""
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(row))
+        if len(chunk) == STREAM_CHUNK_ROWS:
+            yield sep + ",".join(chunk)
+            (sep, chunk) = (",", [])
+    if chunk:
+        yield sep + ",".join(chunk)
+    yield "]\n"
 
 @warranties_api.route('/', methods=['GET', 'POST'])
+@etag()
 def warranties():
 
     if request.method == 'GET':
@@ -32,9 +72,22 @@ def warranties():
         item_type = request.args.get("item_type")
         item_uuid = request.args.get("item_uuid")
         store_uuid = request.args.get("store_uuid")
+        filters = {"store_uuid": store_uuid, "item_uuid": item_uuid,
+                   "item_type": item_type, "item_sku": item_sku}
+        # optional keyset pagination & streaming
+        limit = request.args.get("limit")
+        cursor = request.args.get("next")
+        stream = request.args.get("stream")
         try:
-            result = get_warranties(store_uuid=store_uuid, item_uuid=item_uuid,
-                                    item_type=item_type, item_sku=item_sku)
+            if stream:
+                rows = iter_warranties(cursor=cursor, **filters)
+                return Response(stream_with_context(_stream_json_list(rows)),
+                                mimetype="application/json")
+            elif limit or cursor:
+                result = get_warranties_page(limit=limit or DEFAULT_PAGE_LIMIT,
+                                             cursor=cursor, **filters)
+            else:
+                result = get_warranties(**filters)
         except WarrantyRuntimeError as ex:
             result = {"status": str(ex)}
         return jsonify(result)
@@ -46,13 +99,34 @@ def warranties():
         item_title = request.form.get("item_title")
         item_type = request.form.get("item_type")
         store_uuid = request.form.get("store_uuid")
+        # quoted now & written in the background, see WRITE_BEHIND
+        write = warranty_write_behind if write_behind_enabled() else warranty
         try:
-            result = warranty(item_cost, item_sku, item_title, item_type, store_uuid)
+            result = write(item_cost, item_sku, item_title, item_type, store_uuid)
         except WarrantyRuntimeError as ex:
             result = {"status": str(ex)}
+        except queue.Full:
+            response = jsonify({"status": WARRANTY_ERRORS["busy"]})
+            response.status_code = 503
+            response.headers["Retry-After"] = "1"
+            return response
         return jsonify(result)
 
+@warranties_api.route('/batch', methods=['POST'])
+def warranties_batch():
+    """POST a JSON list of records, each having the same fields as POST /
+
+    responds with a list of per-record results, in the order received"""
+    log.debug("warranties_batch: %s bytes", request.content_length)
+    records = request.get_json(silent=True)
+    try:
+        result = warranty_batch(records)
+    except WarrantyRuntimeError as ex:
+        result = {"status": str(ex)}
+    return jsonify(result)
+
 @warranties_api.route('/constraints', methods=['GET'])
+@etag(constraints_version)
 def constraints():
 
     if request.method == 'GET':
@@ -65,3 +139,45 @@ def constraints():
             result = {"status": str(ex)}
         return jsonify(result)
 
+
+@warranties_api.route('/quote', methods=['GET'])
+@etag(constraints_version)
+def quote():
+    """priced warranties for item_type & item_cost, nothing is written"""
+    item_type = request.args.get("item_type")
+    item_cost = request.args.get("item_cost")
+    try:
+        result = quote_warranties(item_type, item_cost)
+    except WarrantyRuntimeError as ex:
+        result = {"status": str(ex)}
+    return jsonify(result)
+
+
+@admin_api.route('/cache', methods=['GET'])
+def cache_stats():
+    """hit/miss/eviction counters of this process' lookup cache"""
+    return jsonify(warranty_cache_stats())
+
+
+@admin_api.route('/identities', methods=['GET'])
+def identity_caches():
+    """hit rates of this process' store & item id caches, see warranty()"""
+    return jsonify(identity_cache_stats())
+
+
+@admin_api.route('/constraints', methods=['GET'])
+def constraint_snapshot():
+    """version & age of this process' constraints snapshot"""
+    return jsonify(constraint_index_stats())
+
+
+@admin_api.route('/write-behind', methods=['GET'])
+def write_behind():
+    """queued, written & failed counts of this process' write-behind queue"""
+    return jsonify(write_behind_stats())
+
+
+@admin_api.route('/pool', methods=['GET'])
+def connection_pool():
+    """checkout/wait/overflow counters of this process' db connection pool"""
+    return jsonify(pool_stats(db.engine.pool))
@@ -0,0 +1,86 @@
+"""
+Rebuild the warranty_lookups read model from warranties, items & stores
+
+Triggers keep it current as warranties are written (see
+pplans.models.WarrantyLookup), so a rebuild is only needed to backfill a db
+created before the table existed, or to repair one:
+
+    python -m pplans.lookups --dsn postgresql://... [--missing]
+
+A full rebuild deletes & reinserts every row in one transaction, holding a
+SHARE lock on warranties so no writes are missed meanwhile (quotes wait for
+it), while lookups keep reading the old rows until it commits; --missing
+only inserts rows for warranties without one, without blocking writes.
+Rows of deleted warranties are removed by their foreign key.
+"""
+import argparse
+
+from sqlalchemy import text
+
+from morus.logging import getLogger
+
+from pplans.models import db
+
+
+log = getLogger(__name__)
+
+_INSERT_LOOKUPS = """
+    INSERT INTO warranty_lookups (warranty_id, item_type, item_sku, item_uuid, store_uuid,
+                                  warranty_price, warranty_duration_months)
+    SELECT w.warranty_id, i.item_type, i.item_sku, i.item_uuid, s.store_uuid,
+           w.warranty_price, w.warranty_duration_months
+    FROM warranties w
+    JOIN items i ON i.item_id = w.item_id
+    JOIN stores s ON s.store_id = w.store_id
+"""
+
+REBUILD = [
+    text("LOCK TABLE warranties IN SHARE MODE"),
+    # not TRUNCATE, whose ACCESS EXCLUSIVE lock would block lookups too
+    text("DELETE FROM warranty_lookups"),
+    text(_INSERT_LOOKUPS),
+]
+
+BACKFILL = [
+    text(_INSERT_LOOKUPS + """
+        WHERE NOT EXISTS (SELECT 1 FROM warranty_lookups l WHERE l.warranty_id = w.warranty_id)
+        ON CONFLICT (warranty_id) DO NOTHING
+    """),
+]
+
+
+def rebuild_lookups(missing=False):
+    """rewrite warranty_lookups (or with missing=True, add the rows it
+    lacks) in a single transaction, returns rows inserted"""
+    session = db.session
+    try:
+        for stmt in BACKFILL if missing else REBUILD:
+            inserted = session.execute(stmt).rowcount
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    log.info("rebuild_lookups: %s rows inserted", inserted)
+    return inserted
+
+
+def main(argv=None):
+    from pplans.datagen import analyze
+    from pplans.flask.app import DEFAULT_DSN, configured_app
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN)
+    parser.add_argument("--missing", action="store_true",
+                        help="only insert rows for warranties without one")
+    args = parser.parse_args(argv)
+
+    configured_app("pplans.lookups", args.dsn)
+    # creates warranty_lookups & its triggers if the db predates them
+    db.create_all()
+    inserted = rebuild_lookups(missing=args.missing)
+    analyze()
+    print("{} warranty_lookups inserted".format(inserted))
+
+
+if __name__ == "__main__":
+    main()
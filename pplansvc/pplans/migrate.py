@@ -0,0 +1,143 @@
+"""
+Bring a db created by an earlier version of pplans.models up to date
+
+    python -m pplans.migrate --dsn postgresql://...
+
+Tables added since (eg warranty_lookups) are created with their triggers;
+then STEPS alter existing tables, each idempotent so a migration can be
+rerun: constraints gain the numrange cost_range column & its GiST index,
+replacing the B-tree indexes on min_cost & max_cost, duplicate warranties
+are deleted (keeping the first of each) and warranty_lookups is backfilled.
+Then whatever is missing of the constraints_version trigger, the unique
+key of warranties, and the exclusion constraints
+(pplans.models.exclude_overlapping_constraints) is added.  Constraints
+which would violate those are listed & nothing is changed, to be resolved
+by hand first.  Everything runs in a single transaction.
+"""
+import argparse
+
+from sqlalchemy import text
+
+from morus.logging import getLogger
+
+from pplans.lookups import BACKFILL
+from pplans.models import (
+    CONSTRAINTS_VERSION_TRIGGER,
+    BaseModel,
+    ItemType,
+    db,
+    exclude_overlapping_constraints,
+)
+
+
+log = getLogger(__name__)
+
+STEPS = [
+    text("""
+        ALTER TABLE constraints ADD COLUMN IF NOT EXISTS cost_range numrange
+            GENERATED ALWAYS AS (numrange(min_cost, max_cost, '()')) STORED
+    """),
+    text("CREATE INDEX IF NOT EXISTS ix_constraints_cost_range "
+         "ON constraints USING gist (cost_range)"),
+    text("DROP INDEX IF EXISTS ix_constraints_min_cost"),
+    text("DROP INDEX IF EXISTS ix_constraints_max_cost"),
+    # no quotes written between the dedupe & adding WARRANTIES_KEY
+    text("LOCK TABLE warranties IN SHARE MODE"),
+    text("""
+        DELETE FROM warranties WHERE warranty_id IN (
+            SELECT warranty_id FROM (
+                SELECT warranty_id, row_number() OVER (
+                    PARTITION BY store_id, item_id, warranty_price, warranty_duration_months
+                    ORDER BY warranty_id) AS n
+                FROM warranties) AS w
+            WHERE n > 1)
+    """),
+] + BACKFILL
+
+# the natural key pplans.models.Warranty declares
+WARRANTIES_KEY = "UNIQUE (store_id, item_id, warranty_price, warranty_duration_months)"
+
+# pairs of constraints offering the same warranty for overlapping costs
+OVERLAPPING = text("""
+    SELECT a.constraint_id, b.constraint_id
+    FROM constraints a JOIN constraints b
+        ON a.item_type = b.item_type
+        AND a.warranty_price = b.warranty_price
+        AND a.warranty_duration_months = b.warranty_duration_months
+        AND a.constraint_id < b.constraint_id
+        AND numrange(a.min_cost, a.max_cost, '()') && numrange(b.min_cost, b.max_cost, '()')
+    ORDER BY 1, 2
+""")
+
+EXISTING_CONSTRAINTS = text("""
+    SELECT conname FROM pg_constraint WHERE conrelid = 'constraints'::regclass
+""")
+
+EXISTING_WARRANTIES_KEYS = text("""
+    SELECT pg_get_constraintdef(oid) FROM pg_constraint
+    WHERE conrelid = 'warranties'::regclass AND contype = 'u'
+""")
+
+EXISTING_TRIGGERS = text("""
+    SELECT tgname FROM pg_trigger WHERE tgrelid = 'constraints'::regclass AND NOT tgisinternal
+""")
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+def migrate():
+    """create missing tables & apply STEPS, returns the steps applied (as
+    SQL, those which were no-ops included)"""
+    session = db.session
+    applied = []
+    try:
+        BaseModel.metadata.create_all(session.connection())
+        overlapping = session.execute(OVERLAPPING).fetchall()
+        if overlapping:
+            raise MigrationError("overlapping constraints (constraint_id pairs): {}".format(
+                ", ".join("{}/{}".format(a, b) for (a, b) in overlapping)))
+        for stmt in STEPS:
+            session.execute(stmt)
+            applied.append(str(stmt).strip())
+        triggers = {name for (name,) in session.execute(EXISTING_TRIGGERS)}
+        if "constraints_version_trigger" not in triggers:
+            session.execute(CONSTRAINTS_VERSION_TRIGGER.statement)
+            applied.append(CONSTRAINTS_VERSION_TRIGGER.statement.strip())
+        keys = {key for (key,) in session.execute(EXISTING_WARRANTIES_KEYS)}
+        if WARRANTIES_KEY not in keys:
+            stmt = "ALTER TABLE warranties ADD {}".format(WARRANTIES_KEY)
+            session.execute(stmt)
+            applied.append(stmt)
+        existing = {name for (name,) in session.execute(EXISTING_CONSTRAINTS)}
+        for item_type in ItemType:
+            ddl = exclude_overlapping_constraints(item_type)
+            if "constraints_{}_no_overlap".format(item_type.value) not in existing:
+                session.execute(ddl.statement)
+                applied.append(ddl.statement.strip())
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    log.info("migrate: %s steps", len(applied))
+    return applied
+
+
+def main(argv=None):
+    from pplans.flask.app import DEFAULT_DSN, configured_app
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN)
+    args = parser.parse_args(argv)
+
+    configured_app("pplans.migrate", args.dsn)
+    try:
+        applied = migrate()
+    except MigrationError as ex:
+        raise SystemExit(str(ex))
+    print("\n\n".join(applied))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,14 @@ Flask-SQLAlchemy model definitions.
 Aside from the app context initialization, this is the only module in the
 project that should be aware of SQLAlchemy at all
 """
+import contextlib
 import enum
 import uuid
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import DDL, Computed, event
+from sqlalchemy.dialects.postgresql import NUMRANGE, UUID
+from sqlalchemy.orm import Query, raiseload
 
 
 db = SQLAlchemy()
@@ -71,17 +74,26 @@ class Constraint(BaseModel):
 
     a search for warranty terms for (item_type=furniture, item_cost=75.00) will
     return the first 3 rows
+
+    costs match the open interval (min_cost, max_cost), kept as the numrange
+    cost_range so that a GiST index serves containment (`cost_range @>
+    item_cost`), and so the same warranty cannot be offered twice for a cost:
+    rows of an item_type with equal price & duration must not overlap (see
+    exclude_overlapping_constraints())
     """
     __tablename__ = 'constraints'
     __table_args__ = (
         db.UniqueConstraint('item_type', 'min_cost', 'max_cost',
                             'warranty_price', 'warranty_duration_months'),
+        db.Index('ix_constraints_cost_range', 'cost_range', postgresql_using='gist'),
     )
 
     constraint_id = db.Column(db.Integer, primary_key=True)
     item_type = db.Column(db.Enum(ItemType))
-    min_cost = db.Column(db.Numeric(precision=6, scale=2), index=True, nullable=False)
-    max_cost = db.Column(db.Numeric(precision=6, scale=2), index=True, nullable=False)
+    min_cost = db.Column(db.Numeric(precision=6, scale=2), nullable=False)
+    max_cost = db.Column(db.Numeric(precision=6, scale=2), nullable=False)
+    cost_range = db.Column(NUMRANGE, Computed("numrange(min_cost, max_cost, '()')",
+                                              persisted=True))
     warranty_price = db.Column(db.Numeric(precision=6, scale=2), index=True, nullable=False)
     warranty_duration_months = db.Column(db.Integer, nullable=False)
 
@@ -94,8 +106,83 @@ class Constraint(BaseModel):
                                                        self.warranty_duration_months)
 
 
+class ConstraintsVersion(BaseModel):
+    """Single row table identifying the current state of the constraints table
+
+    every statement modifying constraints sets version to the id of the
+    modifying transaction (see trigger below), so the value changes on every
+    committed edit & never repeats; processes caching constraints compare it
+    against the version they loaded to know when to reload
+    """
+    __tablename__ = 'constraints_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return '<ConstraintsVersion {}>'.format(self.version)
+
+
+event.listen(
+    ConstraintsVersion.__table__,
+    "after_create",
+    DDL("INSERT INTO constraints_version (id, version) VALUES (1, txid_current())")
+    .execute_if(dialect="postgresql")
+)
+
+# also installed by pplans.migrate, on constraints created before the trigger
+CONSTRAINTS_VERSION_TRIGGER = DDL("""
+    CREATE OR REPLACE FUNCTION bump_constraints_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE constraints_version SET version = txid_current() WHERE id = 1;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER constraints_version_trigger
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON constraints
+        FOR EACH STATEMENT EXECUTE PROCEDURE bump_constraints_version();
+    """)
+
+event.listen(
+    Constraint.__table__,
+    "after_create",
+    CONSTRAINTS_VERSION_TRIGGER.execute_if(dialect="postgresql")
+)
+
+
+def exclude_overlapping_constraints(item_type):
+    """DDL of the exclusion constraint rejecting rows of item_type whose
+    cost_range overlaps another's with the same price & duration
+
+    equality is written as the overlap of single value ranges, & item_type
+    as one partial constraint per type, so only GiST's built in range
+    operators are used (btree_gist is not required)"""
+    return DDL("""
+        ALTER TABLE constraints ADD CONSTRAINT constraints_{0}_no_overlap
+            EXCLUDE USING gist (
+                cost_range WITH &&,
+                numrange(warranty_price, warranty_price, '[]') WITH &&,
+                int4range(warranty_duration_months, warranty_duration_months, '[]') WITH &&)
+            WHERE (item_type = '{0}')
+        """.format(item_type.value))
+
+
+for _item_type in ItemType:
+    event.listen(
+        Constraint.__table__,
+        "after_create",
+        exclude_overlapping_constraints(_item_type).execute_if(dialect="postgresql")
+    )
+
+
 class Warranty(BaseModel):
     __tablename__ = 'warranties'
+    __table_args__ = (
+        # natural key, makes repeated quotes for same item & store idempotent
+        db.UniqueConstraint('store_id', 'item_id', 'warranty_price',
+                            'warranty_duration_months'),
+    )
 
     warranty_id = db.Column(db.Integer, primary_key=True)
     store_id = db.Column(db.Integer, db.ForeignKey("stores.store_id"), nullable=False)
@@ -113,3 +200,148 @@ class Warranty(BaseModel):
                                                   self.warranty_price,
                                                   self.warranty_duration_months)
 
+
+class WarrantyLookup(BaseModel):
+    """Read model of warranties, each joined with its item & store: one row
+    per warranty holding the fields get_warranties() returns, so lookups
+    read one table without joins
+
+    rows are maintained by the triggers below, in the transaction writing
+    warranties (or changing the identifying fields of items & stores);
+    pplans.lookups rebuilds them, eg to backfill an existing db.  Each
+    filter has an index ending in warranty_id, for pages in that order
+    """
+    __tablename__ = 'warranty_lookups'
+    __table_args__ = (
+        db.Index('ix_warranty_lookups_item_type', 'item_type', 'warranty_id'),
+        db.Index('ix_warranty_lookups_item_sku', 'item_sku', 'warranty_id'),
+        db.Index('ix_warranty_lookups_item_uuid', 'item_uuid', 'warranty_id'),
+        db.Index('ix_warranty_lookups_store_uuid', 'store_uuid', 'warranty_id'),
+    )
+
+    warranty_id = db.Column(db.Integer, db.ForeignKey("warranties.warranty_id",
+                                                      ondelete="CASCADE",
+                                                      onupdate="CASCADE"),
+                            primary_key=True)
+    item_type = db.Column(db.Enum(ItemType))
+    item_sku = db.Column(db.String(32), nullable=False)
+    item_uuid = db.Column(UUID(as_uuid=True), nullable=False)
+    store_uuid = db.Column(UUID(as_uuid=True), nullable=False)
+    warranty_price = db.Column(db.Numeric(precision=6, scale=2), nullable=False)
+    warranty_duration_months = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<WarrantyLookup {}:{}:{}-{}-{}-{}>'.format(self.warranty_id,
+                                                          self.item_type,
+                                                          self.item_sku,
+                                                          self.store_uuid,
+                                                          self.warranty_price,
+                                                          self.warranty_duration_months)
+
+
+# rows of warranty_lookups for the warranties in the relation new_warranties
+_SELECT_LOOKUPS = """
+    SELECT w.warranty_id, i.item_type, i.item_sku, i.item_uuid, s.store_uuid,
+           w.warranty_price, w.warranty_duration_months
+    FROM new_warranties w
+    JOIN items i ON i.item_id = w.item_id
+    JOIN stores s ON s.store_id = w.store_id
+"""
+
+# statement level triggers see every row written by a statement at once (a
+# multi-VALUES insert or COPY), so the lookups are written in one statement
+# too; deleted warranties cascade via the foreign key.  Item & store
+# upserts only SET cost & title, so do not fire the UPDATE OF triggers
+event.listen(
+    WarrantyLookup.__table__,
+    "after_create",
+    DDL("""
+        CREATE OR REPLACE FUNCTION insert_warranty_lookups() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO warranty_lookups {select};
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION update_warranty_lookups() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM warranty_lookups WHERE warranty_id IN (
+                SELECT warranty_id FROM old_warranties
+                UNION SELECT warranty_id FROM new_warranties);
+            INSERT INTO warranty_lookups {select};
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION update_item_lookups() RETURNS trigger AS $$
+        BEGIN
+            UPDATE warranty_lookups
+            SET item_type = NEW.item_type, item_sku = NEW.item_sku, item_uuid = NEW.item_uuid
+            WHERE item_uuid = OLD.item_uuid;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION update_store_lookups() RETURNS trigger AS $$
+        BEGIN
+            UPDATE warranty_lookups SET store_uuid = NEW.store_uuid
+            WHERE store_uuid = OLD.store_uuid;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER warranty_lookups_insert
+            AFTER INSERT ON warranties REFERENCING NEW TABLE AS new_warranties
+            FOR EACH STATEMENT EXECUTE PROCEDURE insert_warranty_lookups();
+
+        CREATE TRIGGER warranty_lookups_update
+            AFTER UPDATE ON warranties
+            REFERENCING OLD TABLE AS old_warranties NEW TABLE AS new_warranties
+            FOR EACH STATEMENT EXECUTE PROCEDURE update_warranty_lookups();
+
+        CREATE TRIGGER item_lookups_update
+            AFTER UPDATE OF item_type, item_sku, item_uuid ON items
+            FOR EACH ROW
+            WHEN (OLD.item_type IS DISTINCT FROM NEW.item_type
+                  OR OLD.item_sku IS DISTINCT FROM NEW.item_sku
+                  OR OLD.item_uuid IS DISTINCT FROM NEW.item_uuid)
+            EXECUTE PROCEDURE update_item_lookups();
+
+        CREATE TRIGGER store_lookups_update
+            AFTER UPDATE OF store_uuid ON stores
+            FOR EACH ROW WHEN (OLD.store_uuid IS DISTINCT FROM NEW.store_uuid)
+            EXECUTE PROCEDURE update_store_lookups();
+        """.format(select=_SELECT_LOOKUPS)).execute_if(dialect="postgresql")
+)
+
+# so that the tables left do not write to one which no longer exists
+event.listen(
+    WarrantyLookup.__table__,
+    "before_drop",
+    DDL("""
+        DROP TRIGGER IF EXISTS warranty_lookups_insert ON warranties;
+        DROP TRIGGER IF EXISTS warranty_lookups_update ON warranties;
+        DROP TRIGGER IF EXISTS item_lookups_update ON items;
+        DROP TRIGGER IF EXISTS store_lookups_update ON stores;
+        """).execute_if(dialect="postgresql")
+)
+
+
+def _raiseload(query):
+    return query.options(raiseload("*"))
+
+
+@contextlib.contextmanager
+def strict_loading():
+    """lazy loading any relationship (eg Warranty.item) of objects loaded
+    within the context raises sqlalchemy.exc.InvalidRequestError, in every
+    thread
+
+    intended for tests, to make accidental per-row lazy loads fail loudly;
+    the before_compile listener doing so is only registered meanwhile, so
+    does not apply (or stop baked lazy loads being cached) otherwise"""
+    event.listen(Query, "before_compile", _raiseload, retval=True, bake_ok=True)
+    try:
+        yield
+    finally:
+        event.remove(Query, "before_compile", _raiseload)
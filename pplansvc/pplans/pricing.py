@@ -0,0 +1,207 @@
+"""
+In-memory pricing structures built from Constraint rows.
+
+Nothing here touches the database; `pplans.warranty` loads the rows and
+decides when to rebuild.  A cost matches a constraint when
+min_cost < item_cost < max_cost, exactly as the SQL filter it replaces.
+
+`ConstraintArrays` requires numpy (`pip install pplansvc[bulk]`), which is
+only imported when it is used.
+"""
+import bisect
+import collections
+import decimal
+
+
+# CSR-style result of ConstraintArrays.price(): the constraints item i is
+# eligible for are constraint_id[indptr[i]:indptr[i+1]], and likewise for
+# warranty_price & warranty_duration_months
+BulkPricing = collections.namedtuple(
+    "BulkPricing",
+    ["indptr", "constraint_id", "warranty_price", "warranty_duration_months"]
+)
+
+
+def to_cost(value):
+    """coerce str/float/int/Decimal to Decimal, raising ValueError if invalid"""
+    try:
+        cost = decimal.Decimal(str(value))
+    except decimal.InvalidOperation:
+        raise ValueError("invalid cost: {}".format(value))
+    if not cost.is_finite():
+        raise ValueError("invalid cost: {}".format(value))
+    return cost
+
+
+class IntervalIndex(object):
+    """matches a cost against a set of open (min_cost, max_cost) intervals
+
+    the sorted distinct bounds b[0] < b[1] < ... < b[n-1] split the number
+    line into 2n+1 slots: each bound itself, and the open gaps between them.
+    The set of intervals containing a cost is the same for every cost in a
+    slot, so it is precomputed per slot and a lookup is a single bisect.
+
+    The slots are filled by one sweep over the bounds, in O(n log n) plus
+    the size of the sets themselves; each set is in the order of rows.
+    """
+
+    def __init__(self, rows):
+        """rows is a list of (min_cost, max_cost, value) tuples"""
+        starts = collections.defaultdict(list)
+        ends = collections.defaultdict(list)
+        for (i, (lo, hi, v)) in enumerate(rows):
+            # an empty interval contains nothing
+            if lo < hi:
+                starts[lo].append(i)
+                ends[hi].append(i)
+        bounds = sorted({lo for (lo, hi, v) in rows} | {hi for (lo, hi, v) in rows})
+
+        def values(active):
+            return tuple(rows[i][2] for i in sorted(active))
+
+        self.bounds = bounds
+        # gaps[i] is the open interval (bounds[i-1], bounds[i]); gaps[0] and
+        # gaps[n] are unbounded and can never match an open interval
+        self.gaps = [()]
+        self.points = []
+        # indexes of the rows with lo < the current bound <= hi, & their
+        # values, only recomputed when a row starts or ends there
+        active = set()
+        current = ()
+        for b in bounds:
+            if b in ends:
+                active.difference_update(ends[b])
+                current = values(active)
+            self.points.append(current)
+            if b in starts:
+                active.update(starts[b])
+                current = values(active)
+            self.gaps.append(current)
+
+    def match(self, cost):
+        i = bisect.bisect_left(self.bounds, cost)
+        if i < len(self.bounds) and self.bounds[i] == cost:
+            return self.points[i]
+        return self.gaps[i]
+
+
+class ConstraintIndex(object):
+    """per-item_type interval indexes over constraint rows
+
+    constraints are dicts as returned by `pplans.warranty.get_constraints`;
+    version identifies the state of the constraints table they were read at
+    """
+
+    def __init__(self, constraints, version=None):
+        self.version = version
+        self._arrays = None
+        self.constraints = sorted(constraints, key=lambda c: c["constraint_id"])
+        by_type = collections.defaultdict(list)
+        for c in self.constraints:
+            by_type[c["item_type"]].append(
+                (to_cost(c["min_cost"]), to_cost(c["max_cost"]), c))
+        self.by_type = {item_type: IntervalIndex(rows)
+                        for (item_type, rows) in by_type.items()}
+
+    def __repr__(self):
+        return '<ConstraintIndex {} {} constraints>'.format(self.version,
+                                                          len(self.constraints))
+
+    def arrays(self):
+        """ConstraintArrays of the same constraints, built on first use"""
+        if self._arrays is None:
+            self._arrays = ConstraintArrays(self.constraints)
+        return self._arrays
+
+    def match(self, item_type="", item_cost=""):
+        """constraints for item_type (all types if empty) containing item_cost
+        (any cost if empty), ordered by constraint_id
+
+        raises ValueError if item_cost is invalid"""
+        if not item_cost:
+            return [c for c in self.constraints
+                    if not item_type or c["item_type"] == item_type]
+        cost = to_cost(item_cost)
+        if item_type:
+            index = self.by_type.get(item_type)
+            return list(index.match(cost)) if index else []
+        ret = []
+        for index in self.by_type.values():
+            ret.extend(index.match(cost))
+        return sorted(ret, key=lambda c: c["constraint_id"])
+
+
+class ConstraintArrays(object):
+    """constraint bounds as numpy arrays, for pricing many costs at once
+
+    constraints are held sorted by (item_type, constraint_id), with each
+    item_type occupying a contiguous slice of the arrays.  Costs are compared
+    as float64, which preserves the strict comparisons for costs given to the
+    cent (the precision of the Constraint columns)
+    """
+
+    # rows of the (costs x constraints) eligibility matrix evaluated at once
+    CHUNK_SIZE = 65536
+
+    def __init__(self, constraints):
+        import numpy as np
+
+        constraints = sorted(constraints, key=lambda c: (c["item_type"], c["constraint_id"]))
+        self.constraint_id = np.array([c["constraint_id"] for c in constraints], dtype=np.int64)
+        self.min_cost = np.array([float(c["min_cost"]) for c in constraints], dtype=np.float64)
+        self.max_cost = np.array([float(c["max_cost"]) for c in constraints], dtype=np.float64)
+        self.warranty_price = np.array([float(c["warranty_price"]) for c in constraints],
+                                       dtype=np.float64)
+        self.warranty_duration_months = np.array(
+            [c["warranty_duration_months"] for c in constraints], dtype=np.int64)
+        self.slices = {}
+        for (i, c) in enumerate(constraints):
+            start = self.slices[c["item_type"]].start if c["item_type"] in self.slices else i
+            self.slices[c["item_type"]] = slice(start, i + 1)
+
+    def eligibility(self, item_type, costs):
+        """boolean matrix, [i, j] is True if costs[i] is eligible for the j-th
+        constraint of item_type, whose ids are returned alongside
+
+        returns (matrix, constraint_ids)"""
+        import numpy as np
+
+        costs = np.asarray(costs, dtype=np.float64).ravel()
+        s = self.slices.get(item_type, slice(0, 0))
+        matrix = ((self.min_cost[s] < costs[:, None]) & (costs[:, None] < self.max_cost[s]))
+        return (matrix, self.constraint_id[s])
+
+    def price(self, item_types, costs):
+        """price costs[i] as an item of type item_types[i] (or of item_types,
+        if a single str is given), returns BulkPricing in input order"""
+        import numpy as np
+
+        costs = np.asarray(costs, dtype=np.float64).ravel()
+        n = len(costs)
+        if isinstance(item_types, str):
+            item_types = np.full(n, item_types, dtype=object)
+        else:
+            item_types = np.asarray(item_types, dtype=object).ravel()
+        if len(item_types) != n:
+            raise ValueError("item_types & costs must have the same length")
+
+        rows = [np.empty(0, dtype=np.int64)]
+        cols = [np.empty(0, dtype=np.int64)]
+        for (item_type, s) in self.slices.items():
+            selected = np.flatnonzero(item_types == item_type)
+            for start in range(0, len(selected), self.CHUNK_SIZE):
+                chunk = selected[start:start + self.CHUNK_SIZE]
+                c = costs[chunk][:, None]
+                (r, j) = np.nonzero((self.min_cost[s] < c) & (c < self.max_cost[s]))
+                rows.append(chunk[r])
+                cols.append(s.start + j)
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        # group by input row; stable sort keeps constraint_id order within a row
+        order = np.argsort(rows, kind="stable")
+        cols = cols[order]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        return BulkPricing(indptr, self.constraint_id[cols], self.warranty_price[cols],
+                           self.warranty_duration_months[cols])
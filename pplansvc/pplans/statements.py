@@ -0,0 +1,145 @@
+"""
+SQLAlchemy Core statements for the hot paths of `pplans.warranty` and
+`pplans.aio`.
+
+Each statement is built once per shape, with bind parameters in place of
+every value, so its compiled form can be reused: `pplans.warranty` executes
+them with a `compiled_cache`, and `pplans.aio` compiles each once for
+asyncpg, which prepares them server side.
+"""
+from sqlalchemy import Numeric, and_, bindparam, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from pplans.models import Constraint, ConstraintsVersion, Item, Store, Warranty, WarrantyLookup
+
+
+ITEM_FIELDS = ("item_uuid", "item_type", "item_sku", "item_cost", "item_title")
+STORE_FIELDS = ("store_uuid", "store_name")
+
+# columns selected by warranty lookups, from the warranty_lookups read model
+WARRANTY_COLUMNS = (
+    WarrantyLookup.warranty_id,
+    WarrantyLookup.item_sku,
+    WarrantyLookup.item_type,
+    WarrantyLookup.item_uuid,
+    WarrantyLookup.store_uuid,
+    WarrantyLookup.warranty_price,
+    WarrantyLookup.warranty_duration_months,
+)
+
+# filters accepted by lookup_statement()
+LOOKUP_FILTERS = {
+    "item_type": WarrantyLookup.item_type,
+    "item_sku": WarrantyLookup.item_sku,
+    "item_uuid": WarrantyLookup.item_uuid,
+    "store_uuid": WarrantyLookup.store_uuid,
+}
+
+
+def upsert_items_statement(rows=None):
+    """insert items, updating cost & title of existing (item_type, item_sku)
+    only when they changed; rows is a list of dicts for a multi-VALUES
+    statement, or None for one row of bind parameters named ITEM_FIELDS
+
+    returns item_id, item_uuid, item_type, item_sku of new & changed rows"""
+    table = Item.__table__
+    stmt = insert(table).values(rows or {name: bindparam(name) for name in ITEM_FIELDS})
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.item_type, table.c.item_sku],
+        set_={
+            "item_cost": stmt.excluded.item_cost,
+            "item_title": stmt.excluded.item_title,
+        },
+        where=(table.c.item_cost.is_distinct_from(stmt.excluded.item_cost)
+               | table.c.item_title.is_distinct_from(stmt.excluded.item_title)),
+    ).returning(table.c.item_id, table.c.item_uuid, table.c.item_type, table.c.item_sku)
+
+
+def select_items_statement(keys=None):
+    """items by a list of (item_type, item_sku), or by bind parameters
+    item_type & item_sku if None"""
+    table = Item.__table__
+    stmt = select([table.c.item_id, table.c.item_uuid, table.c.item_type, table.c.item_sku])
+    if keys is None:
+        return stmt.where((table.c.item_type == bindparam("item_type"))
+                          & (table.c.item_sku == bindparam("item_sku")))
+    return stmt.where(tuple_(table.c.item_type, table.c.item_sku).in_(keys))
+
+
+def insert_stores_statement(rows=None):
+    """insert stores not yet known, rows as for upsert_items_statement() with
+    bind parameters named STORE_FIELDS; returns store_id, store_uuid"""
+    table = Store.__table__
+    stmt = insert(table).values(rows or {name: bindparam(name) for name in STORE_FIELDS})
+    return stmt.on_conflict_do_nothing(
+        index_elements=[table.c.store_uuid],
+    ).returning(table.c.store_id, table.c.store_uuid)
+
+
+def select_stores_statement(store_uuids=None):
+    """stores by a list of store_uuid, or by bind parameter store_uuid"""
+    table = Store.__table__
+    stmt = select([table.c.store_id, table.c.store_uuid])
+    if store_uuids is None:
+        return stmt.where(table.c.store_uuid == bindparam("store_uuid"))
+    return stmt.where(table.c.store_uuid.in_(store_uuids))
+
+
+def _insert_warranties_statement():
+    table = Warranty.__table__
+    # inline: leave warranty_id to its sequence rather than binding it
+    return insert(table, inline=True).values(
+        item_id=bindparam("item_id"),
+        store_id=bindparam("store_id"),
+        warranty_price=bindparam("warranty_price"),
+        warranty_duration_months=bindparam("warranty_duration_months"),
+    ).on_conflict_do_nothing(
+        index_elements=[table.c.store_id, table.c.item_id,
+                        table.c.warranty_price, table.c.warranty_duration_months],
+    )
+
+
+UPSERT_ITEM = upsert_items_statement()
+SELECT_ITEM = select_items_statement()
+INSERT_STORE = insert_stores_statement()
+SELECT_STORE = select_stores_statement()
+# skips warranties which already exist, execute with many rows at once
+INSERT_WARRANTY = _insert_warranties_statement()
+SELECT_CONSTRAINTS_VERSION = select([ConstraintsVersion.version]).where(
+    ConstraintsVersion.id == 1)
+SELECT_CONSTRAINTS = select([
+    Constraint.constraint_id,
+    Constraint.item_type,
+    Constraint.min_cost,
+    Constraint.max_cost,
+    Constraint.warranty_price,
+    Constraint.warranty_duration_months,
+])
+# constraints of bind parameter item_type whose cost_range contains
+# item_cost, served by the GiST index on cost_range
+MATCH_CONSTRAINTS = SELECT_CONSTRAINTS.where(and_(
+    Constraint.item_type == bindparam("item_type"),
+    Constraint.cost_range.contains(bindparam("item_cost", type_=Numeric)),
+)).order_by(Constraint.constraint_id)
+
+_lookup_statements = {}
+
+
+def lookup_statement(filters, after=False, paged=False):
+    """warranties matching bind parameters named for each of filters (keys
+    of LOOKUP_FILTERS), ordered by warranty_id; after adds bind parameter
+    `after` (a warranty_id to start after) and paged `limit`
+
+    statements are built once per combination, and reused"""
+    key = (tuple(sorted(filters)), bool(after), bool(paged))
+    stmt = _lookup_statements.get(key)
+    if stmt is None:
+        wheres = [LOOKUP_FILTERS[name] == bindparam(name) for name in key[0]]
+        if after:
+            wheres.append(WarrantyLookup.warranty_id > bindparam("after"))
+        stmt = select(WARRANTY_COLUMNS).where(and_(*wheres)).order_by(
+            WarrantyLookup.warranty_id)
+        if paged:
+            stmt = stmt.limit(bindparam("limit"))
+        stmt = _lookup_statements.setdefault(key, stmt)
+    return stmt
@@ -0,0 +1,126 @@
+"""
+db fixtures shared by the integration tests
+
+Each test process runs against a db of its own, cloned from a template
+with the schema & demo data when it first calls testing_app(), & dropped
+when it exits; the template is rebuilt only when pplans.models or the demo
+data change.  So integration tests may run in parallel processes, eg
+
+    ./setup.py integration --processes 4
+
+PplansTestCase then runs each test in a transaction which is rolled back
+afterwards (see morus.testing.database), rather than recreating the db for
+every test.
+"""
+import atexit
+import hashlib
+import inspect
+import os
+
+from sqlalchemy.engine.url import make_url
+
+from morus.testing.base import MorusTestCase
+from morus.testing.database import (
+    cloned_database,
+    rolled_back,
+    template_database,
+)
+
+from pplans import models
+from pplans.flask.app import DEFAULT_DSN, configured_app
+from pplans.models import db
+from pplans.warranty import (
+    clear_identity_caches,
+    configure_constraint_index,
+    create_demo_data,
+    invalidate_constraint_index,
+)
+
+
+# server & credentials the test dbs are created with, & named after
+BASE_DSN = os.environ.get("PPLANSVC_TEST_DSN", DEFAULT_DSN)
+
+# emptied by reset_data(), in dependency order
+TABLES = ("warranties", "items", "stores", "constraints")
+
+_dsn = None
+_app = None
+
+
+def _seed_template(dsn):
+    # testing=True will cause app to recreate db & populate test data
+    app = configured_app('pplansvc', dsn, testing=True)
+    db.session.remove()
+    db.get_engine(app).dispose()
+
+
+def _template_fingerprint():
+    source = inspect.getsource(models) + inspect.getsource(create_demo_data)
+    return hashlib.sha1(source.encode("utf8")).hexdigest()
+
+
+def testing_dsn():
+    """dsn of this process' db, cloned from the template when first called"""
+    global _dsn
+    if _dsn is None:
+        template = template_database(
+            BASE_DSN, "{}_template".format(make_url(BASE_DSN).database),
+            _seed_template, _template_fingerprint())
+        clone = cloned_database(BASE_DSN, template)
+        _dsn = clone.__enter__()
+        atexit.register(clone.__exit__, None, None, None)
+    return _dsn
+
+
+def testing_app():
+    """the app tests share, on this process' db"""
+    global _app
+    if _app is None:
+        _app = configured_app('pplansvc', testing_dsn(), admin=True)
+    return _app
+
+
+def reset_data():
+    """replace all rows with the demo data, after tests which commit"""
+    db.session.remove()
+    with db.get_engine(testing_app()).begin() as conn:
+        conn.execute("TRUNCATE {} RESTART IDENTITY CASCADE".format(", ".join(TABLES)))
+    create_demo_data()
+    db.session.remove()
+
+
+def recreate_schema():
+    """drop & recreate the tables, empty, after tests which change them"""
+    db.session.remove()
+    db.drop_all(app=testing_app())
+    db.create_all(app=testing_app())
+
+
+class PplansTestCase(MorusTestCase):
+    """runs each test against the demo data, its writes rolled back after
+
+    sessions all share one connection, so a background_instance must be
+    serving with threaded=False.  Tests which need their writes committed
+    (made concurrently, over several connections, or outside the app's
+    session) set transactional = False, and the demo data is recreated
+    after each instead"""
+
+    transactional = True
+
+    def setUp(self):
+        self.dsn = testing_dsn()
+        self.app = testing_app()
+        # checked inline, in the test's session, not by a refresher thread
+        configure_constraint_index(background=False)
+        self.addCleanup(invalidate_constraint_index)
+        # ids of rows rolled back or truncated
+        self.addCleanup(clear_identity_caches)
+        if self.transactional:
+            transaction = rolled_back(db.session, db.get_engine(self.app))
+            transaction.__enter__()
+            self.addCleanup(transaction.__exit__, None, None, None)
+        else:
+            self.addCleanup(reset_data)
+        # flask test_client & direct calls run in the app context pushed by
+        # configured_app, so their session outlives the request
+        self.addCleanup(db.session.remove)
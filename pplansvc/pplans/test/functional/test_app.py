@@ -5,9 +5,11 @@ database models & requests to external resources should be mocked
 """
 import os
 
+from morus.pool import InstrumentedNullPool
 from morus.testing.base import MorusTestCase
 
 from pplans.flask.app import DEFAULT_DSN, configured_app
+from pplans.warranty import configure_constraint_index, constraint_index_stats
 
 class TestPplansvcApp(MorusTestCase):
 
@@ -30,3 +32,42 @@ class TestPplansvcApp(MorusTestCase):
         expect = b'{"status":"Filter criteria is required"}\n'
         self.assertEqual(resp.data, expect)
 
+    def test_admin(self):
+        # not served unless enabled
+        self.assertEqual(self.app.test_client().get("/admin/identities").status_code, 404)
+
+        class config:
+            PROFILE_TOKEN = "secret"
+
+        app = configured_app('pplansvc', self.dsn, config_module=config, admin=True)
+        client = app.test_client()
+        self.assertEqual(client.get("/admin/identities").status_code, 403)
+        resp = client.get("/admin/identities", headers={"X-Profile": "secret"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue("enabled" in resp.get_json())
+
+    def test_constraint_index_config(self):
+        self.addCleanup(configure_constraint_index)
+        # refreshed off the request path unless configured otherwise
+        self.assertTrue(constraint_index_stats()["background"])
+
+        class config:
+            CONSTRAINT_INDEX_BACKGROUND = False
+
+        configured_app('pplansvc', self.dsn, config_module=config)
+        self.assertFalse(constraint_index_stats()["background"])
+
+        # a background thread would reload constraints continuously
+        with self.assertRaises(ValueError):
+            configure_constraint_index(poll_seconds=0, background=True)
+
+    def test_pool_config(self):
+        app = configured_app('pplansvc', self.dsn, pool_size=3, pool_pre_ping=True)
+        options = app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+        self.assertEqual((options["pool_size"], options["pool_pre_ping"]), (3, True))
+        self.assertEqual(app.config["DB_POOL_SIZE"], 3)
+
+        app = configured_app('pplansvc', self.dsn, pool_size=3, pgbouncer=True)
+        options = app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+        self.assertEqual(options["poolclass"], InstrumentedNullPool)
+        self.assertFalse("pool_size" in options)
@@ -0,0 +1,18 @@
+import statistics
+
+from morus import startup
+from morus.testing.base import MorusTestCase
+
+from pplans.benchmarks.startup import BUDGET, LAZY_MODULES, STATEMENT
+
+
+class TestColdStart(MorusTestCase):
+
+    def test_lazy_modules(self):
+        imported = startup.imported_modules(STATEMENT)
+        self.assertIn("flask", imported)
+        self.assertEqual(imported.intersection(LAZY_MODULES), set())
+
+    def test_budget(self):
+        elapsed = statistics.median(startup.cold_start(STATEMENT, repeat=3))
+        self.assertLess(elapsed, BUDGET, "cold start regressed, see setup.py importtime")
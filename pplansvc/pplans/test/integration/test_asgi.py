@@ -0,0 +1,74 @@
+"""
+Integration tests for the ASGI variant of the app, against the same db
+"""
+import uuid
+
+from morus.asgi import TestClient
+
+from pplans.asgi.app import configured_app as asgi_app
+from pplans.test.fixtures import PplansTestCase
+from pplans.warranty import WARRANTY_ERRORS
+
+
+class TestPplansvcASGI(PplansTestCase):
+
+    # the asgi app has connections of its own
+    transactional = False
+
+    def setUp(self):
+        super(TestPplansvcASGI, self).setUp()
+        self.flask_app = self.app
+        self.app = asgi_app('pplansvc', self.dsn, pool_min_size=1, pool_max_size=2)
+
+    def test_heartbeat(self):
+        with TestClient(self.app) as client:
+            r = client.get("/")
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.json(), {"pplansvc-server": "ok"})
+
+    def test_warranties(self):
+        with TestClient(self.app) as client:
+            r = client.get("/warranties/")
+            self.assertEqual(r.status_code, 400)
+            self.assertEqual(r.json(), {"status": WARRANTY_ERRORS["filter req"]})
+            r = client.get("/warranties/", query={"store_uuid": "b21ad0676f26439"})
+            self.assertEqual(r.status_code, 400)
+            self.assertEqual(r.json(), {"status": WARRANTY_ERRORS["bad store_uuid"].format(
+                "b21ad0676f26439")})
+
+            r = client.get("/warranties/", query={"item_type": "electronics"})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers["content-type"], "application/json")
+            self.assertEqual(r.json()[0]["item_sku"], "ELEC-999")
+
+            data = {
+                "item_type": "furniture",
+                "item_cost": "150.00",
+                "item_sku": "ASYNC-1",
+                "item_title": "Async Sofa",
+                "store_uuid": str(uuid.uuid4()),
+            }
+            r = client.post("/warranties/", data=dict(data, store_uuid="b21ad0676f26439"))
+            self.assertEqual(r.status_code, 400)
+            self.assertTrue(r.json()["status"].startswith("Invalid store_uuid"))
+
+            for i in range(2):
+                r = client.post("/warranties/", data=data)
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(len(r.json()), 2)
+
+            # written once, visible to both variants
+            r = client.get("/warranties/", query={"item_sku": "ASYNC-1"})
+            self.assertEqual(len(r.json()), 2)
+            r = self.flask_app.test_client().get("/warranties/?item_sku=ASYNC-1")
+            self.assertEqual(r.get_json(), client.get(
+                "/warranties/", query={"item_sku": "ASYNC-1"}).json())
+
+    def test_constraints(self):
+        with TestClient(self.app) as client:
+            self.assertEqual(len(client.get("/warranties/constraints").json()), 7)
+            r = client.get("/warranties/constraints", query={"item_type": "furniture"})
+            self.assertEqual(len(r.json()), 5)
+            r = client.get("/warranties/constraints",
+                           query={"item_type": "furniture", "item_cost": "75.00"})
+            self.assertEqual(len(r.json()), 3)
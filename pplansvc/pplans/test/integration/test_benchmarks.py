@@ -0,0 +1,47 @@
+from pplans.benchmarks import constraints, warranty as suite
+from pplans.models import db
+from pplans.test.fixtures import PplansTestCase, recreate_schema
+
+
+class TestWarrantyBenchmarks(PplansTestCase):
+
+    # the suite drops & recreates the tables, so they are recreated (then
+    # the demo data) after
+    transactional = False
+
+    def setUp(self):
+        super(TestWarrantyBenchmarks, self).setUp()
+        self.addCleanup(recreate_schema)
+
+    def test_run(self):
+        results = suite.run(self.dsn, [100], iterations=5)
+        self.assertEqual(list(results), ["100"])
+        benchmarks = results["100"]
+        # 15 combinations of the 4 filters
+        self.assertEqual(len([name for name in benchmarks
+                              if name.startswith("get_warranties[")]), 15)
+        self.assertEqual(benchmarks["get_warranties[item_type]"]["queries"], 1)
+        self.assertEqual(benchmarks["get_constraints"]["queries"], 0)
+        # seeded, plus those quoted by the warranty benchmark
+        self.assertGreater(db.session.execute("SELECT count(*) FROM warranties").scalar(),
+                           100)
+
+
+class TestConstraintBenchmarks(PplansTestCase):
+
+    transactional = False
+
+    def setUp(self):
+        super(TestConstraintBenchmarks, self).setUp()
+        # & the B-tree indexes seeding adds
+        self.addCleanup(recreate_schema)
+
+    def test_run(self):
+        # the demo data's warranties are not deleted unless forced
+        with self.assertRaises(constraints.DatabaseNotEmpty):
+            constraints.run(self.dsn, [100], max_width=100, iterations=5)
+        self.assertGreater(db.session.execute("SELECT count(*) FROM warranties").scalar(), 0)
+
+        results = constraints.run(self.dsn, [100], max_width=100, iterations=5, force=True)
+        self.assertEqual(sorted(results["100"]), ["btree", "gist", "in process"])
+        self.assertEqual(db.session.execute("SELECT count(*) FROM warranties").scalar(), 0)
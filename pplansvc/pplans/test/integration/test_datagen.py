@@ -0,0 +1,38 @@
+from pplans import datagen
+from pplans.models import db, Item, Store, Warranty
+from pplans.test.fixtures import PplansTestCase
+from pplans.warranty import get_constraints, get_warranties
+
+
+class TestDatagen(PplansTestCase):
+
+    def test_load_data(self):
+        counts = datagen.load_data(items=500, stores=20, seed=3)
+        self.assertEqual(counts["items"], 500)
+        self.assertEqual(counts["stores"], 20)
+        # demo data's constraints are kept
+        self.assertEqual(counts["constraints"], 0)
+        self.assertEqual(Item.query.count(), 3 + 500)
+        self.assertEqual(Store.query.count(), 1 + 20)
+        self.assertEqual(Warranty.query.count(), 6 + counts["warranties"])
+
+        # sequences continue after the copied ids
+        item = Item(item_type="furniture", item_sku="NEXT", item_cost="10.00")
+        db.session.add(item)
+        db.session.commit()
+        self.assertEqual(item.item_id, 3 + 500 + 1)
+
+        # copied warranties are found like any others
+        item = Item.query.filter(Item.item_id == 4).one()
+        self.assertTrue(get_warranties(item_sku=item.item_sku) or
+                        not get_constraints(item.item_type.value, item.item_cost))
+
+    def test_load_constraints(self):
+        db.session.execute("DELETE FROM warranties")
+        db.session.execute("DELETE FROM constraints")
+        db.session.commit()
+        counts = datagen.load_data(items=200, stores=10)
+        self.assertEqual(counts["constraints"], len(list(datagen.generate_constraints())))
+        # every item has a warranty with the generated constraints
+        self.assertEqual(db.session.execute(
+            "SELECT count(DISTINCT item_id) FROM warranties").scalar(), 200)
@@ -0,0 +1,41 @@
+import sqlalchemy
+from sqlalchemy.engine.url import make_url
+
+from morus.testing.database import cloned_database, template_database
+
+from pplans.test.fixtures import BASE_DSN, PplansTestCase
+
+
+def scalar(dsn, statement, *params):
+    engine = sqlalchemy.create_engine(dsn, poolclass=sqlalchemy.pool.NullPool)
+    try:
+        return engine.execute(statement, *params).scalar()
+    finally:
+        engine.dispose()
+
+
+def count(dsn, table):
+    return scalar(dsn, "SELECT count(*) FROM {}".format(table))
+
+
+class TestTemplateClones(PplansTestCase):
+
+    transactional = False
+
+    def test_clones(self):
+        template = make_url(self.dsn).database.rsplit("_", 1)[0]
+        # built by testing_dsn(), so not seeded again
+        fingerprint = scalar(BASE_DSN, "SELECT shobj_description(oid, 'pg_database') "
+                             "FROM pg_database WHERE datname = %s", (template,))
+        self.assertEqual(template_database(BASE_DSN, template, self.fail, fingerprint),
+                         template)
+
+        with cloned_database(BASE_DSN, template) as dsn:
+            # a second clone of the template, next to this process' own
+            self.assertNotEqual(dsn, self.dsn)
+            self.assertEqual(count(dsn, "warranties"), 6)
+            scalar(dsn, "DELETE FROM warranties RETURNING 1")
+            self.assertEqual(count(dsn, "warranties"), 0)
+            self.assertEqual(count(self.dsn, "warranties"), 6)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            count(dsn, "warranties")
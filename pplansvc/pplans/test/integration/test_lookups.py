@@ -0,0 +1,87 @@
+import uuid
+
+from pplans import datagen
+from pplans.lookups import REBUILD, rebuild_lookups
+from pplans.models import db
+from pplans.test.fixtures import PplansTestCase
+from pplans.warranty import get_warranties, warranty, warranty_batch
+
+
+# warranties joined with their items & stores, as the lookups should hold
+JOINED = """
+    SELECT w.warranty_id, i.item_type::text, i.item_sku, i.item_uuid, s.store_uuid,
+           w.warranty_price, w.warranty_duration_months
+    FROM warranties w
+    JOIN items i ON i.item_id = w.item_id
+    JOIN stores s ON s.store_id = w.store_id
+    ORDER BY w.warranty_id
+"""
+
+LOOKUPS = """
+    SELECT warranty_id, item_type::text, item_sku, item_uuid, store_uuid,
+           warranty_price, warranty_duration_months
+    FROM warranty_lookups
+    ORDER BY warranty_id
+"""
+
+
+class TestWarrantyLookups(PplansTestCase):
+
+    def assertLookupsCurrent(self):
+        joined = db.session.execute(JOINED).fetchall()
+        self.assertTrue(joined)
+        self.assertEqual(db.session.execute(LOOKUPS).fetchall(), joined)
+
+    def test_maintained_on_write(self):
+        # demo data
+        self.assertLookupsCurrent()
+
+        store_uuid = uuid.uuid4()
+        warranty("150.00", "LOOKUP-1", "Looked Up Sofa", "furniture", store_uuid)
+        warranty_batch([{"item_cost": "80.00", "item_sku": "LOOKUP-{}".format(i),
+                         "item_title": "Batch Chair", "item_type": "furniture",
+                         "store_uuid": str(store_uuid)} for i in range(2, 5)])
+        datagen.load_data(items=50, stores=5, seed=1)
+        self.assertLookupsCurrent()
+
+        # identifying fields of items & stores, and the warranties themselves
+        db.session.execute("UPDATE items SET item_sku = 'LOOKUP-9' WHERE item_sku = 'LOOKUP-1'")
+        db.session.execute("UPDATE stores SET store_uuid = :new WHERE store_uuid = :old",
+                           {"new": uuid.uuid4(), "old": store_uuid})
+        db.session.execute("UPDATE warranties SET warranty_price = warranty_price + 1 "
+                           "WHERE warranty_id % 2 = 0")
+        db.session.execute("DELETE FROM warranties WHERE warranty_id % 3 = 0")
+        db.session.commit()
+        self.assertLookupsCurrent()
+        self.assertEqual(len(get_warranties(item_sku="LOOKUP-9")), 2)
+        self.assertEqual(get_warranties(item_sku="LOOKUP-1"), [])
+
+    def test_rebuild(self):
+        datagen.load_data(items=50, stores=5, seed=2)
+        count = db.session.execute("SELECT count(*) FROM warranties").scalar()
+        db.session.execute("DELETE FROM warranty_lookups WHERE warranty_id % 2 = 0")
+        db.session.commit()
+
+        self.assertEqual(rebuild_lookups(missing=True), count // 2)
+        self.assertLookupsCurrent()
+        self.assertEqual(rebuild_lookups(missing=True), 0)
+
+        db.session.execute("UPDATE warranty_lookups SET item_sku = 'STALE'")
+        db.session.commit()
+        self.assertEqual(rebuild_lookups(), count)
+        self.assertLookupsCurrent()
+
+    def test_rebuild_concurrent_reads(self):
+        count = db.session.execute("SELECT count(*) FROM warranty_lookups").scalar()
+        engine = db.get_engine(self.app)
+        with engine.connect() as rebuilding, engine.connect() as reading:
+            with rebuilding.begin() as transaction:
+                # nor blocked by the read above, in the test's transaction
+                rebuilding.execute("SET LOCAL lock_timeout = '1s'")
+                for stmt in REBUILD:
+                    rebuilding.execute(stmt)
+                # not blocked, & served the rows from before the rebuild
+                reading.execute("SET lock_timeout = '1s'")
+                self.assertEqual(
+                    reading.execute("SELECT count(*) FROM warranty_lookups").scalar(), count)
+                transaction.rollback()
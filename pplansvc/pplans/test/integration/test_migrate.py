@@ -0,0 +1,176 @@
+import uuid
+
+import sqlalchemy.exc
+
+from pplans.migrate import STEPS, MigrationError, migrate
+from pplans.models import db, Constraint, ItemType
+from pplans.test.fixtures import PplansTestCase
+from pplans.warranty import (
+    get_constraints,
+    get_warranties,
+    invalidate_constraint_index,
+    query_constraints,
+    warranty,
+)
+
+
+STORE_UUID = uuid.UUID("8ad8f7a6-3c5e-4d1b-9a52-0f1ad2e4c6b1")
+
+# the tables as pplans.models first created them, with a warranty quoted twice
+BASELINE = [
+    "DROP TABLE warranty_lookups, warranties, constraints, constraints_version, items, stores",
+    "DROP FUNCTION bump_constraints_version, insert_warranty_lookups, "
+    "update_warranty_lookups, update_item_lookups, update_store_lookups",
+    """
+    CREATE TABLE constraints (
+        constraint_id SERIAL NOT NULL,
+        item_type itemtype,
+        min_cost NUMERIC(6, 2) NOT NULL,
+        max_cost NUMERIC(6, 2) NOT NULL,
+        warranty_price NUMERIC(6, 2) NOT NULL,
+        warranty_duration_months INTEGER NOT NULL,
+        PRIMARY KEY (constraint_id),
+        UNIQUE (item_type, min_cost, max_cost, warranty_price, warranty_duration_months)
+    );
+    CREATE INDEX ix_constraints_min_cost ON constraints (min_cost);
+    CREATE INDEX ix_constraints_max_cost ON constraints (max_cost);
+    CREATE INDEX ix_constraints_warranty_price ON constraints (warranty_price);
+    CREATE TABLE items (
+        item_id SERIAL NOT NULL,
+        item_uuid UUID NOT NULL,
+        item_type itemtype,
+        item_cost NUMERIC(12, 2),
+        item_sku VARCHAR(32) NOT NULL,
+        item_title VARCHAR(64),
+        PRIMARY KEY (item_id),
+        UNIQUE (item_type, item_sku),
+        UNIQUE (item_uuid)
+    );
+    CREATE INDEX ix_items_item_sku ON items (item_sku);
+    CREATE INDEX ix_items_item_cost ON items (item_cost);
+    CREATE TABLE stores (
+        store_id SERIAL NOT NULL,
+        store_uuid UUID NOT NULL,
+        store_name VARCHAR(32) NOT NULL,
+        PRIMARY KEY (store_id),
+        UNIQUE (store_uuid)
+    );
+    CREATE INDEX ix_stores_store_name ON stores (store_name);
+    CREATE TABLE warranties (
+        warranty_id SERIAL NOT NULL,
+        store_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        warranty_price NUMERIC(6, 2) NOT NULL,
+        warranty_duration_months INTEGER NOT NULL,
+        PRIMARY KEY (warranty_id),
+        FOREIGN KEY(store_id) REFERENCES stores (store_id),
+        FOREIGN KEY(item_id) REFERENCES items (item_id)
+    );
+    CREATE INDEX ix_warranties_warranty_price ON warranties (warranty_price)
+    """,
+    """
+    INSERT INTO constraints (item_type, min_cost, max_cost, warranty_price,
+                             warranty_duration_months)
+    VALUES ('furniture', 0.00, 100.00, 5.00, 12), ('furniture', 0.00, 100.00, 10.00, 36),
+           ('furniture', 100.01, 500.00, 15.00, 12);
+    INSERT INTO stores (store_uuid, store_name)
+    VALUES ('{}', 'Baseline Store');
+    INSERT INTO items (item_uuid, item_type, item_cost, item_sku, item_title)
+    VALUES ('{}', 'furniture', 80.00, 'BASE-1', 'Baseline Chair');
+    INSERT INTO warranties (store_id, item_id, warranty_price, warranty_duration_months)
+    VALUES (1, 1, 5.00, 12), (1, 1, 10.00, 36), (1, 1, 5.00, 12)
+    """.format(STORE_UUID, uuid.uuid4()),
+]
+
+
+def create_baseline():
+    for stmt in BASELINE:
+        db.session.execute(stmt)
+    db.session.commit()
+
+
+def indexes():
+    return {name for (name,) in db.session.execute(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'constraints'")}
+
+
+def count(table):
+    return db.session.execute("SELECT count(*) FROM {}".format(table)).scalar()
+
+
+class TestMigrate(PplansTestCase):
+
+    def overlapping_duplicate(self):
+        # offers (5.00, 12) for costs 50-100 twice
+        return Constraint(item_type="furniture", min_cost="50.00", max_cost="150.00",
+                          warranty_price="5.00", warranty_duration_months=12)
+
+    def test_exclusion(self):
+        db.session.add(self.overlapping_duplicate())
+        with self.assertRaises(sqlalchemy.exc.IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+        # adjacent bands do not overlap, as costs match open intervals
+        db.session.add(Constraint(item_type="furniture", min_cost="100.00", max_cost="150.00",
+                                  warranty_price="5.00", warranty_duration_months=12))
+        db.session.commit()
+
+    def test_query_constraints(self):
+        for (item_type, item_cost) in [("furniture", "80.00"), ("furniture", "100.00"),
+                                       ("furniture", "120.00"), ("electronics", "1200.00"),
+                                       ("jewelry", "10.00")]:
+            self.assertEqual(query_constraints(item_type, item_cost),
+                             get_constraints(item_type, item_cost))
+
+    def test_migrate(self):
+        create_baseline()
+        self.assertIn("ix_constraints_min_cost", indexes())
+        applied = migrate()
+        # & the version trigger, the warranties key & the exclusion constraints
+        self.assertEqual(len(applied), len(STEPS) + 2 + len(ItemType))
+        self.assertEqual(indexes() & {"ix_constraints_min_cost", "ix_constraints_max_cost"},
+                         set())
+        self.assertIn("ix_constraints_cost_range", indexes())
+        self.assertEqual(len(query_constraints("furniture", "80.00")), 2)
+
+        # the duplicate quote is gone, & the rest backfilled into lookups
+        self.assertEqual((count("warranties"), count("warranty_lookups")), (2, 2))
+        self.assertEqual(len(get_warranties(store_uuid=str(STORE_UUID))), 2)
+
+        # edits to constraints bump the version
+        db.session.execute("UPDATE constraints_version SET version = 0")
+        db.session.add(Constraint(item_type="furniture", min_cost="500.00", max_cost="900.00",
+                                  warranty_price="25.00", warranty_duration_months=12))
+        db.session.commit()
+        self.assertNotEqual(db.session.execute(
+            "SELECT version FROM constraints_version").scalar(), 0)
+
+        # quotes are upserted on the warranties key
+        invalidate_constraint_index()
+        for i in range(2):
+            warranty("80.00", "BASE-1", "Baseline Chair", "furniture", STORE_UUID)
+        self.assertEqual((count("warranties"), count("warranty_lookups")), (2, 2))
+        warranty("300.00", "BASE-2", "Baseline Sofa", "furniture", STORE_UUID)
+        self.assertEqual((count("warranties"), count("warranty_lookups")), (3, 3))
+
+        # rerunning does not add the trigger, key or exclusion constraints again
+        self.assertEqual(len(migrate()), len(STEPS))
+        self.assertEqual(db.session.execute(
+            "SELECT count(*) FROM pg_trigger WHERE tgname = 'constraints_version_trigger'"
+        ).scalar(), 1)
+        db.session.add(self.overlapping_duplicate())
+        with self.assertRaises(sqlalchemy.exc.IntegrityError):
+            db.session.commit()
+
+    def test_migrate_overlapping(self):
+        create_baseline()
+        constraint_id = db.session.execute(
+            "INSERT INTO constraints (item_type, min_cost, max_cost, warranty_price, "
+            "warranty_duration_months) VALUES ('furniture', 50.00, 150.00, 5.00, 12) "
+            "RETURNING constraint_id").scalar()
+        db.session.commit()
+        with self.assertRaisesRegex(MigrationError,
+                                    r"constraint_id pairs\): 1/{}$".format(constraint_id)):
+            migrate()
+        self.assertIn("ix_constraints_min_cost", indexes())
+        self.assertEqual(count("warranties"), 3)
@@ -3,29 +3,42 @@ End-to-end integration tests include setting up an instance of the db,
 launching an instance of the app listening on a local port, and making
 requests over http to test the response
 """
+import contextlib
 import json
-import os
 import requests
+import sqlalchemy.exc
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-from morus.testing.base import MorusTestCase
+from morus.benchmark import QueryCounter
 from morus.testing.fixtures import background_instance, unused_port
 
-from pplans.flask.app import DEFAULT_DSN, configured_app
-from pplans.warranty import WARRANTY_ERRORS
+from pplans.flask.app import configured_app
+from pplans.models import db, strict_loading, Constraint, Warranty
+from pplans.test.fixtures import PplansTestCase
+from pplans.warranty import (
+    WARRANTY_ERRORS,
+    cache_identities,
+    cached_store_id,
+    configure_constraint_index,
+    configure_warranty_cache,
+    configure_write_behind,
+    constraint_index,
+    flush_write_behind,
+    get_constraints,
+    refresh_constraint_index,
+    warranty,
+)
 
 
-class TestPplansvcIntegration(MorusTestCase):
-
-    def setUp(self):
-        self.dsn = os.environ.get("PPLANSVC_TEST_DSN", DEFAULT_DSN)
-        # testing=True will cause app to recreate db & populate test data
-        self.app = configured_app('pplansvc', self.dsn, testing=True)
-
+class TestPplansvcIntegration(PplansTestCase):
 
     def test_heartbeat(self):
         with unused_port() as port:
-            with background_instance(self.app, port) as base_url:
+            with background_instance(self.app, port, threaded=False) as base_url:
                 r = requests.get(base_url)
                 self.assertEqual(r.status_code, 200)
                 self.assertEqual(r.headers['content-type'], 'application/json')
@@ -34,7 +47,7 @@ class TestPplansvcIntegration(MorusTestCase):
 
     def test_warranties(self):
         with unused_port() as port:
-            with background_instance(self.app, port) as base_url:
+            with background_instance(self.app, port, threaded=False) as base_url:
                 url = base_url + "warranties/"
 
                 # GET with no search criteria returns 500
@@ -64,9 +77,11 @@ class TestPplansvcIntegration(MorusTestCase):
                 self.assertEqual(r.status_code, 200)
                 self.assertEqual(len(r.json()), 0)
 
-                # malformed uuid raises 500
+                # malformed uuid is reported, as other invalid fields are
                 r = requests.post(url, data=data)
-                self.assertEqual(r.status_code, 500)
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(r.json(), {"status": WARRANTY_ERRORS["bad store_uuid"].format(
+                    "b21ad0676f26439")})
 
                 data["store_uuid"] = str(uuid.uuid4())
                 r = requests.post(url, data=data)
@@ -77,10 +92,151 @@ class TestPplansvcIntegration(MorusTestCase):
                 self.assertEqual(r.status_code, 200)
                 self.assertEqual(len(r.json()), 2)
 
+                # repeated quotes do not duplicate warranties
+                r = requests.post(url, data=data)
+                self.assertEqual(r.status_code, 200)
+                r = requests.get('{}?item_sku={}'.format(url, amys_sku))
+                self.assertEqual(len(r.json()), 2)
+
+    def test_warranties_batch(self):
+        with unused_port() as port:
+            with background_instance(self.app, port, threaded=False) as base_url:
+                url = base_url + "warranties/batch"
+                store_uuid = str(uuid.uuid4())
+                records = [
+                    # (furniture, 150.00) is eligible for two warranties
+                    {"item_type": "furniture", "item_cost": "150.00",
+                     "item_sku": "BATCH-1", "item_title": "Batch Sofa",
+                     "store_uuid": store_uuid},
+                    # (electronics, 500.00) is eligible for one
+                    {"item_type": "electronics", "item_cost": "500.00",
+                     "item_sku": "BATCH-2", "item_title": "Batch Synth",
+                     "store_uuid": store_uuid},
+                    # no constraint covers (furniture, 5000.00)
+                    {"item_type": "furniture", "item_cost": "5000.00",
+                     "item_sku": "BATCH-3", "item_title": "Batch Throne",
+                     "store_uuid": store_uuid},
+                    # malformed records are reported, not fatal
+                    {"item_type": "furniture", "item_cost": "150.00",
+                     "item_sku": "BATCH-4", "item_title": "Batch Chair",
+                     "store_uuid": "b21ad0676f26439"},
+                    {"item_type": "furniture"},
+                    # as would not fit their columns
+                    {"item_type": "furniture", "item_cost": "150.00",
+                     "item_sku": "X" * 33, "item_title": "Batch Bench",
+                     "store_uuid": store_uuid},
+                    {"item_type": "furniture", "item_cost": "150.00",
+                     "item_sku": "BATCH-5", "item_title": "X" * 65,
+                     "store_uuid": store_uuid},
+                    {"item_type": "furniture", "item_cost": "9999999999.999",
+                     "item_sku": "BATCH-6", "item_title": "Batch Palace",
+                     "store_uuid": store_uuid},
+                    {"item_type": "furniture", "item_cost": "1e30",
+                     "item_sku": "BATCH-7", "item_title": "Batch Palace",
+                     "store_uuid": store_uuid},
+                    {"item_type": "furniture", "item_cost": "1e-100000000",
+                     "item_sku": "BATCH-8", "item_title": "Batch Speck",
+                     "store_uuid": store_uuid},
+                    # a numeric sku is stored as its str
+                    {"item_type": "furniture", "item_cost": 150,
+                     "item_sku": 12345, "item_title": "Batch Stool",
+                     "store_uuid": store_uuid},
+                ]
+                r = requests.post(url, json=records)
+                self.assertEqual(r.status_code, 200)
+                j = r.json()
+                self.assertEqual(len(j), 11)
+                self.assertEqual(len(j[0]["warranties"]), 2)
+                self.assertEqual(len(j[1]["warranties"]), 1)
+                self.assertEqual(j[2], {"status": WARRANTY_ERRORS["no crit"]})
+                self.assertTrue(j[3]["status"].startswith("Invalid store_uuid"))
+                self.assertTrue(j[4]["status"].startswith("Missing required field"))
+                self.assertTrue(j[5]["status"].startswith("Invalid item_sku"))
+                self.assertTrue(j[6]["status"].startswith("Invalid item_title"))
+                self.assertTrue(j[7]["status"].startswith("Invalid item_cost"))
+                self.assertTrue(j[8]["status"].startswith("Invalid item_cost"))
+                self.assertTrue(j[9]["status"].startswith("Invalid item_cost"))
+                self.assertEqual(len(j[10]["warranties"]), 2)
+
+                r = requests.get(base_url + "warranties/?store_uuid=" + store_uuid)
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(len(r.json()), 5)
+                r = requests.get(base_url + "warranties/?item_sku=12345")
+                self.assertEqual(len(r.json()), 2)
+
+                # body must be a list
+                r = requests.post(url, json={"item_type": "furniture"})
+                self.assertEqual(r.json(), {"status": WARRANTY_ERRORS["batch req"]})
+
+    def test_warranties_pagination(self):
+        with unused_port() as port:
+            with background_instance(self.app, port, threaded=False) as base_url:
+                url = base_url + "warranties/?item_type=furniture"
+                everything = requests.get(url).json()
+                self.assertEqual(len(everything), 5)
+
+                # keyset pagination returns the same rows, in pages
+                pages = []
+                r = requests.get(url + "&limit=2").json()
+                pages.append(r["warranties"])
+                while r["next"]:
+                    r = requests.get(url + "&limit=2&next=" + r["next"]).json()
+                    pages.append(r["warranties"])
+                self.assertEqual([len(p) for p in pages], [2, 2, 1])
+                self.assertEqual(sum(pages, []), everything)
+
+                # streamed response returns the same rows
+                r = requests.get(url + "&stream=1", stream=True)
+                self.assertEqual(r.headers['content-type'], 'application/json')
+                self.assertEqual(r.json(), everything)
+
+                r = requests.get(url + "&limit=0")
+                self.assertEqual(r.json(), {"status": "Invalid limit: 0"})
+                r = requests.get(url + "&next=garbage")
+                self.assertEqual(r.json(), {"status": "Invalid next cursor: garbage"})
+                r = requests.get(base_url + "warranties/?stream=1")
+                self.assertEqual(r.json(), {"status": WARRANTY_ERRORS["filter req"]})
+
+    def test_warranties_strict_loading(self):
+        # lookups must not lazy load relationships per row
+        with strict_loading():
+            with self.assertRaises(sqlalchemy.exc.InvalidRequestError):
+                Warranty.query.first().item
+            with unused_port() as port:
+                with background_instance(self.app, port, threaded=False) as base_url:
+                    url = base_url + "warranties/?item_type=furniture"
+                    self.assertEqual(len(requests.get(url).json()), 5)
+                    self.assertEqual(len(requests.get(url + "&limit=2").json()["warranties"]), 2)
+                    self.assertEqual(len(requests.get(url + "&stream=1").json()), 5)
+        # & only within the context
+        self.assertTrue(Warranty.query.first().item)
+
+    def test_warranties_cache(self):
+        configure_warranty_cache(maxsize=100, ttl=60)
+        self.addCleanup(configure_warranty_cache, maxsize=0)
+        with unused_port() as port:
+            with background_instance(self.app, port, threaded=False) as base_url:
+                url = base_url + "warranties/"
+                store_uuid = str(uuid.uuid4())
+                furniture = requests.get(url + "?item_type=furniture").json()
+                electronics = requests.get(url + "?item_type=electronics").json()
+                self.assertEqual(requests.get(url + "?item_type=furniture").json(), furniture)
+                stats = requests.get(base_url + "admin/cache").json()
+                self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 2, 2))
+
+                # POSTing a furniture item invalidates furniture lookups only
+                data = {"item_type": "furniture", "item_cost": "150.00", "item_sku": "CACHE-1",
+                        "item_title": "Cached Sofa", "store_uuid": store_uuid}
+                self.assertEqual(requests.post(url, data=data).status_code, 200)
+                self.assertEqual(len(requests.get(url + "?item_type=furniture").json()),
+                                 len(furniture) + 2)
+                self.assertEqual(requests.get(url + "?item_type=electronics").json(), electronics)
+                stats = requests.get(base_url + "admin/cache").json()
+                self.assertEqual((stats["hits"], stats["invalidations"]), (2, 1))
 
     def test_constraints(self):
         with unused_port() as port:
-            with background_instance(self.app, port) as base_url:
+            with background_instance(self.app, port, threaded=False) as base_url:
                 url = base_url + "warranties/constraints"
                 r = requests.get(url)
                 self.assertEqual(r.status_code, 200)
@@ -99,3 +255,254 @@ class TestPplansvcIntegration(MorusTestCase):
                 self.assertEqual(r.headers['content-type'], 'application/json')
                 self.assertEqual(len(r.json()), 2)
 
+
+    def test_constraints_etag(self):
+        with unused_port() as port:
+            with background_instance(self.app, port, threaded=False) as base_url:
+                url = base_url + "warranties/constraints?item_type=furniture"
+                r = requests.get(url)
+                tag = r.headers["ETag"]
+                r = requests.get(url, headers={"If-None-Match": tag})
+                self.assertEqual(r.status_code, 304)
+
+                # lookups are tagged with a hash of their content
+                url = base_url + "warranties/?item_type=furniture"
+                r = requests.get(url)
+                r = requests.get(url, headers={"If-None-Match": r.headers["ETag"]})
+                self.assertEqual(r.status_code, 304)
+
+                # editing constraints changes the tag
+                configure_constraint_index(poll_seconds=0)
+                self.addCleanup(configure_constraint_index, poll_seconds=1.0)
+                db.session.execute("UPDATE constraints SET warranty_price = 6.00 "
+                                   "WHERE warranty_price = 5.00")
+                db.session.commit()
+                url = base_url + "warranties/constraints?item_type=furniture"
+                r = requests.get(url, headers={"If-None-Match": tag})
+                self.assertEqual(r.status_code, 200)
+                self.assertNotEqual(r.headers["ETag"], tag)
+
+    def test_constraints_invalidation(self):
+        # check constraints_version on every use of the index
+        configure_constraint_index(poll_seconds=0)
+        self.addCleanup(configure_constraint_index, poll_seconds=1.0)
+        with unused_port() as port:
+            with background_instance(self.app, port, threaded=False) as base_url:
+                url = base_url + "warranties/constraints?item_type=electronics&item_cost=500.00"
+                r = requests.get(url)
+                self.assertEqual(len(r.json()), 1)
+
+                # edit constraints outside of this process' session
+                db.session.execute("UPDATE constraints SET max_cost = 400.00 "
+                                   "WHERE item_type = 'electronics' AND max_cost = 999.99")
+                db.session.commit()
+                r = requests.get(url)
+                self.assertEqual(len(r.json()), 0)
+
+
+class TestPplansvcCommitted(PplansTestCase):
+    """tests serving requests concurrently, so over several connections"""
+
+    transactional = False
+
+    def test_warranties_concurrent(self):
+        with unused_port() as port:
+            with background_instance(self.app, port) as base_url:
+                url = base_url + "warranties/"
+                data = {
+                    "item_type": "furniture",
+                    "item_cost": "150.00",
+                    "item_sku": "RACE-1",
+                    "item_title": "Contended Sofa",
+                    "store_uuid": str(uuid.uuid4()),
+                }
+                # concurrent POSTs for the same new item & store all succeed
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    responses = list(pool.map(lambda i: requests.post(url, data=data), range(16)))
+                self.assertEqual([r.status_code for r in responses], [200] * 16)
+
+                r = requests.get(url + "?item_sku=RACE-1")
+                self.assertEqual(len(r.json()), 2)
+
+    def test_identity_caches(self):
+        # committed, so no SAVEPOINT statements are counted
+        configure_constraint_index(poll_seconds=60)
+        self.addCleanup(configure_constraint_index, poll_seconds=1.0)
+        get_constraints("furniture", "150.00")
+        counter = QueryCounter()
+        self.addCleanup(counter.remove)
+        store_uuid = uuid.uuid4()
+        args = ("150.00", "IDENT-1", "Identified Sofa", "furniture", store_uuid)
+
+        # ids of rows written by a transaction rolled back are not cached
+        with mock.patch("pplans.warranty._insert_warranties", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                warranty(*args)
+        self.assertIsNone(cached_store_id(store_uuid))
+
+        with counter:
+            warranty(*args)
+        # upsert item, insert store & warranties
+        self.assertEqual(counter.count, 3)
+        self.assertIsNotNone(cached_store_id(store_uuid))
+
+        # unchanged item & known store are not looked up
+        counter.count = 0
+        with counter:
+            warranty(*args)
+        self.assertEqual(counter.count, 2)
+
+        # an entry for a row which does not exist is dropped on failure
+        other_uuid = uuid.uuid4()
+        cache_identities({}, {other_uuid: 2 ** 31 - 1})
+        with self.assertRaises(sqlalchemy.exc.IntegrityError):
+            warranty("150.00", "IDENT-1", "Identified Sofa", "furniture", other_uuid)
+        self.assertIsNone(cached_store_id(other_uuid))
+        warranty("150.00", "IDENT-1", "Identified Sofa", "furniture", other_uuid)
+
+        with unused_port() as port:
+            with background_instance(self.app, port) as base_url:
+                stats = requests.get(base_url + "admin/identities").json()
+                self.assertTrue(stats["enabled"])
+                self.assertGreater(stats["stores"]["hit_rate"], 0)
+                self.assertGreater(stats["items"]["hit_rate"], 0)
+
+    def test_quote_snapshot(self):
+        configure_constraint_index(poll_seconds=60, background=True,
+                                   context=self.app.app_context)
+        self.addCleanup(configure_constraint_index, poll_seconds=1.0)
+        refresh_constraint_index()
+        client = self.app.test_client()
+        counter = QueryCounter()
+        self.addCleanup(counter.remove)
+        with counter:
+            r = client.get("/warranties/quote?item_type=furniture&item_cost=80.00")
+            self.assertEqual(sorted(o["warranty_price"] for o in r.get_json()),
+                             ["10.00", "5.00", "50.00"])
+            r = client.get("/warranties/quote?item_type=furniture&item_cost=1000.00")
+            self.assertEqual(r.get_json(), [])
+            for (query, status) in [
+                    ("item_type=furniture", WARRANTY_ERRORS["missing field"].format("item_cost")),
+                    ("item_type=boat&item_cost=1", WARRANTY_ERRORS["bad item_type"].format("boat")),
+                    ("item_type=furniture&item_cost=x",
+                     WARRANTY_ERRORS["bad item_cost"].format("x"))]:
+                r = client.get("/warranties/quote?" + query)
+                self.assertEqual(r.get_json(), {"status": status})
+        self.assertEqual(counter.count, 0)
+
+        # edits are picked up by the refresher thread
+        configure_constraint_index(poll_seconds=0.01, background=True,
+                                   context=self.app.app_context)
+        version = constraint_index().version
+        db.session.add(Constraint(item_type="furniture", min_cost="500.00", max_cost="2000.00",
+                                  warranty_price="99.00", warranty_duration_months=60))
+        db.session.commit()
+        deadline = time.monotonic() + 10
+        while constraint_index().version == version and time.monotonic() < deadline:
+            time.sleep(0.01)
+        r = client.get("/warranties/quote?item_type=furniture&item_cost=1000.00")
+        self.assertEqual(r.get_json(), [{"warranty_price": "99.00",
+                                         "warranty_duration_months": 60}])
+        stats = client.get("/admin/constraints").get_json()
+        self.assertEqual((stats["background"], stats["refresh_errors"]), (True, 0))
+        self.assertEqual(stats["version"], constraint_index().version)
+
+    def test_write_behind(self):
+
+        class config:
+            WRITE_BEHIND = True
+            WRITE_BEHIND_MAX_DELAY = 0.5
+            ADMIN_ENABLED = True
+
+        app = configured_app('pplansvc', self.dsn, config_module=config)
+        self.addCleanup(configure_write_behind)
+        store_uuid = str(uuid.uuid4())
+        with unused_port() as port:
+            with background_instance(app, port) as base_url:
+                url = base_url + "warranties/"
+
+                def post(i):
+                    return requests.post(url, data={
+                        "item_type": "furniture", "item_cost": "150.00",
+                        "item_sku": "BEHIND-{}".format(i), "item_title": "Deferred Sofa",
+                        "store_uuid": store_uuid})
+
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    responses = list(executor.map(post, range(8)))
+                # quoted before being written, so without ids
+                self.assertEqual([r.status_code for r in responses], [200] * 8)
+                self.assertEqual(sorted(responses[0].json()[0]),
+                                 ["warranty_duration_months", "warranty_price"])
+
+                self.assertTrue(flush_write_behind(timeout=10))
+                self.assertEqual(len(requests.get(url + "?store_uuid=" + store_uuid).json()),
+                                 16)
+                stats = requests.get(base_url + "admin/write-behind").json()
+                self.assertEqual((stats["written"], stats["failed"], stats["queued"]), (8, 0, 0))
+                # coalesced into fewer transactions
+                self.assertLess(stats["batches"], 8)
+
+                r = requests.post(url, data={"item_type": "furniture", "item_cost": "150.00"})
+                self.assertEqual(r.json(), {"status": WARRANTY_ERRORS["missing field"].format(
+                    "item_sku")})
+                # nor is a record which could not be written
+                r = requests.post(url, data={
+                    "item_type": "furniture", "item_cost": "150.00", "item_sku": "X" * 33,
+                    "item_title": "Oversized Sofa", "store_uuid": store_uuid})
+                self.assertTrue(r.json()["status"].startswith("Invalid item_sku"))
+                self.assertTrue(flush_write_behind(timeout=10))
+                stats = requests.get(base_url + "admin/write-behind").json()
+                self.assertEqual((stats["put"], stats["failed"]), (8, 0))
+
+    def test_write_behind_backpressure(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        @contextlib.contextmanager
+        def stalled():
+            release.wait(10)
+            with self.app.app_context():
+                yield
+
+        configure_write_behind(enabled=True, context=stalled, max_batch=1, max_delay=0,
+                               maxsize=1, put_timeout=0.5)
+        self.addCleanup(configure_write_behind)
+        client = self.app.test_client()
+        data = {"item_type": "furniture", "item_cost": "150.00", "item_sku": "FULL-1",
+                "item_title": "Queued Sofa", "store_uuid": str(uuid.uuid4())}
+        responses = [client.post("/warranties/", data=data) for i in range(3)]
+        # one being written, one queued, then the queue is full
+        self.assertEqual([r.status_code for r in responses], [200, 200, 503])
+        self.assertEqual(responses[2].headers["Retry-After"], "1")
+        release.set()
+        self.assertTrue(flush_write_behind(timeout=10))
+        stats = client.get("/admin/write-behind").get_json()
+        self.assertEqual((stats["written"], stats["rejected"]), (2, 1))
+        self.assertEqual(len(client.get("/warranties/?item_sku=FULL-1").get_json()), 2)
+
+    def test_pool_stats(self):
+        app = configured_app('pplansvc', self.dsn, pool_size=2, max_overflow=1,
+                             admin=True)
+        with unused_port() as port:
+            with background_instance(app, port) as base_url:
+                url = base_url + "warranties/?item_type=furniture"
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    responses = list(executor.map(requests.get, [url] * 8))
+                self.assertTrue(all(r.status_code == 200 for r in responses))
+                stats = requests.get(base_url + "admin/pool").json()
+                self.assertEqual((stats["size"], stats["max_overflow"]), (2, 1))
+                self.assertGreaterEqual(stats["checkouts"], 8)
+                self.assertLessEqual(stats["max_overflow_seen"], 1)
+                self.assertEqual(stats["timeouts"], 0)
+
+    def test_metrics(self):
+        app = configured_app('pplansvc', self.dsn, metrics=True)
+        with unused_port() as port:
+            with background_instance(app, port) as base_url:
+                r = requests.get(base_url + "warranties/?item_type=furniture")
+                self.assertTrue("db;dur=" in r.headers["Server-Timing"])
+                text = requests.get(base_url + "metrics").text
+                labels = '{endpoint="/warranties/",method="GET",status="200"}'
+                self.assertTrue("http_request_duration_seconds_count{} 1\n".format(labels)
+                                in text)
+                self.assertTrue("db_queries_total{}".format(labels) in text)
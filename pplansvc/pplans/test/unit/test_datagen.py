@@ -0,0 +1,57 @@
+import decimal
+
+from morus.testing.base import MorusTestCase
+
+from pplans import datagen
+from pplans.pricing import ConstraintIndex
+
+
+def constraint_index():
+    names = ("item_type", "min_cost", "max_cost", "warranty_price",
+             "warranty_duration_months")
+    return ConstraintIndex([dict(zip(names, row), constraint_id=i)
+                            for (i, row) in enumerate(datagen.generate_constraints())])
+
+
+class TestDatagen(MorusTestCase):
+
+    def test_row_stream(self):
+        stream = datagen.RowStream(iter([(1, "a b", None), (2, "c", 3.5)]))
+        self.assertEqual(stream.read(4), "1\ta ")
+        self.assertEqual(stream.rows, 1)
+        self.assertEqual(stream.read(), "b\t\\N\n2\tc\t3.5\n")
+        self.assertEqual(stream.rows, 2)
+        self.assertEqual(stream.read(10), "")
+
+    def test_generated_constraints_cover_all_costs(self):
+        rows = list(datagen.generate_constraints())
+        self.assertEqual(len(rows), len(set(rows)))
+        index = constraint_index()
+        for item_type in datagen.ITEM_TYPE_WEIGHTS:
+            for cost in ("0.01", "99.99", "100.00", "100.01", "4999.99", "9999.98"):
+                matches = index.match(item_type, cost)
+                self.assertEqual(len(matches), datagen.WARRANTIES_PER_QUOTE,
+                                 (item_type, cost))
+
+    def test_items_deterministic(self):
+        items = list(datagen.generate_items(100, first_id=7, seed=1))
+        self.assertEqual(items, list(datagen.generate_items(100, first_id=7, seed=1)))
+        self.assertNotEqual(items, list(datagen.generate_items(100, first_id=7, seed=2)))
+        self.assertEqual([item[0] for item in items], list(range(7, 107)))
+        for (item_id, item_uuid, item_type, item_sku, item_cost, item_title) in items:
+            self.assertIn(item_type, datagen.ITEM_TYPE_WEIGHTS)
+            self.assertTrue(0 < decimal.Decimal(item_cost) <= decimal.Decimal("9999.98"))
+            self.assertLessEqual(len(item_sku), 32)
+            self.assertLessEqual(len(item_title), 64)
+
+    def test_quotes_skewed(self):
+        index = constraint_index()
+        warranties = list(datagen.generate_warranties(
+            datagen.generate_items(1000), 1000, 50, index, quotes_per_item=3.0))
+        stores = {}
+        for (store_id, item_id, price, months) in warranties:
+            stores.setdefault(item_id, set()).add(store_id)
+        # the most popular item is carried by every store, most by just one
+        self.assertEqual(len(stores[1]), 50)
+        self.assertGreater(sum(1 for s in stores.values() if len(s) == 1), 500)
+        self.assertEqual(len(warranties), len(set(warranties)))
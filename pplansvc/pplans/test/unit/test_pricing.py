@@ -0,0 +1,114 @@
+"""
+Unit tests for in-memory pricing structures; no db required
+"""
+import random
+import unittest
+
+from morus.testing.base import MorusTestCase
+
+from pplans.pricing import ConstraintIndex, IntervalIndex, to_cost
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+CONSTRAINTS = [
+    {"constraint_id": 1, "item_type": "furniture", "min_cost": "0.00",
+     "max_cost": "100.00", "warranty_price": "5.00", "warranty_duration_months": 12},
+    {"constraint_id": 2, "item_type": "furniture", "min_cost": "0.00",
+     "max_cost": "100.00", "warranty_price": "10.00", "warranty_duration_months": 36},
+    {"constraint_id": 4, "item_type": "furniture", "min_cost": "100.01",
+     "max_cost": "500.00", "warranty_price": "15.00", "warranty_duration_months": 12},
+    {"constraint_id": 3, "item_type": "furniture", "min_cost": "50.00",
+     "max_cost": "200.00", "warranty_price": "7.50", "warranty_duration_months": 6},
+    {"constraint_id": 5, "item_type": "electronics", "min_cost": "0.00",
+     "max_cost": "999.99", "warranty_price": "100.00", "warranty_duration_months": 36},
+]
+
+
+def naive_match(item_type, item_cost):
+    """the semantics of the original SQL filter"""
+    cost = to_cost(item_cost)
+    return sorted([c["constraint_id"] for c in CONSTRAINTS
+                   if c["item_type"] == item_type
+                   and to_cost(c["min_cost"]) < cost < to_cost(c["max_cost"])])
+
+
+class PricingTestCase(MorusTestCase):
+
+    def setUp(self):
+        self.index = ConstraintIndex(CONSTRAINTS, version=42)
+
+    def test_interval_index(self):
+        index = IntervalIndex([(to_cost(1), to_cost(3), "a"), (to_cost(2), to_cost(4), "b")])
+        self.assertEqual(index.match(to_cost(0)), ())
+        self.assertEqual(index.match(to_cost(1)), ())
+        self.assertEqual(index.match(to_cost("1.5")), ("a",))
+        self.assertEqual(index.match(to_cost(2)), ("a",))
+        self.assertEqual(index.match(to_cost("2.5")), ("a", "b"))
+        self.assertEqual(index.match(to_cost(3)), ("b",))
+        self.assertEqual(index.match(to_cost(4)), ())
+        self.assertEqual(IntervalIndex([]).match(to_cost(1)), ())
+
+    def test_interval_index_random(self):
+        # overlapping, repeated & empty intervals, in no particular order
+        rng = random.Random(0)
+        rows = []
+        for i in range(200):
+            lo = rng.randint(0, 50)
+            rows.append((to_cost(lo), to_cost(lo + rng.randint(-2, 10)), i))
+        index = IntervalIndex(rows)
+        for cost in range(-1, 63):
+            for cost in (to_cost(cost), to_cost(cost) + to_cost("0.5")):
+                self.assertEqual(index.match(cost),
+                                 tuple(v for (lo, hi, v) in rows if lo < cost < hi), cost)
+
+    def test_match_is_strict(self):
+        # every bound, and values either side of it, match as SQL would
+        costs = ["-1", "0", "0.001", "49.99", "50", "75", "99.99", "100", "100.005",
+                 "100.01", "100.02", "199.99", "200", "499.99", "500", "500.01"]
+        for item_type in ("furniture", "electronics"):
+            for cost in costs:
+                ids = [c["constraint_id"] for c in self.index.match(item_type, cost)]
+                self.assertEqual(ids, naive_match(item_type, cost), (item_type, cost))
+
+    def test_match_filters(self):
+        self.assertEqual(len(self.index.match()), 5)
+        self.assertEqual([c["constraint_id"] for c in self.index.match("furniture")],
+                         [1, 2, 3, 4])
+        self.assertEqual([c["constraint_id"] for c in self.index.match(item_cost="75.00")],
+                         [1, 2, 3, 5])
+        self.assertEqual(self.index.match("jewelry", "75.00"), [])
+        with self.assertRaises(ValueError):
+            self.index.match("furniture", "seventy")
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_constraint_arrays(self):
+        arrays = self.index.arrays()
+        rng = random.Random(0)
+        item_types = [rng.choice(["furniture", "electronics", "jewelry"]) for i in range(500)]
+        costs = ["{:.2f}".format(rng.choice([0, 50, 100, 100.01, 200, 500, 999.99])
+                                 + rng.choice([-0.01, 0, 0.01, 0.005]))
+                 for i in range(500)]
+        result = arrays.price(item_types, costs)
+        self.assertEqual(len(result.indptr), 501)
+        for (i, (item_type, cost)) in enumerate(zip(item_types, costs)):
+            (start, end) = (result.indptr[i], result.indptr[i + 1])
+            expect = self.index.match(item_type, cost)
+            self.assertEqual(list(result.constraint_id[start:end]),
+                             [c["constraint_id"] for c in expect], (item_type, cost))
+            self.assertEqual(list(result.warranty_price[start:end]),
+                             [float(c["warranty_price"]) for c in expect])
+            self.assertEqual(list(result.warranty_duration_months[start:end]),
+                             [c["warranty_duration_months"] for c in expect])
+
+        (matrix, ids) = arrays.eligibility("furniture", ["75.00", "100.00", "150.00"])
+        self.assertEqual(list(ids), [1, 2, 3, 4])
+        self.assertEqual(matrix.tolist(), [[True, True, True, False],
+                                           [False, False, True, False],
+                                           [False, False, True, True]])
+
+        result = arrays.price("furniture", [])
+        self.assertEqual(list(result.indptr), [0])
@@ -0,0 +1,25 @@
+from sqlalchemy.dialects import postgresql
+
+from morus.testing.base import MorusTestCase
+
+from pplans.statements import UPSERT_ITEM, lookup_statement
+
+
+class TestStatements(MorusTestCase):
+
+    def test_lookup_statement_reused(self):
+        stmt = lookup_statement({"item_type": "furniture", "store_uuid": "x"})
+        self.assertIs(lookup_statement(["store_uuid", "item_type"]), stmt)
+        self.assertIsNot(lookup_statement(["item_type"]), stmt)
+        self.assertIsNot(lookup_statement(["item_type", "store_uuid"], paged=True), stmt)
+
+    def test_lookup_statement_parameters(self):
+        stmt = lookup_statement(["item_sku"], after=True, paged=True)
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        self.assertEqual(sorted(compiled.params), ["after", "item_sku", "limit"])
+        self.assertTrue(all(value is None for value in compiled.params.values()))
+
+    def test_upsert_item_parameters(self):
+        compiled = UPSERT_ITEM.compile(dialect=postgresql.dialect())
+        self.assertEqual(sorted(compiled.params),
+                         ["item_cost", "item_sku", "item_title", "item_type", "item_uuid"])
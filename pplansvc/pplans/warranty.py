@@ -6,12 +6,47 @@ with the database.
 
 Functions here should be entirely agnostic to and ignorant of any app context.
 """
+import base64
+import binascii
 import collections
+import contextlib
+import functools
+import json
 import logging
+import os
 import random
+import threading
+import time
+import uuid
 
+from morus.cache import LRUCache
 from morus.logging import getLogger
-from pplans.models import db, Item, Store, Warranty, Constraint
+from morus.writebehind import EXIT_TIMEOUT, BatchWriter
+from pplans.models import (
+    db,
+    Constraint,
+    Item,
+    ItemType,
+    Store,
+    Warranty,
+)
+from pplans.pricing import ConstraintIndex, to_cost
+from pplans.statements import (
+    INSERT_STORE,
+    INSERT_WARRANTY,
+    MATCH_CONSTRAINTS,
+    SELECT_CONSTRAINTS,
+    SELECT_CONSTRAINTS_VERSION,
+    SELECT_ITEM,
+    SELECT_STORE,
+    UPSERT_ITEM,
+    WARRANTY_COLUMNS,
+    insert_stores_statement,
+    lookup_statement,
+    select_items_statement,
+    select_stores_statement,
+    upsert_items_statement,
+)
 
 
 log = getLogger(__name__)
@@ -19,8 +54,79 @@ log = getLogger(__name__)
 WARRANTY_ERRORS = {
     "no crit": "No suitable criteria",
     "filter req": "Filter criteria is required",
+    "batch req": "Batch must be a list of records",
+    "missing field": "Missing required field: {}",
+    "bad item_cost": "Invalid item_cost: {}",
+    "bad item_sku": "Invalid item_sku: {}",
+    "bad item_title": "Invalid item_title: {}",
+    "bad item_type": "Invalid item_type: {}",
+    "bad item_uuid": "Invalid item_uuid: {}",
+    "bad store_uuid": "Invalid store_uuid: {}",
+    "bad limit": "Invalid limit: {}",
+    "bad cursor": "Invalid next cursor: {}",
+    "busy": "Too many warranties waiting to be written, retry later",
 }
 
+WARRANTY_FIELDS = ("item_cost", "item_sku", "item_title", "item_type", "store_uuid")
+
+# limits of the Item columns records are written to, checked up front so
+# that one bad record fails alone rather than its whole transaction
+ITEM_SKU_LENGTH = Item.__table__.c.item_sku.type.length
+ITEM_TITLE_LENGTH = Item.__table__.c.item_title.type.length
+ITEM_COST_PRECISION = Item.__table__.c.item_cost.type.precision
+ITEM_COST_SCALE = Item.__table__.c.item_cost.type.scale
+ITEM_COST_LIMIT = 10 ** (ITEM_COST_PRECISION - ITEM_COST_SCALE)
+# digits after the point postgres accepts in a numeric value, before rounding
+NUMERIC_MAX_SCALE = 16383
+
+# rows per multi-VALUES INSERT statement issued by warranty_batch()
+BATCH_CHUNK_SIZE = 1000
+
+# get_warranties_page() page size
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# rows fetched per round trip by iter_warranties()
+STREAM_BATCH_SIZE = 1000
+
+# constraints are matched against an in-process ConstraintIndex; every
+# CONSTRAINT_INDEX_POLL_SECONDS the constraints_version row is checked & the
+# index rebuilt if constraints were modified (by any process)
+CONSTRAINT_INDEX_POLL_SECONDS = 1.0
+
+_constraint_index = None
+_constraint_index_checked = 0.0
+_constraint_index_lock = threading.Lock()
+
+# when refreshed in the background, the context each check runs in & the
+# thread doing so in this process; see configure_constraint_index()
+_constraint_refresh_context = None
+_constraint_refresher = None
+_constraint_refresh_errors = 0
+
+# optional read-through cache of get_warranties() results, keyed on
+# normalized filters; see configure_warranty_cache()
+_warranty_cache = None
+
+# optional write-behind queue of quotes, see configure_write_behind()
+_quote_writer = None
+
+# returned by _upsert_items()
+ItemRef = collections.namedtuple("ItemRef", ["item_id", "item_uuid"])
+
+# store_uuid -> store_id & (item_type, item_sku) -> ItemRef, of rows known to
+# be committed, so that writes need not look them up; see
+# configure_identity_caches()
+IDENTITY_CACHE_SIZE = 10000
+
+_store_ids = LRUCache(maxsize=IDENTITY_CACHE_SIZE)
+_item_refs = LRUCache(maxsize=IDENTITY_CACHE_SIZE)
+
+# compiled forms of the pplans.statements executed via _execute(); these are
+# built once per shape, so the cache is bounded by the number of shapes
+_compiled_cache = {}
+
+
 class WarrantyRuntimeError(RuntimeError):
     pass
 
@@ -32,107 +138,748 @@ def create_store_name():
     return " ".join([random.choice(W1), random.choice(W2)])
 
 
-def warranty(item_cost, item_sku, item_title, item_type, store_uuid):
-    log.debug("warranty args: {}".format(locals()))
+def _text_field(record, field, max_length):
+    """record[field] as str, eg a sku sent as a JSON number"""
+    value = record[field]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str) or len(value) > max_length:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad " + field].format(value))
+    return value
+
+
+def validate_record(record):
+    """normalize a single batch record (or the args of warranty()), raising
+    WarrantyRuntimeError if invalid"""
+    for field in WARRANTY_FIELDS:
+        if not record.get(field):
+            raise WarrantyRuntimeError(WARRANTY_ERRORS["missing field"].format(field))
+    try:
+        item_cost = to_cost(record["item_cost"])
+    except ValueError:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad item_cost"].format(record["item_cost"]))
+    # as rounded when stored; exponents too large to round (or for postgres
+    # to parse) are rejected first
+    if (item_cost.adjusted() >= ITEM_COST_PRECISION - ITEM_COST_SCALE
+            or item_cost.as_tuple().exponent < -NUMERIC_MAX_SCALE
+            or abs(round(item_cost, ITEM_COST_SCALE)) >= ITEM_COST_LIMIT):
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad item_cost"].format(record["item_cost"]))
+    item_sku = _text_field(record, "item_sku", ITEM_SKU_LENGTH)
+    item_title = _text_field(record, "item_title", ITEM_TITLE_LENGTH)
+    item_type = record["item_type"]
+    if not isinstance(item_type, str) or item_type not in ItemType.__members__:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad item_type"].format(item_type))
+    try:
+        store_uuid = uuid.UUID(str(record["store_uuid"]))
+    except ValueError:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad store_uuid"].format(record["store_uuid"]))
+    return {
+        "item_cost": item_cost,
+        "item_sku": item_sku,
+        "item_title": item_title,
+        "item_type": item_type,
+        "store_uuid": store_uuid,
+    }
+
+
+def _chunks(rows, size=BATCH_CHUNK_SIZE):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _execute(stmt, *multiparams, **options):
+    """execute one of the reusable pplans.statements in the session's
+    transaction, compiling it only on first use (per engine)"""
+    conn = db.session.connection().execution_options(compiled_cache=_compiled_cache,
+                                                     **options)
+    return conn.execute(stmt, *multiparams)
+
+
+def _upsert_items(items):
+    """upsert items, dict of (item_type, item_sku) -> (item_cost, item_title)
+
+    rows are only rewritten when item_cost or item_title actually changed;
+    unchanged rows are not returned by the upsert, and are taken from the
+    identity cache or selected instead
+
+    returns dict of (item_type, item_sku) -> ItemRef"""
+    ret = {}
+    # consistent lock order between concurrent transactions avoids deadlocks
+    rows = [
+        {"item_uuid": uuid.uuid4(), "item_type": item_type, "item_sku": item_sku,
+         "item_cost": item_cost, "item_title": item_title}
+        for ((item_type, item_sku), (item_cost, item_title)) in sorted(items.items())
+    ]
+    for chunk in _chunks(rows):
+        # a single item, as from warranty(), reuses the compiled statement
+        if len(chunk) == 1:
+            rs = _execute(UPSERT_ITEM, chunk[0])
+        else:
+            rs = db.session.execute(upsert_items_statement(chunk))
+        for (item_id, item_uuid, item_type, item_sku) in rs:
+            ret[(item_type.value, item_sku)] = ItemRef(item_id, item_uuid)
+
+    missing = []
+    for key in sorted(items):
+        if key not in ret:
+            item_ref = cached_item_ref(key)
+            if item_ref is None:
+                missing.append(key)
+            else:
+                ret[key] = item_ref
+    for chunk in _chunks(missing):
+        if len(chunk) == 1:
+            rs = _execute(SELECT_ITEM, {"item_type": chunk[0][0], "item_sku": chunk[0][1]})
+        else:
+            rs = db.session.execute(select_items_statement(chunk))
+        for (item_id, item_uuid, item_type, item_sku) in rs:
+            ret[(item_type.value, item_sku)] = ItemRef(item_id, item_uuid)
+    return ret
+
+
+def _upsert_stores(store_uuids):
+    """insert any stores not yet known, list of uuid.UUID
+
+    stores in the identity cache exist, so are neither inserted nor selected
+
+    returns dict of store_uuid -> store_id"""
+    ret = {}
+    for store_uuid in store_uuids:
+        store_id = cached_store_id(store_uuid)
+        if store_id is not None:
+            ret[store_uuid] = store_id
+    rows = [{"store_uuid": store_uuid, "store_name": create_store_name()}
+            for store_uuid in sorted(store_uuids, key=str) if store_uuid not in ret]
+    for chunk in _chunks(rows):
+        if len(chunk) == 1:
+            rs = _execute(INSERT_STORE, chunk[0])
+        else:
+            rs = db.session.execute(insert_stores_statement(chunk))
+        ret.update({store_uuid: store_id for (store_id, store_uuid) in rs})
+    # DO NOTHING does not return pre-existing rows
+    missing = [store_uuid for store_uuid in store_uuids if store_uuid not in ret]
+    for chunk in _chunks(missing):
+        if len(chunk) == 1:
+            rs = _execute(SELECT_STORE, {"store_uuid": chunk[0]})
+        else:
+            rs = db.session.execute(select_stores_statement(chunk))
+        ret.update({store_uuid: store_id for (store_id, store_uuid) in rs})
+    return ret
+
 
-    # check for available warranties for (item_type, item_cost) combo
-    constraints = get_constraints(item_type, item_cost)
-    log.debug("found constraints: {}".format(constraints))
+def cached_item_ref(key):
+    """ItemRef of (item_type, item_sku) if in the identity cache, else None"""
+    return _item_refs.get(key) if _item_refs is not None else None
+
+
+def cached_store_id(store_uuid):
+    """store_id of store_uuid if in the identity cache, else None"""
+    return _store_ids.get(store_uuid) if _store_ids is not None else None
+
+
+def cache_identities(item_refs, store_ids):
+    """add rows just committed to the identity caches; those of a
+    transaction which was rolled back are never added, as they may not
+    exist"""
+    if _item_refs is not None:
+        for (key, item_ref) in item_refs.items():
+            _item_refs.set(key, item_ref)
+    if _store_ids is not None:
+        for (store_uuid, store_id) in store_ids.items():
+            _store_ids.set(store_uuid, store_id)
+
+
+def forget_identities(item_keys, store_uuids):
+    """drop identity cache entries a failed transaction may have used, in
+    case they refer to rows since deleted"""
+    if _item_refs is not None:
+        for key in item_keys:
+            _item_refs.pop(key)
+    if _store_ids is not None:
+        for store_uuid in store_uuids:
+            _store_ids.pop(store_uuid)
+
+
+def configure_identity_caches(maxsize=IDENTITY_CACHE_SIZE):
+    """cache the ids of up to maxsize stores & items each, least recently
+    used are evicted; maxsize=0 disables the caches
+
+    entries are only added once their rows are committed, and never go
+    stale as stores & items are not deleted; clear_identity_caches() after
+    removing rows by other means (eg recreating the db)"""
+    global _store_ids, _item_refs
+    _store_ids = LRUCache(maxsize=maxsize) if maxsize else None
+    _item_refs = LRUCache(maxsize=maxsize) if maxsize else None
+
+
+def clear_identity_caches():
+    for cache in (_store_ids, _item_refs):
+        if cache is not None:
+            cache.clear()
+
+
+def identity_cache_stats():
+    """counters of the store & item identity caches, eg their hit_rate"""
+    if _store_ids is None:
+        return {"enabled": False}
+    return {"enabled": True, "stores": _store_ids.stats(), "items": _item_refs.stats()}
+
+
+def _insert_warranties(rows):
+    """insert warranty rows, skipping any which already exist"""
+    if rows:
+        _execute(INSERT_WARRANTY, rows)
+
+
+def warranty(item_cost, item_sku, item_title, item_type, store_uuid):
+    """quote warranties available for item & ensure they are stored
+
+    item & store are upserted and warranties inserted in a single
+    transaction; repeating the same request does not create new rows"""
+    log.debug("warranty args: %s", locals())
+    (record, constraints) = quote(item_cost, item_sku, item_title, item_type, store_uuid)
+    log.debug("found constraints: %s", constraints)
+    return persist_quotes([(record, constraints)])[0]
+
+
+def warranty_batch(records):
+    """quote & persist warranties for many records in a single transaction
+
+    records is a list of dicts having the same keys as the args to warranty()
+
+    constraints are queried once for all item_types in the batch, items and
+    stores are upserted in bulk, and all warranty rows are inserted in one
+    transaction.  Returns a list of results in the same order as records,
+    each either {"warranties": [...]} or {"status": "<error message>"}
+    """
+    if not isinstance(records, list):
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["batch req"])
+    log.debug("warranty_batch: %s records", len(records))
+
+    results = [None] * len(records)
+    valid = []
+    for (idx, record) in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise WarrantyRuntimeError(WARRANTY_ERRORS["batch req"])
+            valid.append((idx, validate_record(record)))
+        except WarrantyRuntimeError as ex:
+            results[idx] = {"status": str(ex)}
+
+    index = constraint_index()
+
+    # match each record against constraints for its item_type
+    eligible = []
+    for (idx, rec) in valid:
+        matches = index.match(rec["item_type"], rec["item_cost"])
+        if matches:
+            eligible.append((idx, rec, matches))
+        else:
+            results[idx] = {"status": WARRANTY_ERRORS["no crit"]}
+
+    quoted = persist_quotes([(rec, matches) for (idx, rec, matches) in eligible])
+    for ((idx, rec, matches), warranties) in zip(eligible, quoted):
+        results[idx] = {"warranties": warranties}
+    return results
+
+
+def quote(item_cost, item_sku, item_title, item_type, store_uuid):
+    """validate a warranty() request & match it against the constraints,
+    without writing anything
+
+    returns (record, constraints), see persist_quotes()"""
+    record = validate_record({"item_cost": item_cost, "item_sku": item_sku,
+                               "item_title": item_title, "item_type": item_type,
+                               "store_uuid": store_uuid})
+    constraints = constraint_index().match(record["item_type"], record["item_cost"])
     if not constraints:
         raise WarrantyRuntimeError(WARRANTY_ERRORS["no crit"])
+    return (record, constraints)
+
+
+def persist_quotes(quotes):
+    """upsert the items & stores of quotes, a list of quote() results, and
+    insert their warranties, in a single transaction
+
+    returns the warranties of each quote, in order"""
+    # last record wins when the same item appears more than once in a batch
+    items = collections.OrderedDict()
+    store_uuids = []
+    for (rec, matches) in quotes:
+        items[(rec["item_type"], rec["item_sku"])] = (rec["item_cost"], rec["item_title"])
+        store_uuids.append(rec["store_uuid"])
+    store_uuids = list(collections.OrderedDict.fromkeys(store_uuids))
+
+    try:
+        item_refs = _upsert_items(items)
+        store_ids = _upsert_stores(store_uuids)
+
+        ret = []
+        rows = []
+        written = []
+        for (rec, matches) in quotes:
+            item_ref = item_refs[(rec["item_type"], rec["item_sku"])]
+            written.append((rec["item_type"], rec["item_sku"], item_ref.item_uuid,
+                            rec["store_uuid"]))
+            warranties = []
+            for c in matches:
+                warranties.append({
+                    "item_id": item_ref.item_id,
+                    "store_id": store_ids[rec["store_uuid"]],
+                    "warranty_price": c["warranty_price"],
+                    "warranty_duration_months": c["warranty_duration_months"],
+                })
+            rows.extend(warranties)
+            ret.append(warranties)
+
+        _insert_warranties(rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        forget_identities(items, store_uuids)
+        raise
+
+    cache_identities(item_refs, store_ids)
+    _invalidate_warranty_cache(written)
+    return ret
 
-    # Item has a UNIQUE constraint on (item_type, item_sku)
-    wheres = [
-        Item.item_type == item_type,
-        Item.item_sku == item_sku,
-    ]
-    item = Item.query.filter(*wheres).first()
-    if not item:
-        item = Item(item_sku=item_sku, item_type=item_type)
-    item.item_cost = item_cost
-    item.item_title = item_title
-    db.session.add(item)
-
-    store = Store.query.filter(Store.store_uuid==store_uuid).first()
-    if not store:
-        store = Store(store_uuid=store_uuid, store_name=create_store_name())
-    db.session.add(store)
-
-    # commit any changes to db, generate pk ids
-    db.session.commit()
 
-    # for each warranty available for item, ensure row exists
-    warranties = []
-    for avail_warranty in constraints:
-        attrs = {
-            "item_id": item.item_id,
-            "store_id": store.store_id,
-            "warranty_price": avail_warranty["warranty_price"],
-            "warranty_duration_months": avail_warranty["warranty_duration_months"],
-        }
-        warranties.append(attrs)
-        warranty = Warranty(**attrs)
-        db.session.add(warranty)
+def warranty_write_behind(item_cost, item_sku, item_title, item_type, store_uuid):
+    """as warranty(), but returns the warranties once quoted, leaving them to
+    be written by the write-behind queue (see configure_write_behind())
 
-    db.session.commit()
-    return warranties
+    the request is validated as fully as warranty() would, so that what
+    is queued can be written; should a batch still fail, its quotes are
+    retried one at a time & only those failing again are dropped.
+    item_id & store_id are not known until written, so are not returned.
+    Raises queue.Full if the queue stays full for WRITE_BEHIND_PUT_TIMEOUT"""
+    (record, constraints) = quote(item_cost, item_sku, item_title, item_type, store_uuid)
+    _quote_writer.put((record, constraints))
+    return _offers(constraints)
 
 
-def get_warranties(item_type="", item_sku="", item_uuid="", store_uuid=""):
-    log.debug("get_warranties: {}".format(locals()))
-    if not any([item_type, item_sku, item_uuid, store_uuid]):
+def _write_quotes(context, quotes):
+    with context():
+        persist_quotes(quotes)
+
+
+def configure_write_behind(enabled=False, context=contextlib.nullcontext, **writer_kwargs):
+    """write quotes made by warranty_write_behind() from a background
+    thread, coalesced into one transaction per batch; writer_kwargs are
+    those of morus.writebehind.BatchWriter
+
+    context() is entered around each batch, eg app.app_context, which
+    removes the thread's session when it ends.  Quotes still queued are
+    written when reconfigured, by close_write_behind(), or at exit"""
+    global _quote_writer
+    close_write_behind()
+    if enabled:
+        _quote_writer = BatchWriter(functools.partial(_write_quotes, context),
+                                    name="pplans-quote-writer", **writer_kwargs)
+
+
+def write_behind_enabled():
+    return _quote_writer is not None
+
+
+def close_write_behind(timeout=EXIT_TIMEOUT):
+    """write the quotes queued, eg before a worker exits; returns False if
+    some were not written within timeout seconds"""
+    global _quote_writer
+    (writer, _quote_writer) = (_quote_writer, None)
+    if writer is None:
+        return True
+    return writer.close(timeout)
+
+
+def flush_write_behind(timeout=None):
+    """wait until the quotes queued so far are written"""
+    if _quote_writer is None:
+        return True
+    return _quote_writer.flush(timeout)
+
+
+def write_behind_stats():
+    """durability counters of the write-behind queue: quotes put, written,
+    failed (dropped after retries), rejected (queue full), & how long they
+    were queued for"""
+    if _quote_writer is None:
+        return {"enabled": False}
+    return dict(_quote_writer.stats(), enabled=True)
+
+
+def _lookup_params(item_type="", item_sku="", item_uuid="", store_uuid=""):
+    """bind parameters for pplans.statements.lookup_statement(), of the
+    filters given"""
+    params = {"item_type": item_type, "item_sku": item_sku,
+              "item_uuid": item_uuid, "store_uuid": store_uuid}
+    params = {name: value for (name, value) in params.items() if value}
+    if not params:
         raise WarrantyRuntimeError(WARRANTY_ERRORS["filter req"])
+    return params
+
+
+def _lookup_warranties(params, after=None, limit=None, **options):
+    """execute the lookup statement for params, ordered by warranty_id
+
+    only the columns needed are selected: rows are plain tuples, no
+    Warranty, Item or Store objects are hydrated or added to the identity map"""
+    stmt = lookup_statement(params, after=after is not None, paged=limit is not None)
+    params = dict(params)
+    if after is not None:
+        params["after"] = after
+    if limit is not None:
+        params["limit"] = limit
+    return _execute(stmt, params, **options)
+
+
+def _warranty_dict(rec):
+    return {
+        "item_sku": rec.item_sku,
+        "item_type": rec.item_type.value,
+        "item_uuid": rec.item_uuid,
+        "store_uuid": rec.store_uuid,
+        "warranty_price": str(rec.warranty_price),
+        "warranty_duration_months": rec.warranty_duration_months,
+    }
+
+
+def encode_cursor(warranty_id):
+    """opaque pagination token for the page following warranty_id"""
+    token = json.dumps({"after": warranty_id}).encode("utf8")
+    return base64.urlsafe_b64encode(token).decode("ascii")
 
-    wheres = []
-    if item_type:
-        wheres.append(Item.item_type == item_type)
-    if item_uuid:
-        wheres.append(Item.item_uuid == item_uuid)
-    if item_sku:
-        wheres.append(Item.item_sku == item_sku)
-    if store_uuid:
-        wheres.append(Store.store_uuid == store_uuid)
-
-    rs = Warranty.query.join(Warranty.item).join(Warranty.store).filter(*wheres).all()
-    log.debug("get_warranties: {}".format(rs))
-
-    ret = []
-    for rec in rs:
-        ret.append({
-            "item_sku": rec.item.item_sku,
-            "item_type": rec.item.item_type.value,
-            "item_uuid": rec.item.item_uuid,
-            "store_uuid": rec.store.store_uuid,
-            "warranty_price": str(rec.warranty_price),
-            "warranty_duration_months": rec.warranty_duration_months,
-        })
-    return ret
+
+def decode_cursor(cursor):
+    """warranty_id from a token created by encode_cursor()"""
+    try:
+        warranty_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))["after"]
+    except (ValueError, TypeError, KeyError, UnicodeError, binascii.Error):
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad cursor"].format(cursor))
+    if not isinstance(warranty_id, int):
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad cursor"].format(cursor))
+    return warranty_id
+
+
+def _normalize_uuid(value):
+    if not value:
+        return None
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return value
+
+
+def _warranty_cache_key(item_type, item_sku, item_uuid, store_uuid, *extra):
+    """cache key; first 4 elements are the filters, None if not filtered on"""
+    return (item_type or None, item_sku or None, _normalize_uuid(item_uuid),
+            _normalize_uuid(store_uuid)) + extra
+
+
+def _invalidate_warranty_cache(written):
+    """drop cached results which may include any of the written warranties,
+    a list of (item_type, item_sku, item_uuid, store_uuid)
+
+    an entry is dropped if each of its filters matches some written value
+    (exact for a single write, conservative for batches)"""
+    if _warranty_cache is None or not written:
+        return
+    written_values = [{w[i] for w in written} for i in range(4)]
+
+    def touches(key):
+        return all(value is None or value in values
+                   for (value, values) in zip(key[:4], written_values))
+
+    count = _warranty_cache.invalidate(touches)
+    log.debug("_invalidate_warranty_cache: dropped %s entries", count)
+
+
+def configure_warranty_cache(maxsize=0, ttl=None):
+    """cache up to maxsize get_warranties() results, for at most ttl seconds
+    each (forever if None); maxsize=0 disables the cache
+
+    the cache is per-process: writes via warranty() invalidate entries in
+    the writing process only, so ttl bounds staleness of other processes"""
+    global _warranty_cache
+    _warranty_cache = LRUCache(maxsize=maxsize, ttl=ttl) if maxsize else None
+
+
+def warranty_cache_stats():
+    if _warranty_cache is None:
+        return {"enabled": False}
+    return dict(_warranty_cache.stats(), enabled=True)
+
+
+def _cached(key, loader):
+    if _warranty_cache is None:
+        return loader()
+    return _warranty_cache.get_or_load(key, loader)
+
+
+def get_warranties(item_type="", item_sku="", item_uuid="", store_uuid=""):
+    log.debug("get_warranties: %s", locals())
+    params = _lookup_params(item_type, item_sku, item_uuid, store_uuid)
+
+    def load():
+        rs = _lookup_warranties(params).fetchall()
+        log.debug("get_warranties: %s", rs)
+        return [_warranty_dict(rec) for rec in rs]
+
+    return _cached(_warranty_cache_key(item_type, item_sku, item_uuid, store_uuid), load)
+
+
+def get_warranties_page(item_type="", item_sku="", item_uuid="", store_uuid="",
+                        limit=DEFAULT_PAGE_LIMIT, cursor=None):
+    """one page of get_warranties() results, using keyset pagination on
+    warranty_id
+
+    returns {"warranties": [...], "next": cursor}, where cursor is None on
+    the last page, and is otherwise passed back in to fetch the next page
+    """
+    log.debug("get_warranties_page: %s", locals())
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad limit"].format(limit))
+    if not 0 < limit <= MAX_PAGE_LIMIT:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad limit"].format(limit))
+
+    params = _lookup_params(item_type, item_sku, item_uuid, store_uuid)
+    after = decode_cursor(cursor) if cursor else None
+
+    def load():
+        # fetch one extra row to learn whether there is a next page
+        rs = _lookup_warranties(params, after=after, limit=limit + 1).fetchall()
+
+        next_cursor = None
+        if len(rs) > limit:
+            rs = rs[:limit]
+            next_cursor = encode_cursor(rs[-1].warranty_id)
+        return {"warranties": [_warranty_dict(rec) for rec in rs], "next": next_cursor}
+
+    key = _warranty_cache_key(item_type, item_sku, item_uuid, store_uuid, limit, after)
+    return _cached(key, load)
+
+
+def iter_warranties(item_type="", item_sku="", item_uuid="", store_uuid="", cursor=None):
+    """generator of get_warranties() results, streamed from a server-side
+    cursor STREAM_BATCH_SIZE rows at a time so memory use is bounded
+
+    filters are validated when called, rather than on first iteration"""
+    log.debug("iter_warranties: %s", locals())
+    params = _lookup_params(item_type, item_sku, item_uuid, store_uuid)
+    after = decode_cursor(cursor) if cursor else None
+
+    def _iter():
+        rs = _lookup_warranties(params, after=after, stream_results=True)
+        try:
+            while True:
+                rows = rs.fetchmany(STREAM_BATCH_SIZE)
+                if not rows:
+                    break
+                for rec in rows:
+                    yield _warranty_dict(rec)
+        finally:
+            rs.close()
+    return _iter()
+
+
+def _constraints_version():
+    return _execute(SELECT_CONSTRAINTS_VERSION).scalar()
+
+
+def _constraint_dict(rec):
+    return {
+        "constraint_id": rec.constraint_id,
+        "item_type": rec.item_type.value,
+        "min_cost": str(rec.min_cost),
+        "max_cost": str(rec.max_cost),
+        "warranty_price": str(rec.warranty_price),
+        "warranty_duration_months": rec.warranty_duration_months,
+    }
+
+
+def load_constraint_index():
+    """read all constraints from the db into a new ConstraintIndex"""
+    # read version before rows: a concurrent edit then causes a (harmless)
+    # extra rebuild, rather than stale rows being tagged with a new version
+    version = _constraints_version()
+    ret = [_constraint_dict(rec) for rec in _execute(SELECT_CONSTRAINTS)]
+    index = ConstraintIndex(ret, version=version)
+    log.debug("load_constraint_index: %s", index)
+    return index
+
+
+def constraint_index():
+    """returns current ConstraintIndex, rebuilding it if constraints_version
+    has changed since it was loaded (checked at most once per
+    CONSTRAINT_INDEX_POLL_SECONDS)
+
+    when refreshed in the background, returns the last snapshot without
+    touching the db, only checking inline if there is none yet or after
+    invalidate_constraint_index()"""
+    global _constraint_index, _constraint_index_checked
+    if (_constraint_refresh_context is not None and _constraint_index
+            and _constraint_index_checked):
+        if _constraint_refresher is None:
+            _start_constraint_refresher()
+        return _constraint_index
+    now = time.monotonic()
+    if _constraint_index and now - _constraint_index_checked < CONSTRAINT_INDEX_POLL_SECONDS:
+        return _constraint_index
+    with _constraint_index_lock:
+        if _constraint_index and now - _constraint_index_checked < CONSTRAINT_INDEX_POLL_SECONDS:
+            return _constraint_index
+        if not _constraint_index or _constraints_version() != _constraint_index.version:
+            _constraint_index = load_constraint_index()
+        _constraint_index_checked = now
+    return _constraint_index
+
+
+def refresh_constraint_index():
+    """check constraints_version now & reload the index if it changed, eg
+    to load the snapshot at startup"""
+    global _constraint_index, _constraint_index_checked
+    with _constraint_index_lock:
+        if not _constraint_index or _constraints_version() != _constraint_index.version:
+            _constraint_index = load_constraint_index()
+        _constraint_index_checked = time.monotonic()
+    return _constraint_index
+
+
+def _refresh_constraints(stopped, context):
+    global _constraint_refresh_errors
+    while not stopped.wait(CONSTRAINT_INDEX_POLL_SECONDS):
+        try:
+            with context():
+                refresh_constraint_index()
+        except Exception:
+            # keep serving the last snapshot
+            _constraint_refresh_errors += 1
+            log.warning("refresh_constraint_index failed", exc_info=True)
+
+
+def _start_constraint_refresher():
+    global _constraint_refresher
+    with _constraint_index_lock:
+        if _constraint_refresher is not None:
+            return
+        stopped = threading.Event()
+        thread = threading.Thread(target=_refresh_constraints,
+                                  args=(stopped, _constraint_refresh_context),
+                                  name="pplans-constraint-refresher", daemon=True)
+        thread.start()
+        _constraint_refresher = (thread, stopped)
+
+
+def _stop_constraint_refresher():
+    global _constraint_refresher
+    (refresher, _constraint_refresher) = (_constraint_refresher, None)
+    if refresher is not None:
+        refresher[1].set()
+
+
+def _forget_constraint_refresher():
+    # threads do not survive fork(): each worker starts its own on first use
+    global _constraint_refresher
+    _constraint_refresher = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_constraint_refresher)
+
+
+def constraints_version():
+    """version stamp of the constraints get_constraints() currently matches
+    against; only touches the db when the index is due to be checked"""
+    return constraint_index().version
+
+
+def invalidate_constraint_index():
+    """force constraints_version to be checked on next use of the index"""
+    global _constraint_index_checked
+    _constraint_index_checked = 0.0
+
+
+def configure_constraint_index(poll_seconds=None, background=False, context=None):
+    """background=True checks constraints_version every poll_seconds from a
+    thread started (in each process) on first use, inside context(), eg
+    app.app_context, so that requests never wait on the db for constraints.
+    Edits are then seen up to poll_seconds late, and the last snapshot
+    loaded keeps being served while the db is unreachable, so poll_seconds
+    must be positive (0 checks on every use, when not in the background)"""
+    global CONSTRAINT_INDEX_POLL_SECONDS, _constraint_refresh_context
+    poll_seconds = CONSTRAINT_INDEX_POLL_SECONDS if poll_seconds is None else float(poll_seconds)
+    if background and poll_seconds <= 0:
+        raise ValueError("poll_seconds must be positive when refreshed in the background")
+    CONSTRAINT_INDEX_POLL_SECONDS = poll_seconds
+    _stop_constraint_refresher()
+    _constraint_refresh_context = (context or contextlib.nullcontext) if background else None
+    invalidate_constraint_index()
+
+
+def constraint_index_stats():
+    """version & age of the constraints snapshot served by this process"""
+    index = _constraint_index
+    return {
+        "version": index.version if index else None,
+        "constraints": len(index.constraints) if index else 0,
+        "background": _constraint_refresh_context is not None,
+        "checked_seconds_ago": (time.monotonic() - _constraint_index_checked
+                                if index and _constraint_index_checked else None),
+        "refresh_errors": _constraint_refresh_errors,
+    }
 
 
 def get_constraints(item_type="", item_cost=""):
-    log.debug("get_constraints: {}".format(locals()))
-
-    wheres = []
-    if item_type:
-        wheres.append(Constraint.item_type == item_type)
-    if item_cost:
-        wheres.extend([
-            Constraint.min_cost < item_cost,
-            Constraint.max_cost > item_cost,
-        ])
-    rs = Constraint.query.filter(*wheres).all()
-
-    ret = []
-    for rec in rs:
-        ret.append({
-            "constraint_id": rec.constraint_id,
-            "item_type": rec.item_type.value,
-            "min_cost": str(rec.min_cost),
-            "max_cost": str(rec.max_cost),
-            "warranty_price": str(rec.warranty_price),
-            "warranty_duration_months": rec.warranty_duration_months,
-        })
-    return ret
+    log.debug("get_constraints: %s", locals())
+    try:
+        return constraint_index().match(item_type, item_cost)
+    except ValueError:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad item_cost"].format(item_cost))
+
+
+def query_constraints(item_type, item_cost):
+    """as get_constraints(item_type, item_cost), but matched by the db (by
+    containment in cost_range) rather than the in-process index, eg for
+    constraint tables too large to hold in every process"""
+    log.debug("query_constraints: %s", locals())
+    try:
+        item_cost = to_cost(item_cost)
+    except ValueError:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad item_cost"].format(item_cost))
+    rs = _execute(MATCH_CONSTRAINTS, {"item_type": item_type, "item_cost": item_cost})
+    return [_constraint_dict(rec) for rec in rs]
+
+
+def _offers(constraints):
+    return [{"warranty_price": c["warranty_price"],
+             "warranty_duration_months": c["warranty_duration_months"]}
+            for c in constraints]
+
+
+def quote_warranties(item_type, item_cost):
+    """warranties an item of item_type & item_cost is eligible for, priced
+    from the constraint index without writing (or, when it is refreshed in
+    the background, reading) anything"""
+    log.debug("quote_warranties: %s", locals())
+    for (field, value) in (("item_type", item_type), ("item_cost", item_cost)):
+        if not value:
+            raise WarrantyRuntimeError(WARRANTY_ERRORS["missing field"].format(field))
+    if item_type not in ItemType.__members__:
+        raise WarrantyRuntimeError(WARRANTY_ERRORS["bad item_type"].format(item_type))
+    return _offers(get_constraints(item_type, item_cost))
+
+
+def price_items(item_types, item_costs):
+    """vectorized pricing of many items at once, eg for bulk re-pricing
+
+    item_types is a single item_type or a sequence parallel to item_costs;
+    returns pplans.pricing.BulkPricing (requires numpy), see
+    ConstraintArrays.eligibility() for the equivalent boolean matrix
+    """
+    log.debug("price_items: %s items", len(item_costs))
+    return constraint_index().arrays().price(item_types, item_costs)
 
 
 def create_demo_data():
@@ -167,6 +914,7 @@ def create_demo_data():
 
     # commit to generate ids
     db.session.commit()
+    invalidate_constraint_index()
 
     item_one_id = created["items"][0].item_id
     item_two_id = created["items"][1].item_id
@@ -190,5 +938,8 @@ def create_demo_data():
         created["warranties"].append(w)
 
     db.session.commit()
+    if _warranty_cache is not None:
+        _warranty_cache.clear()
+    clear_identity_caches()
     return created
 
@@ -4,10 +4,15 @@ import os
 
 # distutils does not support "python setup.py develop"
 #from distutils.core import setup
-from setuptools import setup
+from setuptools import Command, setup
 
 import morus
-from morus.setuptools.commands import COMMANDS, NoseTestCommand
+from morus.setuptools.commands import (
+    COMMANDS,
+    BenchmarkCommand,
+    ImportTimeCommand,
+    NoseTestCommand,
+)
 
 
 log = logging.getLogger("setup")
@@ -50,11 +55,145 @@ class MulberryDemoIntegrationTestCommand(MulberryDemoNoseTestCommand):
     integration tests actually spin up a server to serve API endpoints, create
     database, fixture data, the whole works
     """
+    user_options = MulberryDemoNoseTestCommand.user_options + [
+        ("processes=", None, "Number of test processes, each on a db of its own "
+                             "(default 1)"),
+    ]
+
     nose_opts = MulberryDemoNoseTestCommand.nose_opts + [
         "./pplans/test/integration",
     ]
+
+    def initialize_options(self):
+        super(MulberryDemoIntegrationTestCommand, self).initialize_options()
+        self.processes = None
+
+    def run_tests(self):
+        if self.processes:
+            # coverage is not collected across nose's worker processes
+            self.nose_opts = [opt for opt in self.nose_opts if "cover" not in opt] + [
+                "--processes={}".format(int(self.processes)),
+                "--process-timeout=600",
+            ]
+        super(MulberryDemoIntegrationTestCommand, self).run_tests()
 COMMANDS["integration"] = MulberryDemoIntegrationTestCommand
 
+class PplansBenchmarkCommand(BenchmarkCommand):
+    """setup.py "benchmark" subcommand
+
+    times pplans.warranty at each --scales number of warranties, see
+    pplans/benchmarks/warranty.py; the db at --dsn is recreated for each
+    """
+    suite = "pplans.benchmarks.warranty"
+    default_baseline = "pplans/benchmarks/baseline.json"
+COMMANDS["benchmark"] = PplansBenchmarkCommand
+
+class PplansImportTimeCommand(ImportTimeCommand):
+    """setup.py "importtime" subcommand
+
+    reports what importing pplans.flask.app spends its time on, & fails if
+    the cold start of configured_app() exceeds its budget, see
+    pplans/benchmarks/startup.py
+    """
+    suite = "pplans.benchmarks.startup"
+COMMANDS["importtime"] = PplansImportTimeCommand
+
+class PplansDatagenCommand(Command):
+    """setup.py "datagen" subcommand
+
+    loads synthetic items, stores & warranties into the db, see
+    pplans/datagen.py
+    """
+    description = "load synthetic data at scale with COPY"
+
+    user_options = [
+        ("dsn=", None, "DSN of database to load"),
+        ("warranties=", None, "about how many warranties, sets --items & --stores"),
+        ("items=", None, "items to generate (default 1000)"),
+        ("stores=", None, "stores to generate (default 100)"),
+        ("quotes-per-item=", None, "mean number of stores quoting each item (default 3)"),
+        ("skew=", None, "Zipf exponent of SKU popularity (default 1.1)"),
+        ("seed=", None, "random seed (default 0)"),
+        ("recreate", None, "drop & recreate tables first"),
+    ]
+    boolean_options = ["recreate"]
+
+    def initialize_options(self):
+        for (option, short, help) in self.user_options:
+            setattr(self, option.rstrip("=").replace("-", "_"), None)
+        self.recreate = False
+
+    def finalize_options(self):
+        if not self.dsn:
+            raise ValueError("dsn is required")
+
+    def run(self):
+        from pplans import datagen
+
+        argv = []
+        for (option, short, help) in self.user_options:
+            value = getattr(self, option.rstrip("=").replace("-", "_"))
+            if option.endswith("=") and value is not None:
+                argv += ["--" + option.rstrip("="), str(value)]
+        if self.recreate:
+            argv.append("--recreate")
+        datagen.main(argv)
+COMMANDS["datagen"] = PplansDatagenCommand
+
+class PplansLookupsCommand(Command):
+    """setup.py "lookups" subcommand
+
+    rebuilds the warranty_lookups read model, see pplans/lookups.py
+    """
+    description = "rebuild (or backfill) the warranty_lookups table"
+
+    user_options = [
+        ("dsn=", None, "DSN of database to rebuild"),
+        ("missing", None, "only insert rows for warranties without one"),
+    ]
+    boolean_options = ["missing"]
+
+    def initialize_options(self):
+        self.dsn = None
+        self.missing = False
+
+    def finalize_options(self):
+        if not self.dsn:
+            raise ValueError("dsn is required")
+
+    def run(self):
+        from pplans import lookups
+
+        argv = ["--dsn", self.dsn]
+        if self.missing:
+            argv.append("--missing")
+        lookups.main(argv)
+COMMANDS["lookups"] = PplansLookupsCommand
+
+class PplansMigrateCommand(Command):
+    """setup.py "migrate" subcommand
+
+    updates the schema of an existing db, see pplans/migrate.py
+    """
+    description = "bring an existing db's schema up to date"
+
+    user_options = [
+        ("dsn=", None, "DSN of database to migrate"),
+    ]
+
+    def initialize_options(self):
+        self.dsn = None
+
+    def finalize_options(self):
+        if not self.dsn:
+            raise ValueError("dsn is required")
+
+    def run(self):
+        from pplans import migrate
+
+        migrate.main(["--dsn", self.dsn])
+COMMANDS["migrate"] = PplansMigrateCommand
+
 
 with open("README.md", "r") as fh:
     long_description = fh.read()
@@ -83,12 +222,19 @@ setup(
     description = "Mulberry Payment Plans Service",
     long_description = long_description,
     long_description_content_type = "text/markdown",
-    packages = ["pplans", "pplans.flask", "pplans.test"],
+    package_data = {"pplans.benchmarks": ["baseline.json"]},
+    packages = ["pplans", "pplans.asgi", "pplans.benchmarks", "pplans.flask", "pplans.test"],
     license = "Proprietary",
     author = "Kenneth Dombrowski",
     author_email = "kdombrowski@gmail.com",
     setup_requires = setup_requires,
     install_requires = install_requires,
+    extras_require = {
+        # pplans.pricing.ConstraintArrays, for vectorized bulk pricing
+        "bulk": ["numpy"],
+        # pplans.aio & pplans.asgi, serve with any ASGI server
+        "async": ["asyncpg", "uvicorn"],
+    },
     #tests_require = tests_require,
     dependency_links = dependency_links,
     cmdclass = COMMANDS,